@@ -23,6 +23,9 @@ def init_app():
     db.init_app(app)
     login.init_app(app)
     
+    from backend.utils import structured_logging
+    structured_logging.init_app(app)
+    
     with app.app_context():
         # Import models to ensure they are registered with SQLAlchemy
         from backend.models.user import User
@@ -32,8 +35,10 @@ def init_app():
         
         # Models are already initialized with db
         
-        # Create database tables
-        db.create_all()
+        # The schema belongs to migrations (`flask db upgrade`); cold starts skip it
+        # unless MIGRATE_ON_STARTUP is set
+        from backend.utils import migrations
+        migrations.init_app(app)
         
         # Register blueprints
         from backend.routes.auth import bp as auth_bp
@@ -48,8 +53,18 @@ def init_app():
         app.register_blueprint(main_bp)
         
         # User loader for Flask-Login
-        @login.user_loader
-        def load_user(user_id):
-            return User.query.get(int(user_id))
+        from backend.utils import user_cache
+        user_cache.init_app(app)
+        login.user_loader(user_cache.load_user)
+        from backend.utils import trip_access
+        trip_access.init_app(app)
+        from backend.utils import optimistic
+        optimistic.init_app(app)
+        from backend.utils import idempotency
+        idempotency.init_app(app)
+        from backend.utils import change_log
+        change_log.init_app(app)
+        from backend.utils import live_updates
+        live_updates.init_app(app)
         
         return app
\ No newline at end of file
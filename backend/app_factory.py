@@ -5,24 +5,74 @@ from backend.database import db
 from backend.models.user import User
 from datetime import date, timedelta
 
-def create_app():
+def create_app(config=None):
     app = Flask(__name__)
     
-    # Load configuration
+    # Load configuration, then any overrides (tests and benchmarks pass their database here)
     app.config.from_object('backend.config.Config')
+    if config:
+        app.config.update(config)
     
-    # Initialize extensions
+    # Initialize extensions; engine options must be set before the engine is created
+    from backend.utils import engine_config, read_replica, sqlite_mode
+    engine_config.init_app(app)
+    read_replica.init_app(app)
+    sqlite_mode.init_app(app)
     db.init_app(app)
     
+    from backend.utils import migrations
+    migrations.init_app(app)
+    
+    # Logging first so every later hook sees the request id
+    from backend.utils import structured_logging
+    structured_logging.init_app(app)
+    
+    # Opt-in per-request SQL instrumentation, metrics and profiling; the profiler
+    # (and pstats) is only imported when enabled to keep cold starts short
+    from backend.utils import sql_instrumentation, metrics, memory_profiling
+    sql_instrumentation.init_app(app)
+    metrics.init_app(app)
+    memory_profiling.init_app(app)
+    if app.config['PROFILING_ENABLED']:
+        from backend.utils import profiler
+        profiler.init_app(app)
+    
+    from backend.utils import template_cache
+    template_cache.init_app(app)
+    
+    # Every process invalidates cached PDFs on commit, including ones that never render a PDF
+    from backend.utils import pdf_cache  # noqa: F401
+    
     # Initialize Flask-Login
     login_manager = LoginManager()
     login_manager.init_app(app)
     login_manager.login_view = 'auth.login'
     login_manager.login_message = 'Please log in to access this page.'
     
-    @login_manager.user_loader
-    def load_user(user_id):
-        return User.query.get(int(user_id))
+    # Users are served from a short-lived cache; last_seen is written behind in batches
+    from backend.utils import user_cache
+    user_cache.init_app(app)
+    login_manager.user_loader(user_cache.load_user)
+    
+    # Trip access checks read the trip_member index through a per-request and TTL cache
+    from backend.utils import trip_access
+    trip_access.init_app(app)
+    
+    # Version conflicts on trips and expenses are retried or answered with 409
+    from backend.utils import optimistic
+    optimistic.init_app(app)
+    
+    # Retried creates with the same idempotency key replay the first response
+    from backend.utils import idempotency
+    idempotency.init_app(app)
+    
+    # Change log of trips, expenses and participants behind the delta sync API
+    from backend.utils import change_log
+    change_log.init_app(app)
+    
+    # Broker and publisher of the live trip update streams
+    from backend.utils import live_updates
+    live_updates.init_app(app)
     
     # Register template filter for trip time labels
     @app.template_filter('trip_time_label')
@@ -61,10 +111,18 @@ def create_app():
     from backend.routes.main import bp as main_bp
     from backend.routes.trips import trips_bp
     from backend.routes.expenses import bp as expenses_bp
-    
+    from backend.routes.exports import bp as exports_bp
+    from backend.routes.jobs import bp as jobs_bp
+    from backend.routes.metrics import bp as metrics_bp
+    from backend.routes.sync_api import bp as sync_api_bp
+
     app.register_blueprint(auth_bp)
     app.register_blueprint(main_bp)
     app.register_blueprint(trips_bp, url_prefix='/trips')
     app.register_blueprint(expenses_bp, url_prefix='/expenses')
+    app.register_blueprint(exports_bp, url_prefix='/exports')
+    app.register_blueprint(jobs_bp, url_prefix='/jobs')
+    app.register_blueprint(metrics_bp)
+    app.register_blueprint(sync_api_bp, url_prefix='/api/v1')
     
     return app
\ No newline at end of file
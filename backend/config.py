@@ -1,3 +1,4 @@
+import json
 import os
 from datetime import timedelta
 
@@ -9,9 +10,146 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///app.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Engine and pool settings; pool sizing applies to server databases such as Postgres
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    # Seconds to wait for a free pooled connection
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+    # Seconds after which connections are replaced, below server or proxy idle timeouts; 0 disables
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'True').lower() in ('true', '1', 't')
+    # Server-side limit per SQL statement in milliseconds (Postgres and MySQL); 0 disables
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+    
+    # Read replica for the dashboard, chart API, settlement and export reads; unset reads from the primary
+    READ_REPLICA_URL = os.environ.get('READ_REPLICA_URL')
+    # Endpoints whose GET requests read from the replica, comma-separated
+    READ_REPLICA_ENDPOINTS = [
+        endpoint.strip() for endpoint in os.environ.get(
+            'READ_REPLICA_ENDPOINTS',
+            'main.dashboard,main.api_months_for_trip,main.api_all_months,main.api_spending_history,'
+            'main.api_dashboard_data,trips.view_settlements,exports.export_trip,exports.export_user,'
+            'exports.export_ledger'
+        ).split(',') if endpoint.strip()
+    ]
+    # Seconds a client reads from the primary after its own write, to cover replication lag
+    READ_REPLICA_PIN_SECONDS = float(os.environ.get('READ_REPLICA_PIN_SECONDS', 5))
+    
+    # SQLite production profile: WAL, synchronous=NORMAL, larger cache, mmap and write retries
+    SQLITE_PRODUCTION = os.environ.get('SQLITE_PRODUCTION', 'False').lower() in ('true', '1', 't')
+    # Milliseconds a connection waits for a competing writer before reporting "database is locked"
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 20000))
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    # Times a locked write is rolled back and run again, and the initial backoff in seconds
+    SQLITE_WRITE_RETRIES = int(os.environ.get('SQLITE_WRITE_RETRIES', 5))
+    SQLITE_WRITE_RETRY_DELAY = float(os.environ.get('SQLITE_WRITE_RETRY_DELAY', 0.05))
+    
+    # Versioned migrations (`flask db upgrade`) and online backfills (`flask db backfill NAME`)
+    MIGRATIONS_DIR = os.environ.get('MIGRATIONS_DIR')
+    # Rows per backfill batch, seconds to pause between batches, and the batch duration above
+    # which the batch size is halved
+    BACKFILL_BATCH_SIZE = int(os.environ.get('BACKFILL_BATCH_SIZE', 500))
+    BACKFILL_SLEEP = float(os.environ.get('BACKFILL_SLEEP', 0.1))
+    BACKFILL_MAX_BATCH_SECONDS = float(os.environ.get('BACKFILL_MAX_BATCH_SECONDS', 0.5))
+    
+    # Startup: apply pending migrations when the app starts (local development only; deployments
+    # run `flask db upgrade` instead so cold starts do no schema work)
+    MIGRATE_ON_STARTUP = os.environ.get('MIGRATE_ON_STARTUP', 'False').lower() in ('true', '1', 't')
+    # Directory of the Jinja bytecode cache, filled ahead of time with `flask templates compile`
+    TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR')
+    
+    # Seconds a logged-in user's row is cached per process; 0 loads it on every request
+    USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 60))
+    # last_seen is written at most once per user per interval, batched every flush interval (seconds)
+    LAST_SEEN_UPDATE_INTERVAL = float(os.environ.get('LAST_SEEN_UPDATE_INTERVAL', 300))
+    LAST_SEEN_FLUSH_INTERVAL = float(os.environ.get('LAST_SEEN_FLUSH_INTERVAL', 30))
+    # Seconds a user's trip memberships are cached per process for access checks; 0 disables
+    TRIP_ACCESS_TTL = float(os.environ.get('TRIP_ACCESS_TTL', 30))
+    # Times a commutative write (adding a payment, advance or participant) is retried after a version conflict
+    WRITE_CONFLICT_RETRIES = int(os.environ.get('WRITE_CONFLICT_RETRIES', 3))
+    # Seconds a stored idempotent response is replayed, and after which an unfinished claim can be taken over
+    IDEMPOTENCY_KEY_TTL = float(os.environ.get('IDEMPOTENCY_KEY_TTL', 86400))
+    IDEMPOTENCY_LOCK_TIMEOUT = float(os.environ.get('IDEMPOTENCY_LOCK_TIMEOUT', 60))
+    
+    # Delta sync (/api/v1/sync): change log rows per response, and how long a change
+    # is held back so concurrent writers commit first (only needed off SQLite)
+    SYNC_PAGE_SIZE = int(os.environ.get('SYNC_PAGE_SIZE', 500))
+    SYNC_SETTLE_SECONDS = float(os.environ.get('SYNC_SETTLE_SECONDS', 0))
+    
+    # Live trip updates (/trips/<id>/events): 'local' for a single worker, 'database' to share
+    # events between workers through the trip_event table, or 'package.module:BrokerClass'
+    LIVE_UPDATES_BROKER = os.environ.get('LIVE_UPDATES_BROKER', 'local')
+    # Seconds between keepalive comments, and after which a stream ends so the client reconnects
+    LIVE_UPDATES_KEEPALIVE = float(os.environ.get('LIVE_UPDATES_KEEPALIVE', 15))
+    LIVE_UPDATES_STREAM_TIMEOUT = float(os.environ.get('LIVE_UPDATES_STREAM_TIMEOUT', 300))
+    # Seconds between reads of the trip_event table, and how long events are kept for reconnects
+    LIVE_UPDATES_POLL_INTERVAL = float(os.environ.get('LIVE_UPDATES_POLL_INTERVAL', 1))
+    LIVE_UPDATES_RETENTION = float(os.environ.get('LIVE_UPDATES_RETENTION', 300))
+    
     # Session
     PERMANENT_SESSION_LIFETIME = timedelta(days=31)
     
+    # Directory for cached PDF reports (defaults to a folder in the system temp dir)
+    PDF_CACHE_DIR = os.environ.get('PDF_CACHE_DIR')
+    
+    # Full trip reports with at least this many expenses are rendered in a worker process pool
+    REPORT_ASYNC_THRESHOLD = int(os.environ.get('REPORT_ASYNC_THRESHOLD', 200))
+    REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', 2))
+    # Seconds after which an unfinished report render is considered dead
+    REPORT_RENDER_TIMEOUT = int(os.environ.get('REPORT_RENDER_TIMEOUT', 600))
+    
+    # Background jobs (run with `flask jobs work`)
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+    # Seconds before the first retry of a failed job; doubles on each further attempt
+    JOB_RETRY_DELAY = int(os.environ.get('JOB_RETRY_DELAY', 30))
+    # Seconds after which a running job is assumed to have lost its worker
+    JOB_TIMEOUT = int(os.environ.get('JOB_TIMEOUT', 900))
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 2))
+    
+    # Maximum number of trips recalculated concurrently by an account sync
+    SYNC_MAX_WORKERS = int(os.environ.get('SYNC_MAX_WORKERS', 4))
+    
+    # SQL instrumentation: per-request query counts, Server-Timing headers and N+1 warnings
+    SQL_INSTRUMENTATION = os.environ.get('SQL_INSTRUMENTATION', 'False').lower() in ('true', '1', 't')
+    # A statement run at least this many times with different parameters in one request is reported
+    SQL_N_PLUS_ONE_THRESHOLD = int(os.environ.get('SQL_N_PLUS_ONE_THRESHOLD', 5))
+    # Maximum queries per endpoint before a warning is logged, e.g. '{"trips.view_trip": 40}'
+    SQL_QUERY_BUDGETS = json.loads(os.environ.get('SQL_QUERY_BUDGETS', '{}'))
+    
+    # Prometheus-style /metrics endpoint; each worker process writes its metrics to METRICS_DIR
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'False').lower() in ('true', '1', 't')
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    # Seconds between writes of a process's metrics file
+    METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+    # When set, scrapers must send "Authorization: Bearer <token>"
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    
+    # Per-request profiling for admins via "X-Profile: cprofile|sample" or ?_profile=cprofile|sample
+    PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'False').lower() in ('true', '1', 't')
+    PROFILE_DIR = os.environ.get('PROFILE_DIR')
+    # Mode used when the flag is just "1"
+    PROFILE_DEFAULT_MODE = os.environ.get('PROFILE_DEFAULT_MODE', 'sample')
+    # Profiles allowed per process per minute, and profile files kept on disk
+    PROFILE_MAX_PER_MINUTE = int(os.environ.get('PROFILE_MAX_PER_MINUTE', 6))
+    PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 200))
+    # Sampling profiler: seconds between stack samples and maximum sampling time per request
+    PROFILE_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', 0.005))
+    PROFILE_MAX_DURATION = float(os.environ.get('PROFILE_MAX_DURATION', 30))
+    
+    # tracemalloc instrumentation of requests, ledger and PDF paths; admins read it at /metrics/memory
+    MEMORY_PROFILING = os.environ.get('MEMORY_PROFILING', 'False').lower() in ('true', '1', 't')
+    # Stack frames stored per allocation; more frames cost more memory and time
+    MEMORY_TRACE_FRAMES = int(os.environ.get('MEMORY_TRACE_FRAMES', 1))
+    # Fraction of requests and sections that also diff snapshots to find top allocation sites
+    MEMORY_SNAPSHOT_RATE = float(os.environ.get('MEMORY_SNAPSHOT_RATE', 0.1))
+    MEMORY_TOP_SITES = int(os.environ.get('MEMORY_TOP_SITES', 10))
+    
+    # Logging: level, "text" or "json" output, and the fraction of requests whose DEBUG records are kept
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+    LOG_DEBUG_SAMPLE_RATE = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', 1.0))
+    
     # Application settings
     DEFAULT_CURRENCY = 'INR'
     
@@ -1,4 +1,31 @@
-from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm
+
+# Callable (session, mapper, clause) returning an engine for a read, or None
+# for the default bind; installed by backend.utils.read_replica
+_read_router = None
+
+
+def set_read_router(router):
+    global _read_router
+    _read_router = router
+
+
+class RoutingSession(SignallingSession):
+    """Session that lets the read router pick the engine for statements outside a flush"""
+
+    def get_bind(self, mapper=None, clause=None):
+        if _read_router is not None and not self._flushing:
+            engine = _read_router(self, mapper, clause)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
 
 # Create the SQLAlchemy instance
-db = SQLAlchemy()
\ No newline at end of file
+db = RoutingSQLAlchemy()
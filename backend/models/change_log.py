@@ -0,0 +1,26 @@
+from datetime import datetime
+from backend.database import db
+
+class ChangeLog(db.Model):
+    """
+    One row written, in the same transaction, for every insert, update or
+    delete of a synced model. seq is the cursor of the delta sync API.
+    """
+    INSERT = 'insert'
+    UPDATE = 'update'
+    DELETE = 'delete'
+
+    # The log is written by a flush hook and must not log itself
+    __track_changes__ = False
+    __table_args__ = (db.Index('ix_change_log_trip_seq', 'trip_id', 'seq'),)
+
+    seq = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(50), nullable=False)
+    # Row id of the changed instance; the user id for trip_member rows
+    row_id = db.Column(db.Integer, nullable=False)
+    trip_id = db.Column(db.Integer, nullable=True)
+    op = db.Column(db.String(10), nullable=False)
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ChangeLog {self.seq} {self.op} {self.table_name} {self.row_id}>'
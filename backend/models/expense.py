@@ -1,7 +1,10 @@
 from datetime import datetime
 import json
+import logging
 from backend.database import db
 
+logger = logging.getLogger(__name__)
+
 class Expense(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     description = db.Column(db.String(200), nullable=False)
@@ -29,6 +32,11 @@ class Expense(db.Model):
     shares = db.Column(db.Text, nullable=False, default='{}')  # Shares for all participants
     items = db.Column(db.Text, nullable=True, default='[]')  # For itemized expenses and unregistered participants
     
+    # Row version for optimistic concurrency; every UPDATE checks and bumps it
+    # (see backend.utils.optimistic)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    __mapper_args__ = {'version_id_col': version}
+    
     def get_participants_list(self):
         """Convert JSON string to list of participant IDs"""
         return json.loads(self.participants)
@@ -92,7 +100,7 @@ class Expense(db.Model):
                     
             return []
         except Exception as e:
-            print(f"Error getting unregistered participants: {str(e)}")
+            logger.warning('Could not read unregistered participants of expense %s: %s', self.id, e)
             return []
     
     def calculate_equal_split(self, unregistered_participants=None):
@@ -102,20 +110,18 @@ class Expense(db.Model):
         # If unregistered_participants parameter is None, try to get it from the expense
         if unregistered_participants is None:
             unregistered_participants = self.get_unregistered_participants()
-            print(f"Retrieved {len(unregistered_participants)} unregistered participants from expense data")
         
         # Include unregistered participants in the calculation
         total_participants = len(participants)
         if unregistered_participants:
             total_participants += len(unregistered_participants)
-            print(f"Including {len(unregistered_participants)} unregistered participants in equal split")
         
         if total_participants == 0:
             return {}
         
         # Calculate equal share for each participant
         share = round(self.amount / total_participants, 2)
-        print(f"Equal share per participant: {share} (total participants: {total_participants})")
+        logger.debug('Expense %s: equal share %s across %d participants', self.id, share, total_participants)
         
         # Create shares dictionary for registered participants
         shares = {participant: share for participant in participants}
@@ -123,7 +129,6 @@ class Expense(db.Model):
         # Add shares for unregistered participants
         for name in unregistered_participants:
             shares[f'unregistered_{name}'] = share
-            print(f"Added share for unregistered participant: {name}")
         
         # Adjust for rounding errors
         total = sum(shares.values())
@@ -134,7 +139,7 @@ class Expense(db.Model):
             first_participant = next(iter(shares.keys()))
             diff = round(expected_total - total, 2)
             shares[first_participant] = round(shares[first_participant] + diff, 2)
-            print(f"Adjusted share for {first_participant} by {diff} to account for rounding")
+            logger.debug('Expense %s: rounding difference of %s added to the first share', self.id, diff)
         
         return shares
     
@@ -149,23 +154,22 @@ class Expense(db.Model):
         # Calculate total of registered participants' shares
         registered_total = sum(processed_shares.values())
         
-        # Log for debugging
-        print(f"Exact split - Registered total: {registered_total}, Expense amount: {self.amount}")
+        logger.debug('Expense %s: exact shares total %s of %s', self.id, registered_total, self.amount)
         
         # If the total doesn't match the expense amount and we have unregistered participants,
         # it's likely because the unregistered participants' shares aren't included in shares_input
         if abs(registered_total - self.amount) > 0.01 and unregistered_participants:
-            print(f"Exact split - Difference detected, likely due to unregistered participants")
+            logger.debug('Expense %s: exact share difference assigned to unregistered participants', self.id)
             # We don't need to raise an error as the unregistered participants' shares are stored separately
         elif abs(registered_total - self.amount) > 0.01:
             # If no unregistered participants, the totals should match
-            print(f"Exact split - Error: Sum of shares ({registered_total}) does not equal expense amount ({self.amount})")
+            logger.warning('Expense %s: exact shares total %s but amount is %s', self.id, registered_total, self.amount)
             # Adjust the first participant's share to make up the difference
             if processed_shares:
                 first_key = next(iter(processed_shares))
                 diff = round(self.amount - registered_total, 2)
                 processed_shares[first_key] = round(processed_shares[first_key] + diff, 2)
-                print(f"Exact split - Adjusted first participant's share by {diff}")
+                logger.debug('Expense %s: difference of %s added to the first share', self.id, diff)
         
         return processed_shares
     
@@ -185,8 +189,7 @@ class Expense(db.Model):
         #   ...
         # ]
         
-        print(f"Calculating itemized split with {len(items_input)} items")
-        print(f"Items data: {items_input}")
+        logger.debug('Expense %s: itemized split of %d items', self.id, len(items_input))
         
         # Initialize shares for all participants
         shares = {}
@@ -198,7 +201,7 @@ class Expense(db.Model):
             # Count total participants for this item (both registered and unregistered)
             total_item_participants = len(item_participants) + len(item_unregistered)
             if total_item_participants == 0:
-                print(f"Warning: Item '{item.get('name', 'unnamed')}' has no participants")
+                logger.warning('Expense %s: an item has no participants and was skipped', self.id)
                 continue
                 
             # Split item price equally among all item participants
@@ -232,9 +235,10 @@ class Expense(db.Model):
     def update_split(self, split_method, participants, shares_data=None, items_data=None, unregistered_participants=None):
         """Update the expense split based on the selected method"""
         try:
-            print(f"Updating split with method: {split_method}")
-            print(f"Participants: {participants}")
-            print(f"Unregistered participants: {unregistered_participants}")
+            logger.debug(
+                'Expense %s: %s split across %d registered and %d unregistered participants',
+                self.id, split_method, len(participants or ()), len(unregistered_participants or ())
+            )
             
             # Set the split method
             self.split_method = split_method
@@ -242,7 +246,6 @@ class Expense(db.Model):
             # Save the registered participants list
             if participants is not None:
                 self.set_participants_list(participants)
-                print(f"Set participants list: {self.participants}")
             
             # Store unregistered participants in the items field
             items_dict = {}
@@ -257,23 +260,20 @@ class Expense(db.Model):
                         # If existing items is a list and no new items data, preserve it as 'items'
                         items_dict['items'] = existing_items
                 except (json.JSONDecodeError, TypeError) as e:
-                    print(f"Error parsing existing items: {e}")
+                    logger.warning('Could not parse items of expense %s: %s', self.id, e)
                     # Initialize with empty dict if there's an error
                     items_dict = {}
             
             # Add unregistered participants to the items dictionary
             if unregistered_participants:
                 items_dict['unregistered_participants'] = unregistered_participants
-                print(f"Added unregistered participants to items dict: {unregistered_participants}")
             
             # If we have new items data, add it to the dictionary
             if items_data and isinstance(items_data, list):
                 items_dict['items'] = items_data
-                print(f"Added items data to items dict: {len(items_data)} items")
             
             # Save the updated items dictionary
             self.items = json.dumps(items_dict)
-            print(f"Updated items field: {self.items}")
             
             # Calculate shares based on split method
             if split_method == 'equal':
@@ -301,14 +301,29 @@ class Expense(db.Model):
             
             # Save the calculated shares
             self.set_shares(calculated_shares)
-            print(f"Set shares: {self.shares}")
             
             return calculated_shares
         except Exception as e:
-            import traceback
-            print(f"Error in update_split: {str(e)}")
-            traceback.print_exc()
+            logger.exception('Error updating split of expense %s', self.id)
             raise
     
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'trip_id': self.trip_id,
+            'description': self.description,
+            'amount': self.amount,
+            'currency': self.currency,
+            'category': self.category,
+            'date': self.date.isoformat() if self.date else None,
+            'split_method': self.split_method,
+            'payer_id': self.payer_id,
+            'participants': self.get_participants_list(),
+            'shares': self.get_shares(),
+            'items': json.loads(self.items) if self.items else [],
+            'version': self.version,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+    
     def __repr__(self):
         return f'<Expense {self.description}: {self.currency} {self.amount}>'
@@ -0,0 +1,30 @@
+from datetime import datetime
+from backend.database import db
+
+class IdempotencyKey(db.Model):
+    """The stored outcome of a POST sent with an idempotency key, replayed when the client retries it"""
+    IN_PROGRESS = 'in_progress'
+    COMPLETED = 'completed'
+
+    # Request bookkeeping is not a change to trip data
+    __track_changes__ = False
+    __table_args__ = (db.UniqueConstraint('user_id', 'key', name='uq_idempotency_key_user_key'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(100), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    endpoint = db.Column(db.String(100), nullable=False)
+    # Hash of the request body; the same key with a different body is rejected
+    fingerprint = db.Column(db.String(64), nullable=False)
+
+    status = db.Column(db.String(20), nullable=False, default=IN_PROGRESS)
+    response_status = db.Column(db.Integer, nullable=True)
+    response_location = db.Column(db.Text, nullable=True)
+    response_mimetype = db.Column(db.String(100), nullable=True)
+    response_body = db.Column(db.LargeBinary, nullable=True)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<IdempotencyKey {self.key} user={self.user_id} {self.status}>'
@@ -0,0 +1,72 @@
+from datetime import datetime
+import json
+from backend.database import db
+
+class Job(db.Model):
+    """A unit of background work picked up by `flask jobs work` worker processes"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+    # Job bookkeeping is not a change to trip data
+    __track_changes__ = False
+
+    id = db.Column(db.Integer, primary_key=True)
+    job_type = db.Column(db.String(50), nullable=False, index=True)
+    trip_id = db.Column(db.Integer, db.ForeignKey('trip.id'), nullable=True, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    payload_json = db.Column(db.Text, default=json.dumps({}))
+
+    status = db.Column(db.String(20), nullable=False, default=QUEUED, index=True)
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    message = db.Column(db.Text, nullable=True)
+    result_json = db.Column(db.Text, nullable=True)
+
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_after = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    # Set to "<job_type>:<trip_id>" while the job is queued or running so the same
+    # work cannot be queued twice; cleared once the job finishes
+    dedup_key = db.Column(db.String(200), unique=True, nullable=True)
+
+    worker_id = db.Column(db.String(100), nullable=True)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def get_payload(self):
+        """Get the job arguments as a dictionary"""
+        if not self.payload_json:
+            return {}
+        return json.loads(self.payload_json)
+
+    def get_result(self):
+        """Get the job result, or None if the job has not produced one"""
+        if not self.result_json:
+            return None
+        return json.loads(self.result_json)
+
+    def is_finished(self):
+        return self.status in (self.SUCCEEDED, self.FAILED)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'job_type': self.job_type,
+            'trip_id': self.trip_id,
+            'status': self.status,
+            'progress': self.progress,
+            'message': self.message,
+            'result': self.get_result(),
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.job_type} {self.status}>'
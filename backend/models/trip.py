@@ -1,7 +1,15 @@
 from datetime import datetime
+import hashlib
 import json
+import logging
+from sqlalchemy import event, inspect
 from backend.database import db
+from backend.models.trip_member import TripMember
 from backend.models.unregistered_participant import UnregisteredParticipant
+from backend.utils.ledger import settle_balances
+from backend.utils import metrics, memory_profiling
+
+logger = logging.getLogger(__name__)
 
 class Trip(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -35,8 +43,15 @@ class Trip(db.Model):
     # }, ...]
     general_payments_json = db.Column(db.Text, default=json.dumps([]))
     
+    # Row version for optimistic concurrency; every UPDATE checks and bumps it
+    # (see backend.utils.optimistic)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    __mapper_args__ = {'version_id_col': version}
+    
     # Relationships
     expenses = db.relationship('Expense', backref='trip', lazy='dynamic', cascade='all, delete-orphan')
+    # Access index derived from admin_id and participants; see sync_members()
+    members = db.relationship('TripMember', cascade='all, delete-orphan')
     
     def get_participants_list(self):
         """Convert JSON string to list of participant IDs"""
@@ -59,22 +74,44 @@ class Trip(db.Model):
         """Convert a stored lowercase name to title case for display"""
         return name.title()
     
+    def get_member_roles(self):
+        """{user_id: role} of every registered user with access to the trip"""
+        roles = {}
+        if self.admin_id is not None:
+            roles[int(self.admin_id)] = TripMember.ADMIN
+        for participant_id in self.get_participants_list() or []:
+            if str(participant_id).isdigit():
+                roles.setdefault(int(participant_id), TripMember.PARTICIPANT)
+        return roles
+    
+    def sync_members(self):
+        """Bring the trip_member rows in line with admin_id and participants"""
+        expected = self.get_member_roles()
+        current = {member.user_id: member for member in self.members}
+        for user_id, member in current.items():
+            if user_id not in expected:
+                # An explicit delete (not only orphan cascade) so commit hooks see the change
+                self.members.remove(member)
+                db.session.delete(member)
+            elif member.role != expected[user_id]:
+                member.role = expected[user_id]
+        for user_id, role in expected.items():
+            if user_id not in current:
+                self.members.append(TripMember(user_id=user_id, role=role))
+    
     def set_participants_list(self, participants):
         """Convert list of participant IDs to JSON string"""
         self.participants = json.dumps(participants)
     
     def add_participant(self, user_id):
         """Add a registered participant to the trip"""
-        print(f"DEBUG: add_participant called for trip {self.id} with user_id: {user_id}")
         participants = self.get_participants_list()
-        print(f"DEBUG: Current participants: {participants}")
         if str(user_id) not in participants and user_id != self.admin_id:
             participants.append(str(user_id))
-            print(f"DEBUG: User not in list and not admin, adding. New list: {participants}")
+            logger.debug('Added user %s to trip %s', user_id, self.id)
             self.set_participants_list(participants)
-            print(f"DEBUG: add_participant returning True")
             return True
-        print(f"DEBUG: User already in list or is admin. Returning False")
+        logger.debug('User %s is already in trip %s', user_id, self.id)
         return False
         
     def add_unregistered_participant(self, name):
@@ -103,7 +140,6 @@ class Trip(db.Model):
     
     def remove_unregistered_participant(self, name):
         """Remove an unregistered participant from the trip"""
-        print(f"DEBUG: remove_unregistered_participant called for trip {self.id} with name: {name}")
         # Find the unregistered participant in the database
         participant = self.unregistered_participants_list.filter_by(name=name.strip().lower()).first()
         
@@ -111,15 +147,13 @@ class Trip(db.Model):
             # Delete the participant from the database
             db.session.delete(participant)
             db.session.commit()
-            print(f"DEBUG: Participant removed from database")
-            print(f"DEBUG: remove_unregistered_participant returning True")
+            logger.debug('Removed unregistered participant %s from trip %s', participant.id, self.id)
             return True
-        print(f"DEBUG: Participant not found in database. Returning False")
+        logger.debug('Unregistered participant to remove not found in trip %s', self.id)
         return False
         
     def link_participant(self, name, user_id):
         """Link an unregistered participant to a registered user"""
-        print(f"DEBUG: link_participant called with name: '{name}', user_id: {user_id}")
         
         # Import db here to avoid circular imports
         from backend.database import db
@@ -128,10 +162,10 @@ class Trip(db.Model):
         participant = self.unregistered_participants_list.filter_by(name=name.strip().lower()).first()
         
         if not participant:
-            print(f"DEBUG: Participant '{name}' not found in database")
+            logger.debug('Unregistered participant to link not found in trip %s', self.id)
             return False
             
-        print(f"DEBUG: Found participant in database: '{participant.name}'")
+        logger.debug('Linking unregistered participant %s of trip %s to user %s', participant.id, self.id, user_id)
         
         # Set the linked user ID
         participant.linked_user_id = user_id
@@ -141,24 +175,18 @@ class Trip(db.Model):
         result = True
         if int(user_id) != self.admin_id:
             result = self.add_participant(user_id)
-            print(f"DEBUG: add_participant result: {result}")
-        else:
-            print(f"DEBUG: User is admin, skipping add_participant")
         
         # Update all expense records to replace the unregistered participant with the registered user
         # Always proceed with data mapping, regardless of whether add_participant returned True or False
         # Create the unregistered ID that was used in expenses
         unregistered_id = f"unregistered_{participant.name}"
-        print(f"DEBUG: unregistered_id: {unregistered_id}")
         
         # Update all expenses
         for expense in self.expenses:
-            print(f"DEBUG: Processing expense {expense.id}")
             # Update payer_id if it matches the unregistered participant ID
             if expense.payer_id == unregistered_id:
-                old_payer_id = expense.payer_id
                 expense.payer_id = str(user_id)
-                print(f"DEBUG: Updating payer_id from {old_payer_id} to {user_id}")
+                logger.debug('Expense %s: payer re-pointed to user %s', expense.id, user_id)
             
             # Update participants list if it contains the unregistered participant ID
             participants = expense.get_participants_list()
@@ -167,7 +195,7 @@ class Trip(db.Model):
                 participants.remove(unregistered_id)
                 participants.append(str(user_id))
                 updated_participants = True
-                print(f"DEBUG: Updating participants list, removing {unregistered_id}, adding {user_id}")
+                logger.debug('Expense %s: participant re-pointed to user %s', expense.id, user_id)
             
             if updated_participants:
                 expense.set_participants_list(participants)
@@ -179,7 +207,7 @@ class Trip(db.Model):
                 amount = shares.pop(unregistered_id)
                 shares[str(user_id)] = amount
                 updated_shares = True
-                print(f"DEBUG: Updating shares, moving {amount} from {unregistered_id} to {user_id}")
+                logger.debug('Expense %s: share re-pointed to user %s', expense.id, user_id)
             
             if updated_shares:
                 expense.set_shares(shares)
@@ -191,7 +219,7 @@ class Trip(db.Model):
             amount = advances.pop(unregistered_id)
             advances[str(user_id)] = amount
             updated_advances = True
-            print(f"DEBUG: Updating advances, moving {amount} from {unregistered_id} to {user_id}")
+            logger.debug('Trip %s: advance re-pointed to user %s', self.id, user_id)
         
         if updated_advances:
             self.set_advances(advances)
@@ -203,7 +231,7 @@ class Trip(db.Model):
             if payment.get('participant_id') == unregistered_id:
                 payment['participant_id'] = str(user_id)
                 updated_payments = True
-                print(f"DEBUG: Updating general payment, changing participant_id from {unregistered_id} to {user_id}")
+                logger.debug('Trip %s: general payment re-pointed to user %s', self.id, user_id)
         
         if updated_payments:
             self.set_general_payments(payments)
@@ -222,9 +250,143 @@ class Trip(db.Model):
         
         # Always return True to indicate successful linking, regardless of whether the user was added as a participant
         # The route will handle the case where the user is already a participant
-        print(f"DEBUG: link_participant completed successfully")
+        logger.info('Linked unregistered participant %s of trip %s to user %s', participant.id, self.id, user_id)
         return True
     
+    def sync_linked_participants(self):
+        """Re-point expenses, advances and payments still referencing linked unregistered participants.
+        
+        Returns (sync_count, updated_expense_ids) without committing, or (None, [])
+        when the trip has no linked participants.
+        """
+        # Import db here to avoid circular imports
+        from backend.database import db
+        
+        # Get all linked unregistered participants for this trip
+        linked_participants = self.unregistered_participants_list.filter(UnregisteredParticipant.linked_user_id.isnot(None)).all()
+        
+        logger.debug('Found %d linked participants for trip %s', len(linked_participants), self.id)
+        
+        if not linked_participants:
+            return None, []
+        
+        sync_count = 0
+        updated_expenses = []
+        
+        # For each linked participant, check the expense table for references
+        for linked_participant in linked_participants:
+            # The database stores names in lowercase, but expense records might use original case
+            # So we need to check for both formats
+            unregistered_ids_to_check = [
+                f"unregistered_{linked_participant.name}",  # lowercase version (database format)
+                f"unregistered_{linked_participant.name.title()}",  # Title case version
+                f"unregistered_{linked_participant.name.upper()}",  # Uppercase version
+                f"unregistered_{linked_participant.name.capitalize()}"  # Capitalized version
+            ]
+            
+            user_id = str(linked_participant.linked_user_id)
+            
+            logger.debug('Checking trip %s for references to participant %s (linked to user %s)', self.id, linked_participant.id, user_id)
+            
+            # Check all expenses in this trip for references to this unregistered participant
+            for expense in self.expenses:
+                expense_updated = False
+                
+                # Check if this expense references the unregistered participant in any format
+                for unregistered_id in unregistered_ids_to_check:
+                    # 1. Check payer_id
+                    if expense.payer_id == unregistered_id:
+                        expense.payer_id = user_id
+                        logger.debug('Expense %s: payer re-pointed to user %s', expense.id, user_id)
+                        expense_updated = True
+                    
+                    # 2. Check participants list
+                    participants = expense.get_participants_list()
+                    if unregistered_id in participants:
+                        participants.remove(unregistered_id)
+                        participants.append(user_id)
+                        expense.set_participants_list(participants)
+                        logger.debug('Expense %s: participant re-pointed to user %s', expense.id, user_id)
+                        expense_updated = True
+                    
+                    # 3. Check shares
+                    shares = expense.get_shares()
+                    if unregistered_id in shares:
+                        amount = shares.pop(unregistered_id)
+                        shares[user_id] = amount
+                        expense.set_shares(shares)
+                        logger.debug('Expense %s: share re-pointed to user %s', expense.id, user_id)
+                        expense_updated = True
+                
+                # If this expense was updated, add it to the session
+                if expense_updated:
+                    db.session.add(expense)
+                    if expense.id not in updated_expenses:
+                        updated_expenses.append(expense.id)
+                    sync_count += 1
+            
+            # Check advances for this unregistered participant (check all formats)
+            advances = self.get_advances()
+            advance_updated = False
+            for unregistered_id in unregistered_ids_to_check:
+                if unregistered_id in advances:
+                    amount = advances.pop(unregistered_id)
+                    advances[user_id] = amount
+                    advance_updated = True
+                    logger.debug('Trip %s: advance re-pointed to user %s', self.id, user_id)
+            
+            if advance_updated:
+                self.set_advances(advances)
+                sync_count += 1
+            
+            # Check general payments for this unregistered participant (check all formats)
+            payments = self.get_general_payments()
+            payment_updated = False
+            for payment in payments:
+                for unregistered_id in unregistered_ids_to_check:
+                    if payment.get('participant_id') == unregistered_id:
+                        payment['participant_id'] = user_id
+                        payment_updated = True
+                        logger.debug('Trip %s: general payment re-pointed to user %s', self.id, user_id)
+            
+            if payment_updated:
+                self.set_general_payments(payments)
+                sync_count += 1
+        
+        return sync_count, updated_expenses
+    
+    def get_data_version(self):
+        """Return a short fingerprint of all data that feeds the trip's reports.
+
+        The fingerprint changes whenever the trip, its expenses, its unregistered
+        participants or the names of its registered participants change.
+        """
+        from backend.models.expense import Expense
+        from backend.models.user import User
+
+        expense_stats = db.session.query(
+            db.func.count(Expense.id),
+            db.func.max(Expense.updated_at),
+            db.func.sum(Expense.id),
+            db.func.sum(Expense.amount)
+        ).filter(Expense.trip_id == self.id).one()
+
+        unregistered = db.session.query(
+            UnregisteredParticipant.id,
+            UnregisteredParticipant.name,
+            UnregisteredParticipant.linked_user_id
+        ).filter_by(trip_id=self.id).order_by(UnregisteredParticipant.id).all()
+
+        user_ids = [int(pid) for pid in self.get_participants_list() if str(pid).isdigit()] + [self.admin_id]
+        user_names = db.session.query(User.id, User.name).filter(User.id.in_(user_ids)).order_by(User.id).all()
+
+        parts = [
+            self.id, self.name, self.updated_at, self.participants,
+            self.advances_json, self.general_payments_json,
+            tuple(expense_stats), [tuple(row) for row in unregistered], [tuple(row) for row in user_names]
+        ]
+        return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:16]
+
     def calculate_total_expenses(self):
         """Calculate total expenses for this trip"""
         return sum(expense.amount for expense in self.expenses)
@@ -300,6 +462,8 @@ class Trip(db.Model):
         """Save the advances dictionary as JSON"""
         self.advances_json = json.dumps(advances)
         
+    @metrics.timed(metrics.LEDGER_TIME, operation='recalculate_all_balances')
+    @memory_profiling.tracked('recalculate_all_balances')
     def recalculate_all_balances(self):
         """Recalculate all participant balances and return a dictionary of balances"""
         balances = {}
@@ -327,7 +491,7 @@ class Trip(db.Model):
         """Add an advance payment for a participant"""
         advances = self.get_advances()
         
-        print(f"Model - Adding advance: participant_id={participant_id} of type {type(participant_id)}")
+        logger.debug('Trip %s: adding advance of %s for participant %r', self.id, amount, participant_id)
         
         # If participant already has an advance, add to it
         if participant_id in advances:
@@ -352,11 +516,8 @@ class Trip(db.Model):
         """Delete an advance payment for a participant"""
         advances = self.get_advances()
         
-        print(f"In model: Deleting advance for {participant_id}")
-        print(f"Available advances: {advances}")
-        
         if participant_id not in advances:
-            print(f"Advance not found for {participant_id}")
+            logger.debug('Trip %s: no advance to delete for participant %r', self.id, participant_id)
             return False
             
         # Remove the advance
@@ -430,11 +591,8 @@ class Trip(db.Model):
         """Delete a general payment"""
         payments = self.get_general_payments()
         
-        print(f"In model: Deleting payment at index {payment_index}")
-        print(f"Available payments: {payments}")
-        
         if payment_index < 0 or payment_index >= len(payments):
-            print(f"Payment index out of range: {payment_index}, total payments: {len(payments)}")
+            logger.debug('Trip %s: payment index %s out of range (%d payments)', self.id, payment_index, len(payments))
             return False
             
         # Remove the payment
@@ -511,6 +669,8 @@ class Trip(db.Model):
         
         return trip_contributors
     
+    @metrics.timed(metrics.LEDGER_TIME, operation='calculate_settlements')
+    @memory_profiling.tracked('calculate_settlements')
     def calculate_settlements(self):
         """Calculate how to settle debts between participants"""
         try:
@@ -521,7 +681,6 @@ class Trip(db.Model):
                 
             # Get all unregistered participants
             unregistered_participants = self.get_unregistered_participants()
-            print(f"Found {len(unregistered_participants)} unregistered participants for settlements")
             
             # Calculate balance for each registered participant
             balances = {}
@@ -542,59 +701,48 @@ class Trip(db.Model):
                 # Only include non-zero balances
                 if abs(balance) > 0.01:
                     balances[unregistered_id] = balance
-                    print(f"Unregistered participant {name} has balance: {balance}")
             
             # If no significant balances, return empty settlements
             if not balances:
                 return []
             
             # Calculate settlements
-            settlements = []
-            max_iterations = 100  # Prevent infinite loops
-            iteration = 0
-            
-            while balances and iteration < max_iterations:
-                iteration += 1
-                
-                # Find max creditor and max debtor
-                max_creditor = max(balances.items(), key=lambda x: x[1]) if balances else None
-                max_debtor = min(balances.items(), key=lambda x: x[1]) if balances else None
-                
-                # If all balances are settled (close to zero), we're done
-                if not max_creditor or not max_debtor or abs(max_creditor[1]) < 0.01 or abs(max_debtor[1]) < 0.01:
-                    break
-                
-                # Calculate settlement amount
-                amount = min(max_creditor[1], -max_debtor[1])
-                
-                # Round to 2 decimal places to avoid floating point issues
-                amount = round(amount, 2)
-                
-                if amount <= 0:
-                    break  # No more meaningful settlements to make
-                
-                # Create settlement
-                settlements.append({
-                    'from_user': max_debtor[0],
-                    'to_user': max_creditor[0],
-                    'amount': amount
-                })
-                
-                # Update balances
-                balances[max_creditor[0]] -= amount
-                balances[max_debtor[0]] += amount
-                
-                # Remove settled balances to save memory
-                balances = {k: v for k, v in balances.items() if abs(v) > 0.01}
+            settlements = settle_balances(balances, max_iterations=100)
             
             # Limit the number of settlements to return (memory optimization)
             return settlements[:20]  # Return at most 20 settlements
             
         except Exception as e:
-            print(f"Error calculating settlements: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception('Error calculating settlements for trip %s', self.id)
             return []  # Return empty list on error
     
+    def to_dict(self):
+        """The trip with its participants, advances and general payments"""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'description': self.description,
+            'start_date': self.start_date.isoformat() if self.start_date else None,
+            'end_date': self.end_date.isoformat() if self.end_date else None,
+            'admin_id': self.admin_id,
+            'participants': self.get_participants_list() or [],
+            'advances': self.get_advances(),
+            'general_payments': self.get_general_payments(),
+            'version': self.version,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+    
     def __repr__(self):
-        return f'<Trip {self.name}: {self.start_date.date()} to {self.end_date.date()}>'
\ No newline at end of file
+        return f'<Trip {self.name}: {self.start_date.date()} to {self.end_date.date()}>'
+
+
+@event.listens_for(db.session, 'before_flush')
+def _sync_trip_members(session, flush_context, instances):
+    """Keep trip_member in step with every trip whose admin or participants change"""
+    for trip in list(session.new) + list(session.dirty):
+        if not isinstance(trip, Trip):
+            continue
+        state = inspect(trip)
+        if (trip in session.new or state.attrs.participants.history.has_changes()
+                or state.attrs.admin_id.history.has_changes()):
+            trip.sync_members()
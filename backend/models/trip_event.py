@@ -0,0 +1,23 @@
+from datetime import datetime
+from backend.database import db
+
+class TripEvent(db.Model):
+    """
+    A live update event published through the database broker, read by the
+    workers with subscribers to the trip. Rows are purged after
+    LIVE_UPDATES_RETENTION seconds.
+    """
+    # Published events describe changes that were already tracked
+    __track_changes__ = False
+    __table_args__ = (db.Index('ix_trip_event_trip_id', 'trip_id', 'id'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    # No foreign key: the event announcing a trip's deletion outlives the trip
+    trip_id = db.Column(db.Integer, nullable=False)
+    event_type = db.Column(db.String(30), nullable=False)
+    # JSON payload, serialized once by the publishing process
+    data = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f'<TripEvent {self.id} trip={self.trip_id} {self.event_type}>'
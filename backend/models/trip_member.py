@@ -0,0 +1,19 @@
+from backend.database import db
+
+class TripMember(db.Model):
+    """
+    A user's access to a trip, derived from Trip.admin_id and Trip.participants.
+
+    Rows are kept in step with the trip by a flush hook in models/trip.py, so
+    "which trips can this user open" is an indexed lookup instead of a LIKE
+    scan over the participants JSON of every trip.
+    """
+    ADMIN = 'admin'
+    PARTICIPANT = 'participant'
+
+    trip_id = db.Column(db.Integer, db.ForeignKey('trip.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True, index=True)
+    role = db.Column(db.String(20), nullable=False, default=PARTICIPANT)
+
+    def __repr__(self):
+        return f'<TripMember trip={self.trip_id} user={self.user_id} {self.role}>'
@@ -13,5 +13,14 @@ class UnregisteredParticipant(db.Model):
     trip = db.relationship('Trip', backref=db.backref('unregistered_participants_list', lazy='dynamic'))
     linked_user = db.relationship('User', backref='linked_unregistered_participants', foreign_keys=[linked_user_id])
     
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'trip_id': self.trip_id,
+            'name': self.name,
+            'linked_user_id': self.linked_user_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+    
     def __repr__(self):
         return f'<UnregisteredParticipant {self.name}>'
\ No newline at end of file
@@ -2,14 +2,17 @@ from flask import Blueprint, render_template, redirect, url_for, flash, request,
 from flask_login import current_user, login_required
 from datetime import datetime
 import json
+import logging
 from backend.models.expense import Expense
 from backend.models.trip import Trip
 from backend.models.user import User
 from backend.models.unregistered_participant import UnregisteredParticipant
 from backend.database import db
 from backend.config import Config
+from backend.utils import idempotency, optimistic, sqlite_mode, trip_access
 
 bp = Blueprint('expenses', __name__, url_prefix='/trip')
+logger = logging.getLogger(__name__)
 
 @bp.route('/<int:trip_id>/expenses')
 @login_required
@@ -17,8 +20,7 @@ def list_expenses(trip_id):
     trip = Trip.query.get_or_404(trip_id)
     
     # Check if user is a participant or admin
-    participants = trip.get_participants_list()
-    if str(current_user.id) not in participants and current_user.id != trip.admin_id:
+    if not trip_access.can_access(trip.id):
         flash('You do not have access to this trip', 'error')
         return redirect(url_for('trips.list_trips'))
     
@@ -71,18 +73,17 @@ def list_expenses(trip_id):
 
 @bp.route('/<int:trip_id>/expenses/add', methods=['GET', 'POST'])
 @login_required
+@idempotency.idempotent
 def add_expense(trip_id):
     trip = Trip.query.get_or_404(trip_id)
     
     # Check if user is a participant or admin
-    participants = trip.get_participants_list()
-    if str(current_user.id) not in participants and current_user.id != trip.admin_id:
+    if not trip_access.can_access(trip.id):
         flash('You do not have access to this trip', 'error')
         return redirect(url_for('trips.list_trips'))
     
     if request.method == 'POST':
         try:
-            print("Form submitted, processing expense data...")
             description = request.form.get('description')
             amount = request.form.get('amount')
             date_str = request.form.get('date')
@@ -91,10 +92,6 @@ def add_expense(trip_id):
             selected_unregistered = request.form.getlist('unregistered_participants')
             category = request.form.get('category')
             
-            print(f"Form data: description={description}, amount={amount}, date={date_str}, split_method={split_method}, category={category}")
-            print(f"Selected participants: {selected_participants}")
-            print(f"Selected unregistered: {selected_unregistered}")
-            
             # Validate input
             if not description or not amount or not date_str or not split_method:
                 flash('All fields are required', 'error')
@@ -113,21 +110,14 @@ def add_expense(trip_id):
                     
                 date = datetime.strptime(date_str, '%Y-%m-%d')
             except (ValueError, TypeError) as e:
-                print(f"Error parsing amount or date: {e}")
+                logger.debug('Trip %s: rejected expense with invalid amount or date: %s', trip_id, e)
                 flash('Invalid amount or date format', 'error')
                 return redirect(url_for('expenses.add_expense', trip_id=trip_id))
         
             # Get payer ID (default to current user if not specified)
             payer_id = request.form.get('payer_id', str(current_user.id))
-            print(f"Payer ID: {payer_id}")
-            
-            # Handle 'group_everyone' special case for payer
-            if payer_id == 'group_everyone':
-                print("Group payment detected: This expense was paid by everyone collectively")
-                # We'll store this special value directly
             
             # Create new expense
-            print("Creating expense object...")
             expense = Expense(
                 description=description,
                 amount=amount,
@@ -143,11 +133,9 @@ def add_expense(trip_id):
                 'registered': selected_participants,
                 'unregistered': selected_unregistered
             }
-            print(f"All participants: {all_participants}")
         
             # Handle different split methods
             if split_method == 'equal':
-                print("Using equal split method")
                 # Make sure we pass lists, not None
                 participants_list = selected_participants if selected_participants else []
                 unregistered_list = selected_unregistered if selected_unregistered else []
@@ -160,7 +148,6 @@ def add_expense(trip_id):
                 expense.update_split('equal', participants_list, unregistered_participants=unregistered_list)
             
             elif split_method == 'exact':
-                print("Using exact split method")
                 shares_data = {}
                 total_shares = 0.0
                 
@@ -175,7 +162,6 @@ def add_expense(trip_id):
                                 return redirect(url_for('expenses.add_expense', trip_id=trip_id))
                             shares_data[participant_id] = share_value
                             total_shares += share_value
-                            print(f"Participant {participant_id} share: {share_value}")
                         except ValueError:
                             flash(f'Invalid share amount format', 'error')
                             return redirect(url_for('expenses.add_expense', trip_id=trip_id))
@@ -192,14 +178,12 @@ def add_expense(trip_id):
                                 return redirect(url_for('expenses.add_expense', trip_id=trip_id))
                             unregistered_shares[name] = share_value
                             total_shares += share_value
-                            print(f"Unregistered participant {name} share: {share_value}")
                         except ValueError:
                             flash(f'Invalid share amount format for {name}', 'error')
                             return redirect(url_for('expenses.add_expense', trip_id=trip_id))
                 
                 # Validate total shares match expense amount (with small rounding tolerance)
                 if abs(total_shares - amount) > 0.01:
-                    print(f"Total shares ({total_shares}) does not match expense amount ({amount})")
                     flash(f'Total shares ({total_shares}) must equal the expense amount ({amount})', 'error')
                     return redirect(url_for('expenses.add_expense', trip_id=trip_id))
                 
@@ -213,11 +197,9 @@ def add_expense(trip_id):
                                    unregistered_participants=selected_unregistered)
             
             elif split_method == 'itemized':
-                print("Using itemized split method")
                 # Process items from form
                 items_data = []
                 item_count = int(request.form.get('item_count', 0))
-                print(f"Processing {item_count} items")
                 
                 # Validate we have at least one item
                 if item_count <= 0:
@@ -232,8 +214,6 @@ def add_expense(trip_id):
                     item_participants = request.form.getlist(f'item_participants_{i}')
                     item_unregistered = request.form.getlist(f'item_unregistered_{i}')
                     
-                    print(f"Item {i}: {item_name}, {item_price}, participants: {item_participants}, unregistered: {item_unregistered}")
-                    
                     # Validate item data
                     if not item_name or not item_price:
                         flash(f'Item {i+1} is missing name or price', 'error')
@@ -264,47 +244,25 @@ def add_expense(trip_id):
                 
                 # Validate total items price matches expense amount (with small rounding tolerance)
                 if abs(total_items_price - amount) > 0.01:
-                    print(f"Total items price ({total_items_price}) does not match expense amount ({amount})")
                     flash(f'Total items price ({total_items_price}) must equal the expense amount ({amount})', 'error')
                     return redirect(url_for('expenses.add_expense', trip_id=trip_id))
                 
                 expense.update_split('itemized', selected_participants, items_data=items_data, 
                                    unregistered_participants=selected_unregistered)
         
-            print("Saving expense to database...")
-            db.session.add(expense)
-            
-            # Detailed debugging before commit
-            print("Expense object created with the following details:")
-            print(f"Expense description: {expense.description}")
-            print(f"Expense amount: {expense.amount}")
-            print(f"Expense date: {expense.date}")
-            print(f"Expense split method: {expense.split_method}")
-            print(f"Expense participants: {expense.participants}")
-            print(f"Expense shares: {expense.shares}")
-            print(f"Expense items: {expense.items if expense.items else 'No items'}")
-            
-            # Commit changes to the database
-            db.session.commit()
+            # Commit changes to the database, retrying if SQLite is locked by another writer
+            sqlite_mode.run_write(lambda: db.session.add(expense))
             
             # Recalculate all balances to ensure consistency
             balances = trip.recalculate_all_balances()
             
-            # Detailed debugging after successful save
-            print("Expense saved successfully!")
-            print(f"Expense ID: {expense.id}")
-            print(f"Expense in database: {Expense.query.get(expense.id) is not None}")
-            print("Database changes committed successfully")
+            logger.info('Trip %s: added expense %s (%s split)', trip_id, expense.id, split_method)
             
             flash('Expense added successfully', 'success')
             return redirect(url_for('expenses.list_expenses', trip_id=trip_id))
         except Exception as e:
             db.session.rollback()
-            print(f"Error saving expense: {str(e)}")
-            print(f"Exception type: {type(e).__name__}")
-            print(f"Form data received: {request.form}")
-            import traceback
-            traceback.print_exc()
+            logger.exception('Trip %s: error saving expense', trip_id)
             flash(f'Error saving expense: {str(e)}', 'error')
             return redirect(url_for('expenses.add_expense', trip_id=trip_id))
     
@@ -346,8 +304,7 @@ def view_expense(trip_id, expense_id):
         return redirect(url_for('expenses.list_expenses', trip_id=trip_id))
     
     # Check if user is a participant or admin
-    participants = trip.get_participants_list()
-    if str(current_user.id) not in participants and current_user.id != trip.admin_id:
+    if not trip_access.can_access(trip.id):
         flash('You do not have access to this expense', 'error')
         return redirect(url_for('trips.list_trips'))
     
@@ -480,7 +437,7 @@ def view_expense(trip_id, expense_id):
                     'amount': amount
                 })
     except Exception as e:
-        print(f"Error parsing shares: {e}")
+        logger.warning('Could not parse shares of expense %s: %s', expense.id, e)
     
     # Get expense items
     items = []
@@ -491,7 +448,7 @@ def view_expense(trip_id, expense_id):
         elif isinstance(items_data, list):
             items = items_data
     except Exception as e:
-        print(f"Error parsing items: {e}")
+        logger.warning('Could not parse items of expense %s: %s', expense.id, e)
     
     # Get unregistered participants
     unregistered_participants = []
@@ -500,7 +457,7 @@ def view_expense(trip_id, expense_id):
         if isinstance(items_data, dict) and 'unregistered_participants' in items_data:
             unregistered_participants = items_data['unregistered_participants']
     except Exception as e:
-        print(f"Error parsing unregistered participants: {e}")
+        logger.warning('Could not parse unregistered participants of expense %s: %s', expense.id, e)
     
     return render_template('expenses/view.html', 
                           trip=trip, 
@@ -560,6 +517,9 @@ def edit_expense(trip_id, expense_id):
         # Get payer ID
         payer_id = request.form.get('payer_id')
         
+        # Reject the edit if the expense changed since the form was rendered
+        optimistic.check_version(expense, request.form.get('version'))
+        
         # Update expense
         expense.description = description
         expense.amount = amount
@@ -609,7 +569,7 @@ def edit_expense(trip_id, expense_id):
             
             expense.update_split('itemized', selected_participants, items_data=items_data, unregistered_participants=selected_unregistered)
         
-        db.session.commit()
+        optimistic.commit()
         
         # Recalculate all balances to ensure consistency
         balances = trip.recalculate_all_balances()
@@ -674,9 +634,9 @@ def delete_expense(trip_id, expense_id):
         flash('You do not have permission to delete this expense', 'error')
         return redirect(url_for('expenses.view_expense', trip_id=trip_id, expense_id=expense_id))
     
-    # Delete the expense
-    db.session.delete(expense)
-    db.session.commit()
+    # Delete the expense unless it changed since the user viewed it
+    optimistic.check_version(expense, request.form.get('version'))
+    optimistic.run_write(lambda: db.session.delete(expense), retries=0)
     
     # Recalculate all balances to ensure consistency
     balances = trip.recalculate_all_balances()
@@ -0,0 +1,165 @@
+from flask import Blueprint, Response, redirect, url_for, flash, request, jsonify, send_file, stream_with_context
+from flask_login import current_user, login_required
+from backend.models.trip import Trip
+from backend.models.user import User
+from backend.utils import trip_access
+import click
+import os
+import sys
+import tempfile
+
+bp = Blueprint('exports', __name__)
+
+
+def _export_response(trip_ids, filename):
+    """Build a streaming download response for the requested format"""
+    # Export modules load on first use, they are not needed at startup
+    from backend.utils.export import EXPORT_FORMATS, stream_export
+    
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f'Unsupported format: {fmt}. Use one of: {", ".join(EXPORT_FORMATS)}'}), 400
+
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    filename = f'{filename}.{fmt}'
+    mimetype = EXPORT_FORMATS[fmt]
+    if compress:
+        filename += '.gz'
+        mimetype = 'application/gzip'
+
+    chunks = stream_export(trip_ids, fmt, compress=compress)
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+
+@bp.route('/trips/<int:trip_id>')
+@login_required
+def export_trip(trip_id):
+    """Stream a trip's expenses, shares, advances and payments"""
+    trip = Trip.query.get_or_404(trip_id)
+
+    # Check if user is a participant or admin
+    if not trip_access.can_access(trip.id):
+        flash('You do not have access to this trip', 'error')
+        return redirect(url_for('trips.list_trips'))
+
+    return _export_response([trip.id], f'trip_export_{trip.name.replace(" ", "_")}')
+
+
+@bp.route('/me')
+@login_required
+def export_user():
+    """Stream the ledger of every trip the current user belongs to"""
+    trip_ids = trip_access.trip_ids()
+    return _export_response(trip_ids, f'expenses_export_user_{current_user.id}')
+
+
+@bp.route('/ledger')
+@login_required
+def export_ledger():
+    """Download the expense/share ledger as Parquet, Arrow IPC or CSV"""
+    from backend.utils.analytics_export import LEDGER_FORMATS, write_ledger
+    
+    fmt = request.args.get('format', 'parquet').lower()
+    if fmt not in LEDGER_FORMATS:
+        return jsonify({'error': f'Unsupported format: {fmt}. Use one of: {", ".join(LEDGER_FORMATS)}'}), 400
+
+    trip_id = request.args.get('trip_id', type=int)
+    all_trips = request.args.get('all_trips', '').lower() in ('1', 'true', 'yes')
+    user_trip_ids = trip_access.trip_ids()
+
+    if trip_id:
+        if not trip_access.can_access(trip_id):
+            return jsonify({'error': 'Unauthorized'}), 403
+        trip_ids = [trip_id]
+    elif all_trips:
+        # Only site admins may export the ledger of every trip
+        if not current_user.is_admin:
+            return jsonify({'error': 'Unauthorized'}), 403
+        trip_ids = None
+    else:
+        trip_ids = user_trip_ids
+
+    fd, path = tempfile.mkstemp(prefix='ledger_', suffix=f'.{fmt}')
+    os.close(fd)
+    try:
+        written_fmt, _ = write_ledger(path, fmt, trip_ids)
+        ledger_file = open(path, 'rb')
+    finally:
+        # The open handle keeps the data readable until the response is sent
+        os.remove(path)
+
+    extension, mimetype = LEDGER_FORMATS[written_fmt]
+    return send_file(
+        ledger_file,
+        mimetype=mimetype,
+        as_attachment=True,
+        download_name=f'expense_ledger.{extension}'
+    )
+
+
+def _write_export(trip_ids, fmt, compress, output):
+    from backend.utils.export import EXPORT_FORMATS, stream_export
+    
+    if fmt not in EXPORT_FORMATS:
+        raise click.BadParameter(f'Use one of: {", ".join(sorted(EXPORT_FORMATS))}', param_hint='--format')
+    chunks = stream_export(trip_ids, fmt, compress=compress)
+    if output == '-':
+        stream = sys.stdout.buffer
+        for chunk in chunks:
+            stream.write(chunk)
+        stream.flush()
+    else:
+        with open(output, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        click.echo(f'Exported {len(trip_ids)} trip(s) to {output}', err=True)
+
+
+@bp.cli.command('trip')
+@click.argument('trip_id', type=int)
+@click.option('--format', 'fmt', default='csv', help='csv or ndjson.')
+@click.option('--gzip', 'compress', is_flag=True, help='Compress the output with gzip.')
+@click.option('--output', '-o', default='-', help='Output file (defaults to stdout).')
+def export_trip_command(trip_id, fmt, compress, output):
+    """Export a single trip's ledger."""
+    if Trip.query.get(trip_id) is None:
+        raise click.ClickException(f'Trip {trip_id} not found')
+    _write_export([trip_id], fmt, compress, output)
+
+
+@bp.cli.command('user')
+@click.argument('email')
+@click.option('--format', 'fmt', default='csv', help='csv or ndjson.')
+@click.option('--gzip', 'compress', is_flag=True, help='Compress the output with gzip.')
+@click.option('--output', '-o', default='-', help='Output file (defaults to stdout).')
+def export_user_command(email, fmt, compress, output):
+    """Export the ledger of every trip a user belongs to."""
+    user = User.query.filter_by(email=email).first()
+    if user is None:
+        raise click.ClickException(f'No user found with email: {email}')
+    trip_ids = sorted(trip.id for trip in user.get_trips())
+    _write_export(trip_ids, fmt, compress, output)
+
+
+@bp.cli.command('ledger')
+@click.option('--format', 'fmt', default='parquet', help='parquet, arrow or csv.')
+@click.option('--trip-id', 'trip_ids', type=int, multiple=True, help='Trip to include (repeatable).')
+@click.option('--all-trips', is_flag=True, help='Export the ledger of every trip.')
+@click.option('--batch-size', type=int, default=10000, show_default=True)
+@click.option('--output', '-o', required=True, help='Output file.')
+def export_ledger_command(fmt, trip_ids, all_trips, batch_size, output):
+    """Export the expense/share ledger for analytics."""
+    from backend.utils.analytics_export import LEDGER_FORMATS, write_ledger
+    
+    if fmt not in LEDGER_FORMATS:
+        raise click.BadParameter(f'Use one of: {", ".join(sorted(LEDGER_FORMATS))}', param_hint='--format')
+    if not trip_ids and not all_trips:
+        raise click.UsageError('Pass --trip-id at least once or --all-trips')
+    written_fmt, row_count = write_ledger(output, fmt, None if all_trips else list(trip_ids), batch_size)
+    if written_fmt != fmt:
+        click.echo(f'pyarrow is not installed, wrote CSV instead of {fmt}', err=True)
+    click.echo(f'Wrote {row_count} ledger rows to {output}', err=True)
@@ -0,0 +1,72 @@
+from flask import Blueprint, jsonify
+from flask_login import current_user, login_required
+from backend.models.job import Job
+from backend.models.trip import Trip
+from backend.utils import jobs
+import click
+import multiprocessing
+
+bp = Blueprint('jobs', __name__)
+
+
+@bp.route('/<int:job_id>')
+@login_required
+def job_status(job_id):
+    """Report the status, progress and result of a background job"""
+    job = Job.query.get_or_404(job_id)
+
+    # Jobs are visible to the user who queued them and to the trip's participants
+    allowed = job.user_id == current_user.id
+    if not allowed and job.trip_id:
+        trip = Trip.query.get(job.trip_id)
+        allowed = trip is not None and (
+            str(current_user.id) in trip.get_participants_list() or current_user.id == trip.admin_id
+        )
+    if not allowed:
+        return jsonify({'success': False, 'message': 'You do not have access to this job'}), 403
+
+    return jsonify({'success': True, 'job': job.to_dict()})
+
+
+def _worker_main(worker_id, burst, poll_interval):
+    """Entry point of a spawned worker process"""
+    from backend.app_factory import create_app
+    app = create_app()
+    with app.app_context():
+        jobs.work(worker_id=worker_id, burst=burst, poll_interval=poll_interval)
+
+
+@bp.cli.command('work')
+@click.option('--workers', type=int, default=1, show_default=True, help='Number of worker processes.')
+@click.option('--burst', is_flag=True, help='Exit once the queue is empty.')
+@click.option('--poll-interval', type=float, default=None, help='Seconds between polls of an empty queue.')
+def work_command(workers, burst, poll_interval):
+    """Run background job workers."""
+    if workers <= 1:
+        processed = jobs.work(burst=burst, poll_interval=poll_interval)
+        click.echo(f'Processed {processed} job(s)', err=True)
+        return
+
+    # Spawned workers build their own app and database connections
+    context = multiprocessing.get_context('spawn')
+    base_id = jobs.default_worker_id()
+    processes = [
+        context.Process(target=_worker_main, args=(f'{base_id}/{index}', burst, poll_interval))
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+
+@bp.cli.command('purge')
+@click.option('--days', type=int, default=7, show_default=True, help='Remove finished jobs older than this.')
+def purge_command(days):
+    """Delete old finished jobs."""
+    removed = jobs.purge_finished(days)
+    click.echo(f'Removed {removed} finished job(s)', err=True)
@@ -1,12 +1,17 @@
-from flask import Blueprint, render_template, redirect, url_for, jsonify, request
+from flask import Blueprint, render_template, redirect, url_for, jsonify, request, Response, stream_with_context
 from flask_login import current_user, login_required
 from datetime import date, timedelta, datetime
+import json
+import logging
 from backend.models.trip import Trip
 from backend.models.expense import Expense
 from backend.models.user import User
 from backend.database import db
+from backend.utils import jobs, sync, trip_access
+from backend.utils.sql_functions import year_month
 
 bp = Blueprint("main", __name__)
+logger = logging.getLogger(__name__)
 
 
 @bp.route("/")
@@ -57,7 +62,7 @@ def dashboard():
     if trip_ids:
         paid_expenses_query = (
             Expense.query.filter(
-                Expense.trip_id.in_(trip_ids), Expense.payer_id == current_user.id
+                Expense.trip_id.in_(trip_ids), Expense.payer_id == str(current_user.id)
             )
             .order_by(Expense.date.desc())
             .limit(10)
@@ -83,10 +88,10 @@ def dashboard():
     months_for_filter = []
     if trip_ids:
         distinct_months = (
-            db.session.query(db.func.strftime("%Y-%m", Expense.date))
+            db.session.query(year_month(Expense.date))
             .filter(Expense.trip_id.in_(trip_ids))
             .distinct()
-            .order_by(db.func.strftime("%Y-%m", Expense.date).desc())
+            .order_by(year_month(Expense.date).desc())
             .all()
         )
 
@@ -176,17 +181,14 @@ def dashboard():
 @bp.route("/api/months_for_trip/<int:trip_id>")
 @login_required
 def api_months_for_trip(trip_id):
-    user_trips = current_user.get_trips()
-    trip_ids = [trip.id for trip in user_trips]
-
-    if trip_id not in trip_ids:
+    if not trip_access.can_access(trip_id):
         return jsonify({"error": "Unauthorized"}), 403
 
     distinct_months = (
-        db.session.query(db.func.strftime("%Y-%m", Expense.date))
+        db.session.query(year_month(Expense.date))
         .filter(Expense.trip_id == trip_id)
         .distinct()
-        .order_by(db.func.strftime("%Y-%m", Expense.date).desc())
+        .order_by(year_month(Expense.date).desc())
         .all()
     )
 
@@ -202,17 +204,16 @@ def api_months_for_trip(trip_id):
 @bp.route("/api/all_months")
 @login_required
 def api_all_months():
-    user_trips = current_user.get_trips()
-    trip_ids = [trip.id for trip in user_trips]
+    trip_ids = trip_access.trip_ids()
 
     if not trip_ids:
         return jsonify([])
 
     distinct_months = (
-        db.session.query(db.func.strftime("%Y-%m", Expense.date))
+        db.session.query(year_month(Expense.date))
         .filter(Expense.trip_id.in_(trip_ids))
         .distinct()
-        .order_by(db.func.strftime("%Y-%m", Expense.date).desc())
+        .order_by(year_month(Expense.date).desc())
         .all()
     )
 
@@ -232,8 +233,7 @@ def api_spending_history():
     month = request.args.get("month")  # YYYY-MM format
 
     # Base query for user's expenses
-    user_trips = current_user.get_trips()
-    trip_ids = [trip.id for trip in user_trips]
+    trip_ids = trip_access.trip_ids()
 
     if not trip_ids:
         return jsonify({"line_chart_labels": [], "line_chart_values": []})
@@ -334,8 +334,7 @@ def api_dashboard_data():
     month = request.args.get("month")  # YYYY-MM format
 
     # Base query for user's expenses
-    user_trips = current_user.get_trips()
-    trip_ids = [trip.id for trip in user_trips]
+    trip_ids = trip_access.trip_ids()
 
     if not trip_ids:
         return jsonify({})
@@ -344,7 +343,7 @@ def api_dashboard_data():
     base_query = Expense.query.filter(Expense.trip_id.in_(trip_ids))
 
     if trip_id:
-        if trip_id in trip_ids:  # Security check
+        if trip_access.can_access(trip_id):  # Security check
             base_query = base_query.filter(Expense.trip_id == trip_id)
         else:
             return jsonify({"error": "Invalid trip_id"}), 403
@@ -469,33 +468,63 @@ def api_dashboard_data():
 @login_required
 def api_sync():
     """API endpoint to manually sync/refresh all user data and balances"""
+    if jobs.wants_async():
+        current_user.update_last_seen()
+        job, created = jobs.enqueue('sync_account', user_id=current_user.id)
+        return jobs.job_accepted(job, created)
+    
     try:
         # Get all trips for the user
-        user_trips = current_user.get_trips()
-        
-        # Recalculate balances for each trip
-        sync_count = 0
-        for trip in user_trips:
-            try:
-                # Recalculate all balances for this trip
-                balances = trip.recalculate_all_balances()
-                sync_count += 1
-            except Exception as e:
-                print(f"Error syncing trip {trip.id}: {str(e)}")
-                # Continue with other trips even if one fails
+        trip_ids = trip_access.trip_ids()
         
         # Update user's last seen timestamp
         current_user.update_last_seen()
         
+        # Stream one NDJSON event per trip as it finishes, then a summary
+        if request.values.get("stream", "").lower() in ("1", "true", "yes"):
+            return Response(
+                stream_with_context(_stream_sync_events(trip_ids)),
+                mimetype="application/x-ndjson"
+            )
+        
+        # Recalculate balances for each trip; failures are reported per trip
+        sync_count, results = sync.sync_trips(trip_ids)
+        failed_trips = [sync.failed_trip(result) for result in results if not result["success"]]
+        
+        message = f"Successfully synchronized {sync_count} trips"
+        if failed_trips:
+            message += f" ({len(failed_trips)} failed)"
+        
         return jsonify({
             "success": True, 
-            "message": f"Successfully synchronized {sync_count} trips", 
-            "sync_count": sync_count
+            "message": message, 
+            "sync_count": sync_count,
+            "failed_trips": failed_trips,
+            "results": results
         })
         
     except Exception as e:
-        print(f"Error during synchronization: {str(e)}")
+        logger.exception("Error during account synchronization for user %s", current_user.id)
         return jsonify({
             "success": False, 
             "message": f"Error during synchronization: {str(e)}"
         }), 500
+
+
+def _stream_sync_events(trip_ids):
+    """Progress events for a streamed account sync"""
+    yield json.dumps({"event": "start", "total": len(trip_ids)}) + "\n"
+    sync_count = 0
+    failed_trips = []
+    for completed, result in enumerate(sync.iter_sync(trip_ids), start=1):
+        if result["success"]:
+            sync_count += 1
+        else:
+            failed_trips.append(sync.failed_trip(result))
+        yield json.dumps({"event": "trip", "completed": completed, "total": len(trip_ids), **result}) + "\n"
+    yield json.dumps({
+        "event": "done",
+        "success": True,
+        "sync_count": sync_count,
+        "failed_trips": failed_trips
+    }) + "\n"
@@ -0,0 +1,44 @@
+from flask import Blueprint, Response, abort, current_app, jsonify, request
+from flask_login import current_user, login_required
+from backend.utils import memory_profiling, metrics
+import click
+import hmac
+
+bp = Blueprint('metrics', __name__)
+
+
+@bp.route('/metrics')
+def prometheus_metrics():
+    """Expose request, database, ledger, PDF and cache metrics of all worker processes"""
+    if not current_app.config['METRICS_ENABLED']:
+        abort(404)
+
+    # Scrapers authenticate with a bearer token when one is configured
+    token = current_app.config.get('METRICS_TOKEN')
+    if token:
+        supplied = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode()):
+            abort(401)
+
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@bp.route('/metrics/memory', methods=['GET', 'DELETE'])
+@login_required
+def memory_report():
+    """Peak memory and top allocation sites per endpoint and section of this worker process"""
+    if not current_app.config['MEMORY_PROFILING']:
+        abort(404)
+    if not current_user.is_admin:
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    if request.method == 'DELETE':
+        memory_profiling.reset()
+    return jsonify(memory_profiling.report())
+
+
+@bp.cli.command('reset')
+def reset_command():
+    """Delete recorded metrics files."""
+    metrics.reset()
+    click.echo('Metrics reset', err=True)
@@ -0,0 +1,23 @@
+from flask import Blueprint, jsonify, request
+from flask_login import current_user, login_required
+from backend.utils import change_log, trip_access
+
+bp = Blueprint('sync_api', __name__)
+
+
+@bp.route('/sync')
+@login_required
+def delta_sync():
+    """Trips, expenses and participants changed since the cursor, with tombstones for deletions"""
+    since = request.args.get('since', '').strip()
+    trip_ids = trip_access.trip_ids()
+
+    # No cursor, or one from another database: start over from a snapshot
+    if not since:
+        return jsonify(change_log.snapshot(trip_ids))
+    if not since.isdigit():
+        return jsonify({'error': 'since must be a cursor returned by this endpoint'}), 400
+    if int(since) > change_log.current_cursor():
+        return jsonify(change_log.snapshot(trip_ids))
+
+    return jsonify(change_log.delta(current_user.id, trip_ids, int(since)))
@@ -1,4 +1,4 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, send_file
+from flask import Blueprint, Response, render_template, redirect, url_for, flash, request, jsonify, send_file, current_app, stream_with_context
 from flask_login import current_user, login_required
 from datetime import datetime
 from backend.models.trip import Trip
@@ -6,12 +6,15 @@ from backend.models.user import User
 from backend.models.expense import Expense
 from backend.models.unregistered_participant import UnregisteredParticipant
 from backend.database import db
+from backend.utils import idempotency, jobs, live_updates, optimistic, trip_access
 from sqlalchemy import func
-from io import BytesIO
 import json
+import logging
+import os
 
 # Define the blueprint without a URL prefix
 trips_bp = Blueprint('trips', __name__)
+logger = logging.getLogger(__name__)
 
 @trips_bp.route('/')
 @login_required
@@ -76,27 +79,19 @@ def test_route():
 @login_required
 def view_trip(trip_id):
     try:
-        # Debug information
-        print(f"Attempting to view trip with ID: {trip_id}")
         
         # Get the trip
         trip = Trip.query.get_or_404(trip_id)
-        print(f"Found trip: {trip.name}")
         
         # Check if user is a participant or admin
-        participants = trip.get_participants_list()
-        print(f"Participants: {participants}")
-        print(f"Current user ID: {current_user.id}")
-        print(f"Trip admin ID: {trip.admin_id}")
-        
-        if str(current_user.id) not in participants and current_user.id != trip.admin_id:
-            print("Access denied: User is not a participant or admin")
+        if not trip_access.can_access(trip.id):
+            logger.info('User %s denied access to trip %s', current_user.id, trip_id)
             flash('You do not have access to this trip', 'error')
             return redirect(url_for('trips.list_trips'))
         
         # Get expenses for this trip
         expenses = Expense.query.filter_by(trip_id=trip_id).order_by(Expense.date.desc()).all()
-        print(f"Found {len(expenses)} expenses")
+        logger.debug('Trip %s: viewing %d expenses', trip_id, len(expenses))
         
         # Get user names for display
         participant_ids = trip.get_participants_list()
@@ -168,10 +163,10 @@ def view_trip(trip_id):
         try:
             settlements = trip.calculate_settlements()
         except MemoryError:
-            print("Memory error occurred during settlements calculation, using empty settlements")
+            logger.error('Trip %s: out of memory calculating settlements, showing none', trip_id)
             settlements = []
         except Exception as e:
-            print(f"Error calculating settlements: {str(e)}")
+            logger.exception('Trip %s: error calculating settlements', trip_id)
             settlements = []
         
         # Get expense contributors
@@ -187,9 +182,7 @@ def view_trip(trip_id):
                             expense_contributors=expense_contributors)
                             
     except Exception as e:
-        print(f"Error viewing trip: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception('Error viewing trip %s', trip_id)
         flash(f'Error viewing trip: {str(e)}', 'error')
         return redirect(url_for('trips.list_trips'))
     
@@ -227,13 +220,16 @@ def edit_trip(trip_id):
             flash('End date cannot be before start date', 'error')
             return render_template('trips/edit.html', trip=trip)
         
+        # Reject the edit if the trip changed since the form was rendered
+        optimistic.check_version(trip, request.form.get('version'))
+        
         # Update trip
         trip.name = name
         trip.description = description
         trip.start_date = start_date
         trip.end_date = end_date
         
-        db.session.commit()
+        optimistic.commit()
         
         flash('Trip updated successfully', 'success')
         return redirect(url_for('trips.view_trip', trip_id=trip.id))
@@ -250,7 +246,6 @@ def edit_trip(trip_id):
 @trips_bp.route('/<int:trip_id>/manage-participants', methods=['GET', 'POST'])
 @login_required
 def manage_participants(trip_id):
-    print(f"DEBUG: manage_participants called with trip_id: {trip_id}")
     trip = Trip.query.get_or_404(trip_id)
     
     # Check if user is the admin
@@ -259,14 +254,9 @@ def manage_participants(trip_id):
         return redirect(url_for('trips.view_trip', trip_id=trip_id))
     
     if request.method == 'POST':
-        print(f"DEBUG: POST request received")
-        print(f"DEBUG: Request headers: {dict(request.headers)}")
-        print(f"DEBUG: Content-Type: {request.headers.get('Content-Type')}")
-        print(f"DEBUG: Request form data: {request.form}")
-        print(f"DEBUG: Request JSON data: {request.get_json()}")
         
         action = request.form.get('action') if request.form.get('action') else (request.get_json().get('action') if request.get_json() else None)
-        print(f"DEBUG: Action: {action}")
+        logger.debug('Trip %s: participant action %s', trip_id, action)
         
         if action == 'add_registered':
             email = request.form.get('email')
@@ -277,9 +267,8 @@ def manage_participants(trip_id):
                 flash(f'No user found with email: {email}', 'error')
                 return redirect(url_for('trips.manage_participants', trip_id=trip_id))
             
-            # Add user to trip
-            if trip.add_participant(user.id):
-                db.session.commit()
+            # Add user to trip, retrying if the trip changed concurrently
+            if optimistic.run_write(lambda: trip.add_participant(user.id)):
                 flash(f'Added {user.name} to the trip', 'success')
             else:
                 flash(f'{user.name} is already a participant', 'info')
@@ -311,8 +300,7 @@ def manage_participants(trip_id):
                 user = User.query.filter(func.lower(User.email) == func.lower(participant_input)).first()
                 if user:
                     # User exists, add as registered participant
-                    if trip.add_participant(user.id):
-                        db.session.commit()
+                    if optimistic.run_write(lambda: trip.add_participant(user.id)):
                         return jsonify({'success': True, 'message': f'Added {user.name} to the trip as a registered user', 'type': 'registered'}) if request.headers.get('Content-Type') == 'application/json' else redirect(url_for('trips.manage_participants', trip_id=trip_id))
                     else:
                         return jsonify({'success': False, 'message': f'{user.name} is already a participant'}) if request.headers.get('Content-Type') == 'application/json' else flash(f'{user.name} is already a participant', 'info')
@@ -333,8 +321,7 @@ def manage_participants(trip_id):
                 user = User.query.filter(func.lower(User.name) == func.lower(name_input)).first()
                 if user:
                     # User exists with this name, add as registered participant
-                    if trip.add_participant(user.id):
-                        db.session.commit()
+                    if optimistic.run_write(lambda: trip.add_participant(user.id)):
                         return jsonify({'success': True, 'message': f'Added {user.name} to the trip as a registered user', 'type': 'registered'}) if request.headers.get('Content-Type') == 'application/json' else redirect(url_for('trips.manage_participants', trip_id=trip_id))
                     else:
                         return jsonify({'success': False, 'message': f'{user.name} is already a participant'}) if request.headers.get('Content-Type') == 'application/json' else flash(f'{user.name} is already a participant', 'info')
@@ -351,9 +338,8 @@ def manage_participants(trip_id):
         elif action == 'remove_registered':
             user_id = request.form.get('user_id')
             
-            # Remove user from trip
-            if trip.remove_participant(user_id):
-                db.session.commit()
+            # Remove user from trip, retrying if the trip changed concurrently
+            if optimistic.run_write(lambda: trip.remove_participant(user_id)):
                 flash('Participant removed from the trip', 'success')
             else:
                 flash('Participant not found', 'error')
@@ -369,29 +355,20 @@ def manage_participants(trip_id):
                 flash('Participant not found', 'error')
         
         elif action == 'link_participant':
-            print(f"DEBUG: link_participant action triggered in manage_participants route")
-            print(f"DEBUG: Request headers: {dict(request.headers)}")
-            print(f"DEBUG: Request content type: {request.headers.get('Content-Type')}")
             # Handle both form data and JSON data (AJAX requests)
             if request.headers.get('Content-Type') == 'application/json':
-                print(f"DEBUG: Processing JSON request")
                 # AJAX request with JSON data
                 json_data = request.get_json()
-                print(f"DEBUG: JSON data received: {json_data}")
                 name = json_data.get('name')
                 email = json_data.get('email')
             else:
-                print(f"DEBUG: Processing form data")
                 # Regular form submission
                 name = request.form.get('name')
                 email = request.form.get('email')
             
-            print(f"DEBUG: Linking participant - name: '{name}', email: '{email}'")
-            print(f"DEBUG: Name type: {type(name)}, Name length: {len(name) if name else 0}")
-            
             # Validate that we have a name
             if not name or not name.strip():
-                print(f"DEBUG: Participant name is missing or empty")
+                logger.debug('Trip %s: link request without a participant name', trip_id)
                 # Check if this is an AJAX request
                 if request.headers.get('Content-Type') == 'application/json':
                     return jsonify({'success': False, 'message': 'Participant name is missing. Please try again.'}), 400
@@ -400,10 +377,9 @@ def manage_participants(trip_id):
                     return redirect(url_for('trips.manage_participants', trip_id=trip_id))
             
             # Find user by email (case-insensitive)
-            print(f"DEBUG: Searching for user with email: {email}")
             user = User.query.filter(func.lower(User.email) == func.lower(email)).first()
             if not user:
-                print(f"DEBUG: No user found with email: {email}")
+                logger.debug('Trip %s: link request for an unknown email', trip_id)
                 # Check if this is an AJAX request
                 if request.headers.get('Content-Type') == 'application/json':
                     return jsonify({'success': False, 'message': f'No user found with email: {email}'}), 404
@@ -411,20 +387,12 @@ def manage_participants(trip_id):
                     flash(f'No user found with email: {email}', 'error')
                     return redirect(url_for('trips.manage_participants', trip_id=trip_id))
             
-            print(f"DEBUG: Found user - id: {user.id}, name: {user.name}, email: {user.email}")
-            
             # Check if the user is a participant of this trip or is the admin
             participant_ids = trip.get_participants_list()
-            print(f"DEBUG: Trip participants: {participant_ids}")
-            print(f"DEBUG: Trip admin_id: {trip.admin_id}")
-            print(f"DEBUG: Checking if user {user.id} is in participants or is admin")
-            print(f"DEBUG: user.id: {user.id}, str(user.id): {str(user.id)}")
-            print(f"DEBUG: user.id != trip.admin_id: {user.id != trip.admin_id}")
-            print(f"DEBUG: str(user.id) in participant_ids: {str(user.id) in participant_ids}")
             
             # Check if user is already a participant in this trip
             if str(user.id) in participant_ids:
-                print(f"DEBUG: User {user.name} is already a participant in this trip")
+                logger.debug('Trip %s: user %s is already a participant', trip_id, user.id)
                 # Check if this is an AJAX request
                 if request.headers.get('Content-Type') == 'application/json':
                     return jsonify({'success': False, 'message': f'User {user.name} is already added in this trip'}), 400
@@ -434,7 +402,7 @@ def manage_participants(trip_id):
             
             # Check if user is the admin (admins are automatically participants)
             if user.id == trip.admin_id:
-                print(f"DEBUG: User {user.name} is the admin of this trip")
+                logger.debug('Trip %s: user %s is the admin', trip_id, user.id)
                 # Check if this is an AJAX request
                 if request.headers.get('Content-Type') == 'application/json':
                     return jsonify({'success': False, 'message': f'User {user.name} is already the admin of this trip'}), 400
@@ -446,20 +414,29 @@ def manage_participants(trip_id):
             # The name passed from the template is in display format (title case)
             # Convert to lowercase to match database storage format
             name_lower = name.strip().lower()
-            print(f"DEBUG: All validations passed, calling link_participant with name: '{name_lower}', user_id: {user.id}")
+            
+            # Rewriting every expense of a large trip can take a while; let AJAX clients hand it to a worker
+            if request.headers.get('Content-Type') == 'application/json' and jobs.wants_async():
+                job, created = jobs.enqueue(
+                    'link_participant',
+                    trip_id=trip.id,
+                    user_id=current_user.id,
+                    payload={'name': name_lower, 'user_id': user.id},
+                    dedup_key=f'link_participant:{trip.id}:{name_lower}'
+                )
+                return jobs.job_accepted(job, created)
+            
             result = trip.link_participant(name_lower, user.id)
-            print(f"DEBUG: link_participant result: {result}")
             
             if result:
                 db.session.commit()
-                print(f"DEBUG: Database commit completed")
                 # Check if this is an AJAX request
                 if request.headers.get('Content-Type') == 'application/json':
                     return jsonify({'success': True, 'message': f'Linked {name} to user {user.name}'})
                 else:
                     flash(f'Linked {name} to user {user.name}', 'success')
             else:
-                print(f"DEBUG: Failed to link {name} to user {user.name}")
+                logger.info('Trip %s: failed to link a participant to user %s', trip_id, user.id)
                 # Check if this is an AJAX request
                 if request.headers.get('Content-Type') == 'application/json':
                     return jsonify({'success': False, 'message': f'Failed to link {name} to user {user.name}'}), 400
@@ -467,78 +444,14 @@ def manage_participants(trip_id):
                     flash(f'Failed to link {name} to user {user.name}', 'error')
         
         elif action == 'sync_linked_participants':
-            # New action to synchronize all linked participants
-            print(f"DEBUG: sync_linked_participants action triggered")
-            
-            # Get all linked unregistered participants for this trip
-            linked_participants = trip.unregistered_participants_list.filter(UnregisteredParticipant.linked_user_id.isnot(None)).all()
-            
-            sync_count = 0
-            for linked_participant in linked_participants:
-                unregistered_id = f"unregistered_{linked_participant.name}"
-                user_id = str(linked_participant.linked_user_id)
-                
-                print(f"DEBUG: Syncing {unregistered_id} to user {user_id}")
-                
-                # Update all expenses
-                for expense in trip.expenses:
-                    updated = False
-                    
-                    # Update payer_id if it matches the unregistered participant ID
-                    if expense.payer_id == unregistered_id:
-                        expense.payer_id = user_id
-                        print(f"DEBUG: Updated payer_id from {unregistered_id} to {user_id} in expense {expense.id}")
-                        updated = True
-                    
-                    # Update participants list if it contains the unregistered participant ID
-                    participants = expense.get_participants_list()
-                    if unregistered_id in participants:
-                        participants.remove(unregistered_id)
-                        participants.append(user_id)
-                        expense.set_participants_list(participants)
-                        print(f"DEBUG: Updated participants list in expense {expense.id}")
-                        updated = True
-                    
-                    # Update shares to replace the unregistered participant with the registered user
-                    shares = expense.get_shares()
-                    if unregistered_id in shares:
-                        amount = shares.pop(unregistered_id)
-                        shares[user_id] = amount
-                        expense.set_shares(shares)
-                        print(f"DEBUG: Updated shares in expense {expense.id}")
-                        updated = True
-                    
-                    if updated:
-                        db.session.add(expense)
-                        sync_count += 1
-                
-                # Update advances
-                advances = trip.get_advances()
-                if unregistered_id in advances:
-                    amount = advances.pop(unregistered_id)
-                    advances[user_id] = amount
-                    trip.set_advances(advances)
-                    print(f"DEBUG: Updated advances for {unregistered_id} to {user_id}")
-                    sync_count += 1
-                
-                # Update general payments
-                payments = trip.get_general_payments()
-                payment_updated = False
-                for payment in payments:
-                    if payment.get('participant_id') == unregistered_id:
-                        payment['participant_id'] = user_id
-                        payment_updated = True
-                        print(f"DEBUG: Updated general payment for {unregistered_id} to {user_id}")
-                
-                if payment_updated:
-                    trip.set_general_payments(payments)
-                    sync_count += 1
-            
-            # Commit all changes
-            db.session.commit()
+            # Re-point records of linked participants, matching every stored form of their id
+            sync_count, _ = trip.sync_linked_participants()
+            sync_count = sync_count or 0
+            if sync_count:
+                db.session.commit()
             
             flash(f'Synchronized {sync_count} linked participant records', 'success')
-            print(f"DEBUG: Synchronization completed. {sync_count} records updated.")
+            logger.info('Trip %s: synchronized %d linked participant records', trip_id, sync_count)
         
         # For AJAX requests, return JSON response
         if request.headers.get('Content-Type') == 'application/json':
@@ -585,12 +498,12 @@ def delete_trip(trip_id):
 
 @trips_bp.route('/<int:trip_id>/advances', methods=['GET', 'POST'])
 @login_required
+@idempotency.idempotent
 def manage_advances(trip_id):
     trip = Trip.query.get_or_404(trip_id)
     
     # Check if user is a participant or admin
-    participants = trip.get_participants_list()
-    if str(current_user.id) not in participants and current_user.id != trip.admin_id:
+    if not trip_access.can_access(trip.id):
         flash('You do not have access to this trip', 'error')
         return redirect(url_for('trips.list_trips'))
     
@@ -618,7 +531,6 @@ def manage_advances(trip_id):
             amount = request.form.get('amount')
             
             try:
-                print(f"Adding advance for participant ID: {participant_id}, type: {type(participant_id)}")
                 
                 # Handle participant_id
                 if participant_id is None:
@@ -630,9 +542,8 @@ def manage_advances(trip_id):
                     flash('Amount must be greater than zero', 'error')
                     return redirect(url_for('trips.manage_advances', trip_id=trip_id))
                 
-                # Add advance payment
-                trip.add_advance(participant_id, amount)
-                db.session.commit()
+                # Add advance payment; adding commutes, so a concurrent change is retried
+                optimistic.run_write(lambda: trip.add_advance(participant_id, amount))
                 
                 # Recalculate all balances to ensure consistency
                 balances = trip.recalculate_all_balances()
@@ -642,7 +553,6 @@ def manage_advances(trip_id):
                     name = participant_id.replace('unregistered_', '')
                     # Display name in title case
                     display_name = trip.get_unregistered_participant_display_name(name)
-                    print(f"Detected unregistered participant with name: {name}")
                     flash(f'Added advance payment of ₹{amount} for {display_name}', 'success')
                 else:
                     user = registered_map.get(participant_id)
@@ -669,12 +579,11 @@ def manage_advances(trip_id):
                 current_amount = advances.get(participant_id, 0)
                 amount_difference = amount - current_amount
                 
-                # Edit advance payment
-                if not trip.edit_advance(participant_id, amount):
+                # Edit advance payment; the amount replaces the one the user saw
+                optimistic.check_version(trip, request.form.get('version'))
+                if not optimistic.run_write(lambda: trip.edit_advance(participant_id, amount), retries=0):
                     flash('Advance payment not found', 'error')
                     return redirect(url_for('trips.manage_advances', trip_id=trip_id))
-                    
-                db.session.commit()
                 
                 # Recalculate all balances to ensure consistency
                 balances = trip.recalculate_all_balances()
@@ -700,21 +609,11 @@ def manage_advances(trip_id):
             participant_id = request.form.get('participant_id')
             
             try:
-                print(f"Attempting to delete advance for participant ID: {participant_id}")
-                # Debug the advance data
-                advances = trip.get_advances()
-                if participant_id in advances:
-                    print(f"Advance to delete: {advances[participant_id]} for participant {participant_id}")
-                else:
-                    print(f"No advance found for participant: {participant_id}")
-                    print(f"Available advances: {advances}")
-                
                 # Delete advance payment
-                if not trip.delete_advance(participant_id):
+                optimistic.check_version(trip, request.form.get('version'))
+                if not optimistic.run_write(lambda: trip.delete_advance(participant_id), retries=0):
                     flash('Advance payment not found', 'error')
                     return redirect(url_for('trips.manage_advances', trip_id=trip_id))
-                    
-                db.session.commit()
                 
                 # Recalculate all balances to ensure consistency
                 balances = trip.recalculate_all_balances()
@@ -732,6 +631,8 @@ def manage_advances(trip_id):
                     
                 return redirect(url_for('trips.manage_advances', trip_id=trip_id))
                 
+            except optimistic.WriteConflict:
+                raise
             except Exception as e:
                 db.session.rollback()
                 flash(f'Error deleting advance payment: {str(e)}', 'error')
@@ -774,12 +675,12 @@ def manage_advances(trip_id):
 
 @trips_bp.route('/<int:trip_id>/payments', methods=['GET', 'POST'])
 @login_required
+@idempotency.idempotent
 def manage_payments(trip_id):
     trip = Trip.query.get_or_404(trip_id)
     
     # Check if user is a participant or admin
-    participants = trip.get_participants_list()
-    if str(current_user.id) not in participants and current_user.id != trip.admin_id:
+    if not trip_access.can_access(trip.id):
         flash('You do not have access to this trip', 'error')
         return redirect(url_for('trips.list_trips'))
     
@@ -917,9 +818,10 @@ def manage_payments(trip_id):
                 
                 date = datetime.strptime(date_str, '%Y-%m-%d')
                 
-                # Add general payment
-                trip.add_general_payment(participant_id, amount, description, date, expense_id)
-                db.session.commit()
+                # Add general payment; appending commutes, so a concurrent change is retried
+                optimistic.run_write(
+                    lambda: trip.add_general_payment(participant_id, amount, description, date, expense_id)
+                )
                 
                 # Recalculate all balances to ensure consistency
                 balances = trip.recalculate_all_balances()
@@ -957,12 +859,14 @@ def manage_payments(trip_id):
                 
                 date = datetime.strptime(date_str, '%Y-%m-%d')
                 
-                # Edit general payment
-                if not trip.edit_general_payment(payment_index, participant_id, amount, description, date, expense_id):
+                # Edit general payment; the index is only valid for the version the user saw
+                optimistic.check_version(trip, request.form.get('version'))
+                if not optimistic.run_write(
+                    lambda: trip.edit_general_payment(payment_index, participant_id, amount, description, date, expense_id),
+                    retries=0
+                ):
                     flash('Payment not found', 'error')
                     return redirect(url_for('trips.manage_payments', trip_id=trip_id))
-                    
-                db.session.commit()
                 
                 # Recalculate all balances to ensure consistency
                 balances = trip.recalculate_all_balances()
@@ -978,20 +882,11 @@ def manage_payments(trip_id):
             payment_index = int(request.form.get('payment_index'))
             
             try:
-                print(f"Attempting to delete payment at index: {payment_index}")
-                # Debug the payment data
-                all_payments = trip.get_general_payments()
-                if 0 <= payment_index < len(all_payments):
-                    print(f"Payment to delete: {all_payments[payment_index]}")
-                else:
-                    print(f"Invalid payment index: {payment_index}, total payments: {len(all_payments)}")
-                
-                # Delete general payment
-                if not trip.delete_general_payment(payment_index):
+                # Delete general payment; the index is only valid for the version the user saw
+                optimistic.check_version(trip, request.form.get('version'))
+                if not optimistic.run_write(lambda: trip.delete_general_payment(payment_index), retries=0):
                     flash('Invalid payment index', 'error')
                     return redirect(url_for('trips.manage_payments', trip_id=trip_id))
-                    
-                db.session.commit()
                 
                 # Recalculate all balances to ensure consistency
                 balances = trip.recalculate_all_balances()
@@ -999,6 +894,8 @@ def manage_payments(trip_id):
                 flash('Payment deleted successfully', 'success')
                 return redirect(url_for('trips.manage_payments', trip_id=trip_id))
                 
+            except optimistic.WriteConflict:
+                raise
             except Exception as e:
                 db.session.rollback()
                 flash(f'Error deleting payment: {str(e)}', 'error')
@@ -1021,14 +918,34 @@ def manage_payments(trip_id):
                           total_payment_count=total_payment_count,
                           total_payment_amount=total_payment_amount)
 
+@trips_bp.route('/<int:trip_id>/events')
+@login_required
+def trip_events(trip_id):
+    """Server-Sent Events stream of the trip's expense, balance and settlement changes"""
+    trip = Trip.query.get_or_404(trip_id)
+
+    # Check if user is a participant or admin
+    if not trip_access.can_access(trip.id):
+        return jsonify({'success': False, 'message': 'You do not have access to this trip'}), 403
+
+    last_event_id = request.headers.get('Last-Event-ID', '').strip()
+    last_event_id = int(last_event_id) if last_event_id.isdigit() else None
+
+    # The stream stays open for minutes and must not hold a database connection
+    db.session.close()
+    return Response(
+        stream_with_context(live_updates.stream(trip.id, last_event_id)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @trips_bp.route('/<int:trip_id>/settlements')
 @login_required
 def view_settlements(trip_id):
     trip = Trip.query.get_or_404(trip_id)
     
     # Check if user is a participant or admin
-    participants = trip.get_participants_list()
-    if str(current_user.id) not in participants and current_user.id != trip.admin_id:
+    if not trip_access.can_access(trip.id):
         flash('You do not have access to this trip', 'error')
         return redirect(url_for('trips.list_trips'))
     
@@ -1128,44 +1045,111 @@ def view_settlements(trip_id):
 @login_required
 def export_pdf(trip_id):
     """Export settlements as PDF"""
-    from expense_tracker.backend.utils.pdf_generator import generate_settlement_pdf
+    from backend.utils import trip_report
     
     trip = Trip.query.get_or_404(trip_id)
     
     # Check if user is a participant
-    participants = trip.get_participants_list()
-    if str(current_user.id) not in participants and current_user.id != trip.admin_id:
+    if not trip_access.can_access(trip.id):
         flash('You do not have access to this trip', 'error')
         return redirect(url_for('trips.list_trips'))
     
-    # Calculate settlements
-    settlements = trip.calculate_settlements()
+    # The ETag identifies the trip data and report layout the PDF was built from
+    data_version = trip.get_data_version()
+    etag = f'{data_version}-v{trip_report.PDF_TEMPLATE_VERSION}'
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        return response
     
-    # Calculate individual balances
-    balances = {}
-    for participant_id in participants:
-        balances[participant_id] = trip.calculate_user_balance(int(participant_id))
+    # In async mode the PDF is rendered into the cache by a worker; downloading
+    # afterwards is then a cache hit
+    if jobs.wants_async():
+        job, created = jobs.enqueue('render_settlement_pdf', trip_id=trip.id, user_id=current_user.id)
+        return jobs.job_accepted(job, created)
     
-    # Add admin if not already in participants
-    if str(trip.admin_id) not in participants:
-        balances[str(trip.admin_id)] = trip.calculate_user_balance(trip.admin_id)
+    # Serve the cached PDF for this data version, generating it on a miss
+    pdf_path = trip_report.settlement_pdf(trip, data_version)
+    
+    # Send the PDF as a downloadable file
+    return send_file(
+        pdf_path,
+        mimetype='application/pdf',
+        as_attachment=True,
+        download_name=f'settlement_report_{trip.name.replace(" ", "_")}.pdf',
+        etag=etag,
+        last_modified=os.path.getmtime(pdf_path),
+        max_age=0
+    )
+
+def _report_payload(trip, status, path):
+    """JSON description of a trip report's rendering state"""
+    from backend.utils import trip_report
+    payload = {
+        'status': status,
+        'status_url': url_for('trips.trip_report_status', trip_id=trip.id)
+    }
+    if status == 'ready':
+        payload['download_url'] = url_for('trips.download_trip_report', trip_id=trip.id)
+    elif status == 'failed':
+        payload['error'] = trip_report.report_error(path)
+    return payload
+
+@trips_bp.route('/<int:trip_id>/report', methods=['POST'])
+@login_required
+def start_trip_report(trip_id):
+    """Start rendering the full itemized trip report"""
+    from backend.utils import trip_report
+    trip = Trip.query.get_or_404(trip_id)
+    
+    # Check if user is a participant or admin
+    if not trip_access.can_access(trip.id):
+        return jsonify({'success': False, 'message': 'You do not have access to this trip'}), 403
     
-    # Create a user map for easy lookup
-    users = User.query.filter(User.id.in_([int(pid) for pid in participants] + [trip.admin_id])).all()
-    user_map = {str(user.id): user.name for user in users}
+    status, path = trip_report.start_report(trip)
+    return jsonify(_report_payload(trip, status, path)), 202 if status == 'pending' else 200
+
+@trips_bp.route('/<int:trip_id>/report/status')
+@login_required
+def trip_report_status(trip_id):
+    """Poll the rendering state of the full trip report"""
+    from backend.utils import trip_report
+    trip = Trip.query.get_or_404(trip_id)
     
-    # Generate PDF
-    pdf_content = generate_settlement_pdf(trip, settlements, balances, user_map)
+    # Check if user is a participant or admin
+    if not trip_access.can_access(trip.id):
+        return jsonify({'success': False, 'message': 'You do not have access to this trip'}), 403
     
-    # Create a BytesIO object
-    pdf_io = BytesIO(pdf_content)
+    path = trip_report.report_path(trip)
+    return jsonify(_report_payload(trip, trip_report.report_status(path), path))
+
+@trips_bp.route('/<int:trip_id>/report/download')
+@login_required
+def download_trip_report(trip_id):
+    """Download the rendered full trip report"""
+    from backend.utils import trip_report
+    
+    trip = Trip.query.get_or_404(trip_id)
+    
+    # Check if user is a participant or admin
+    if not trip_access.can_access(trip.id):
+        flash('You do not have access to this trip', 'error')
+        return redirect(url_for('trips.list_trips'))
+    
+    data_version = trip.get_data_version()
+    path = trip_report.report_path(trip, data_version)
+    if trip_report.report_status(path) != 'ready':
+        flash('The trip report is not ready yet. Please try again in a moment.', 'info')
+        return redirect(url_for('trips.view_settlements', trip_id=trip_id))
     
-    # Send the PDF as a downloadable file
     return send_file(
-        pdf_io,
+        path,
         mimetype='application/pdf',
         as_attachment=True,
-        download_name=f'settlement_report_{trip.name.replace(" ", "_")}.pdf'
+        download_name=f'trip_report_{trip.name.replace(" ", "_")}.pdf',
+        etag=f'{data_version}-v{trip_report.REPORT_TEMPLATE_VERSION}',
+        last_modified=os.path.getmtime(path),
+        max_age=0
     )
 
 @trips_bp.route('/<int:trip_id>/sync-linked-participants', methods=['POST'])
@@ -1178,109 +1162,23 @@ def sync_linked_participants(trip_id):
     if trip.admin_id != current_user.id:
         return jsonify({'success': False, 'message': 'You do not have permission to perform this action'}), 403
     
+    if jobs.wants_async():
+        job, created = jobs.enqueue('sync_linked_participants', trip_id=trip.id, user_id=current_user.id)
+        return jobs.job_accepted(job, created)
+    
     try:
-        # Get all linked unregistered participants for this trip
-        linked_participants = trip.unregistered_participants_list.filter(UnregisteredParticipant.linked_user_id.isnot(None)).all()
-        
-        print(f"DEBUG: Found {len(linked_participants)} linked participants for trip {trip_id}")
-        
-        if not linked_participants:
+        sync_count, updated_expenses = trip.sync_linked_participants()
+        if sync_count is None:
             return jsonify({
                 'success': True, 
                 'message': 'No linked participants found for this trip',
                 'sync_count': 0
             })
         
-        sync_count = 0
-        updated_expenses = []
-        
-        # For each linked participant, check the expense table for references
-        for linked_participant in linked_participants:
-            # The database stores names in lowercase, but expense records might use original case
-            # So we need to check for both formats
-            unregistered_ids_to_check = [
-                f"unregistered_{linked_participant.name}",  # lowercase version (database format)
-                f"unregistered_{linked_participant.name.title()}",  # Title case version
-                f"unregistered_{linked_participant.name.upper()}",  # Uppercase version
-                f"unregistered_{linked_participant.name.capitalize()}"  # Capitalized version
-            ]
-            
-            user_id = str(linked_participant.linked_user_id)
-            
-            print(f"DEBUG: Checking for references to {linked_participant.name} (linked to user {user_id}) in expenses")
-            print(f"DEBUG: Will check for these IDs: {unregistered_ids_to_check}")
-            
-            # Check all expenses in this trip for references to this unregistered participant
-            for expense in trip.expenses:
-                expense_updated = False
-                
-                # Check if this expense references the unregistered participant in any format
-                for unregistered_id in unregistered_ids_to_check:
-                    # 1. Check payer_id
-                    if expense.payer_id == unregistered_id:
-                        expense.payer_id = user_id
-                        print(f"DEBUG: Updated payer_id in expense {expense.id} from {unregistered_id} to {user_id}")
-                        expense_updated = True
-                    
-                    # 2. Check participants list
-                    participants = expense.get_participants_list()
-                    if unregistered_id in participants:
-                        participants.remove(unregistered_id)
-                        participants.append(user_id)
-                        expense.set_participants_list(participants)
-                        print(f"DEBUG: Updated participants list in expense {expense.id}")
-                        expense_updated = True
-                    
-                    # 3. Check shares
-                    shares = expense.get_shares()
-                    if unregistered_id in shares:
-                        amount = shares.pop(unregistered_id)
-                        shares[user_id] = amount
-                        expense.set_shares(shares)
-                        print(f"DEBUG: Updated shares in expense {expense.id}")
-                        expense_updated = True
-                
-                # If this expense was updated, add it to the session
-                if expense_updated:
-                    db.session.add(expense)
-                    if expense.id not in updated_expenses:
-                        updated_expenses.append(expense.id)
-                    sync_count += 1
-            
-            # Check advances for this unregistered participant (check all formats)
-            advances = trip.get_advances()
-            advance_updated = False
-            for unregistered_id in unregistered_ids_to_check:
-                if unregistered_id in advances:
-                    amount = advances.pop(unregistered_id)
-                    advances[user_id] = amount
-                    advance_updated = True
-                    print(f"DEBUG: Updated advances for {unregistered_id} to {user_id}")
-            
-            if advance_updated:
-                trip.set_advances(advances)
-                sync_count += 1
-            
-            # Check general payments for this unregistered participant (check all formats)
-            payments = trip.get_general_payments()
-            payment_updated = False
-            for payment in payments:
-                for unregistered_id in unregistered_ids_to_check:
-                    if payment.get('participant_id') == unregistered_id:
-                        payment['participant_id'] = user_id
-                        payment_updated = True
-                        print(f"DEBUG: Updated general payment for {unregistered_id} to {user_id}")
-            
-            if payment_updated:
-                trip.set_general_payments(payments)
-                sync_count += 1
-        
         # Commit all changes
         if sync_count > 0:
             db.session.commit()
-            print(f"DEBUG: Committed {sync_count} updates to database")
-        else:
-            print(f"DEBUG: No updates needed")
+        logger.info('Trip %s: synchronized %d linked participant records', trip.id, sync_count)
         
         message = f'Successfully synchronized {sync_count} linked participant records across {len(updated_expenses)} expenses'
         if sync_count == 0:
@@ -1295,9 +1193,7 @@ def sync_linked_participants(trip_id):
         
     except Exception as e:
         db.session.rollback()
-        print(f"Error during synchronization: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception('Trip %s: error synchronizing linked participants', trip.id)
         return jsonify({'success': False, 'message': f'Error during synchronization: {str(e)}'}), 500
 
 @trips_bp.route('/<int:trip_id>/sync-balances', methods=['POST'])
@@ -1311,6 +1207,10 @@ def sync_trip_balances(trip_id):
         flash('You do not have permission to sync this trip', 'error')
         return redirect(url_for('trips.view_trip', trip_id=trip_id))
     
+    if jobs.wants_async():
+        job, created = jobs.enqueue('sync_balances', trip_id=trip.id, user_id=current_user.id)
+        return jobs.job_accepted(job, created)
+    
     try:
         # Recalculate all balances
         balances = trip.recalculate_all_balances()
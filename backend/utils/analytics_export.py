@@ -0,0 +1,158 @@
+import csv
+from backend.database import db
+from backend.models.expense import Expense
+from backend.models.trip import Trip
+from backend.utils.export import NameResolver
+
+# Ledger columns and their Arrow types. One row is written per participant
+# share; expenses without any shares get a single row with empty share fields.
+LEDGER_COLUMNS = [
+    ('expense_id', 'int64'),
+    ('trip_id', 'int64'),
+    ('trip_name', 'string'),
+    ('date', 'date32'),
+    ('description', 'string'),
+    ('category', 'string'),
+    ('currency', 'string'),
+    ('split_method', 'string'),
+    ('amount', 'float64'),
+    ('payer_id', 'string'),
+    ('payer_name', 'string'),
+    ('participant_id', 'string'),
+    ('participant_name', 'string'),
+    ('share', 'float64'),
+]
+
+LEDGER_FORMATS = {
+    'parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'arrow': ('arrow', 'application/vnd.apache.arrow.file'),
+    'csv': ('csv', 'text/csv'),
+}
+
+DEFAULT_BATCH_SIZE = 10000
+
+
+def load_pyarrow():
+    """Return the pyarrow module, or None when it is not installed"""
+    try:
+        import pyarrow
+    except ImportError:
+        return None
+    return pyarrow
+
+
+def ledger_schema(pa):
+    """Build the typed Arrow schema for the ledger"""
+    return pa.schema([(name, getattr(pa, type_name)()) for name, type_name in LEDGER_COLUMNS])
+
+
+def iter_ledger_rows(trip_ids=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Yield one ledger row per expense share for the given trips (all trips if None)"""
+    trip_query = db.session.query(Trip.id, Trip.name)
+    expense_query = Expense.query
+    if trip_ids is not None:
+        if not trip_ids:
+            return
+        trip_query = trip_query.filter(Trip.id.in_(trip_ids))
+        expense_query = expense_query.filter(Expense.trip_id.in_(trip_ids))
+    trip_names = dict(trip_query.all())
+
+    resolver = NameResolver()
+    expenses = expense_query.order_by(Expense.trip_id, Expense.id).yield_per(batch_size)
+    for expense in expenses:
+        row = {
+            'expense_id': expense.id,
+            'trip_id': expense.trip_id,
+            'trip_name': trip_names.get(expense.trip_id),
+            'date': expense.date.date() if expense.date else None,
+            'description': expense.description,
+            'category': expense.category,
+            'currency': expense.currency,
+            'split_method': expense.split_method,
+            'amount': expense.amount,
+            'payer_id': expense.payer_id,
+            'payer_name': resolver.name(expense.payer_id),
+            'participant_id': None,
+            'participant_name': None,
+            'share': None,
+        }
+        shares = expense.get_shares()
+        if not shares:
+            yield row
+            continue
+        for participant_id, share in shares.items():
+            yield dict(
+                row,
+                participant_id=participant_id,
+                participant_name=resolver.name(participant_id),
+                share=float(share)
+            )
+
+
+def _write_columnar(pa, rows, output_path, fmt, batch_size):
+    """Write rows as Parquet or Arrow IPC, one record batch at a time"""
+    schema = ledger_schema(pa)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        sink = None
+        writer = pq.ParquetWriter(output_path, schema)
+
+        def write_batch(batch):
+            writer.write_table(pa.Table.from_batches([batch], schema=schema))
+    else:
+        sink = pa.OSFile(output_path, 'wb')
+        writer = pa.ipc.new_file(sink, schema)
+        write_batch = writer.write_batch
+
+    columns = {name: [] for name in schema.names}
+
+    def flush():
+        arrays = [pa.array(columns[field.name], type=field.type) for field in schema]
+        write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+        for values in columns.values():
+            values.clear()
+
+    row_count = 0
+    try:
+        for row in rows:
+            for name, values in columns.items():
+                values.append(row[name])
+            row_count += 1
+            if row_count % batch_size == 0:
+                flush()
+        if columns['expense_id']:
+            flush()
+    finally:
+        writer.close()
+        if sink is not None:
+            sink.close()
+    return row_count
+
+
+def _write_csv(rows, output_path):
+    fieldnames = [name for name, _ in LEDGER_COLUMNS]
+    row_count = 0
+    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            row_count += 1
+    return row_count
+
+
+def write_ledger(output_path, fmt='parquet', trip_ids=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Write the expense/share ledger to output_path.
+
+    Falls back to CSV when pyarrow is not installed. Returns a tuple of
+    (format actually written, number of rows).
+    """
+    if fmt not in LEDGER_FORMATS:
+        raise ValueError(f"Unsupported ledger format: {fmt}")
+
+    rows = iter_ledger_rows(trip_ids, batch_size)
+    if fmt != 'csv':
+        pa = load_pyarrow()
+        if pa is not None:
+            return fmt, _write_columnar(pa, rows, output_path, fmt, batch_size)
+    return 'csv', _write_csv(rows, output_path)
@@ -0,0 +1,153 @@
+"""
+Online backfills: rewrite rows in small, throttled, resumable batches.
+
+A Backfill names a table, the columns it reads and a transform(row) that
+returns the changed values of a row (or None to leave it alone). run() walks
+the table in primary key order. Each batch is one short transaction that
+updates the changed rows and advances the checkpoint, so an interrupted
+backfill resumes after the last committed batch and never processes a row
+twice. Between batches it sleeps, and it halves the batch size when a batch
+takes longer than max_batch_seconds, so the app's own writes keep getting
+the database.
+"""
+import logging
+import time
+from datetime import datetime
+from sqlalchemy import Column, DateTime, Integer, String, Table, bindparam, column, select, table
+from sqlalchemy.exc import OperationalError
+from backend.utils import sqlite_mode
+from backend.utils.migrations import metadata
+
+logger = logging.getLogger(__name__)
+
+backfill_progress = Table(
+    'backfill_progress', metadata,
+    Column('name', String(200), primary_key=True),
+    Column('last_key', Integer, nullable=True),
+    Column('rows_scanned', Integer, nullable=False, default=0),
+    Column('rows_updated', Integer, nullable=False, default=0),
+    Column('started_at', DateTime, nullable=False),
+    Column('updated_at', DateTime, nullable=False),
+    Column('finished_at', DateTime, nullable=True),
+)
+
+# Attempts at a batch that hits a locked SQLite database before giving up
+LOCKED_BATCH_RETRIES = 5
+
+
+class Backfill:
+    """A data migration over one table with an integer primary key"""
+
+    def __init__(self, name, table_name, columns, transform, key='id'):
+        self.name = name
+        self.table_name = table_name
+        self.columns = list(columns)
+        self.transform = transform
+        self.key = key
+
+    def table(self):
+        return table(self.table_name, column(self.key), *(column(name) for name in self.columns))
+
+
+def progress(engine, name):
+    """Checkpoint of a backfill as a dict, or None when it never ran"""
+    metadata.create_all(engine, tables=[backfill_progress])
+    with engine.connect() as connection:
+        row = connection.execute(select(backfill_progress).where(backfill_progress.c.name == name)).first()
+    return dict(row._mapping) if row else None
+
+
+def _save_progress(connection, name, values, exists):
+    values = dict(values, updated_at=datetime.utcnow())
+    if exists:
+        connection.execute(backfill_progress.update().where(backfill_progress.c.name == name).values(**values))
+    else:
+        connection.execute(backfill_progress.insert().values(name=name, started_at=values['updated_at'], **values))
+
+
+def _run_batch(engine, backfill, state, batch_size):
+    """Process the rows after state['last_key']; returns the state after the committed batch"""
+    source = backfill.table()
+    key = source.c[backfill.key]
+    query = select(source).order_by(key).limit(batch_size)
+    if state['last_key'] is not None:
+        query = query.where(key > state['last_key'])
+
+    # Parameters are prefixed because names of SET columns are reserved in UPDATE statements
+    statement = source.update().where(key == bindparam('b_key')).values(
+        {name: bindparam(f'b_{name}') for name in backfill.columns}
+    )
+
+    new_state = dict(state)
+    with engine.begin() as connection:
+        rows = connection.execute(query).fetchall()
+        updates = []
+        for row in rows:
+            values = dict(row._mapping)
+            changes = backfill.transform(values)
+            if changes:
+                values.update(changes)
+                params = {f'b_{name}': values[name] for name in backfill.columns}
+                params['b_key'] = values[backfill.key]
+                updates.append(params)
+        if updates:
+            connection.execute(statement, updates)
+
+        if rows:
+            new_state['last_key'] = rows[-1]._mapping[backfill.key]
+            new_state['rows_scanned'] += len(rows)
+            new_state['rows_updated'] += len(updates)
+        else:
+            new_state['finished_at'] = datetime.utcnow()
+        exists = new_state.pop('exists')
+        _save_progress(connection, backfill.name, new_state, exists)
+    new_state['exists'] = True
+    return new_state
+
+
+def run(engine, backfill, batch_size=1000, sleep=0.1, max_batch_seconds=1.0, max_batches=None, restart=False):
+    """Run or resume a backfill; returns its checkpoint"""
+    current = progress(engine, backfill.name)
+    if current and restart:
+        with engine.begin() as connection:
+            connection.execute(backfill_progress.delete().where(backfill_progress.c.name == backfill.name))
+        current = None
+    if current and current['finished_at']:
+        return current
+
+    state = {
+        'last_key': current['last_key'] if current else None,
+        'rows_scanned': current['rows_scanned'] if current else 0,
+        'rows_updated': current['rows_updated'] if current else 0,
+        'finished_at': None,
+        'exists': current is not None,
+    }
+    size = batch_size
+    batches = 0
+    while not state['finished_at'] and (max_batches is None or batches < max_batches):
+        started = time.perf_counter()
+        for attempt in range(LOCKED_BATCH_RETRIES):
+            try:
+                state = _run_batch(engine, backfill, state, size)
+                break
+            except OperationalError as e:
+                if not sqlite_mode.is_locked_error(e) or attempt == LOCKED_BATCH_RETRIES - 1:
+                    raise
+                logger.warning('Backfill %s: database locked, retrying batch', backfill.name)
+                time.sleep(sleep * (2 ** attempt) or 0.05)
+        elapsed = time.perf_counter() - started
+        batches += 1
+
+        # Adapt the batch size so each transaction stays short under the current load
+        if elapsed > max_batch_seconds and size > 1:
+            size = max(1, size // 2)
+        elif elapsed < max_batch_seconds / 4 and size < batch_size:
+            size = min(batch_size, size * 2)
+        logger.info(
+            'Backfill %s: %d row(s) scanned, %d updated, last %s %s, batch took %.2fs, next batch %d rows',
+            backfill.name, state['rows_scanned'], state['rows_updated'], backfill.key, state['last_key'], elapsed, size
+        )
+        if not state['finished_at'] and sleep:
+            time.sleep(sleep)
+
+    return progress(engine, backfill.name)
@@ -0,0 +1,148 @@
+"""
+Change log and delta sync for offline-first clients.
+
+A flush hook appends a change_log row for every insert, update and delete of
+a trip, an expense, an unregistered participant or a trip membership, in the
+same transaction as the change. ChangeLog.seq grows with every row, so a
+client that keeps the highest seq it has seen (its cursor) can ask for
+everything after it. delta() coalesces those rows into the current state of
+each changed row, plus tombstones for the deleted ones. Advances and
+general payments are fields of the trip and arrive with it.
+
+A client without a cursor gets a snapshot() of all its trips. When it is
+added to a trip it gets that trip's full contents. When it loses access, or
+the trip is deleted, it gets a tombstone for the trip and should drop the
+trip's expenses and participants with it.
+
+On SQLite, writers commit one at a time, so seq order is commit order. A
+database with concurrent writers can commit a lower seq after a higher one.
+SYNC_SETTLE_SECONDS holds back changes that recent so slow commits are not
+skipped.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import and_, event, func, or_
+from backend.database import db
+from backend.models.change_log import ChangeLog
+from backend.models.expense import Expense
+from backend.models.trip import Trip
+from backend.models.unregistered_participant import UnregisteredParticipant
+
+# Synced tables and their key in sync responses
+SYNCED = {
+    'trip': ('trips', Trip),
+    'expense': ('expenses', Expense),
+    'unregistered_participant': ('participants', UnregisteredParticipant),
+}
+MEMBERSHIP_TABLE = 'trip_member'
+
+_settings = {
+    'page_size': 500,
+    'settle_seconds': 0.0,
+}
+
+
+def _entry(op, instance):
+    table = getattr(instance, '__tablename__', None)
+    if table == MEMBERSHIP_TABLE:
+        return {'table_name': table, 'row_id': instance.user_id, 'trip_id': instance.trip_id, 'op': op}
+    if table not in SYNCED or instance.id is None:
+        return None
+    trip_id = instance.id if table == 'trip' else instance.trip_id
+    return {'table_name': table, 'row_id': instance.id, 'trip_id': trip_id, 'op': op}
+
+
+@event.listens_for(db.session, 'after_flush')
+def _record_changes(session, flush_context):
+    """Log the flushed changes in the flushing transaction"""
+    updated = [instance for instance in session.dirty if session.is_modified(instance, include_collections=False)]
+    entries = [
+        entry
+        for op, instances in ((ChangeLog.INSERT, session.new), (ChangeLog.UPDATE, updated), (ChangeLog.DELETE, session.deleted))
+        for entry in (_entry(op, instance) for instance in instances)
+        if entry is not None
+    ]
+    if entries:
+        now = datetime.utcnow()
+        session.connection().execute(ChangeLog.__table__.insert(), [dict(entry, changed_at=now) for entry in entries])
+
+
+def current_cursor():
+    return db.session.query(func.max(ChangeLog.seq)).scalar() or 0
+
+
+def _empty_response(cursor, full):
+    response = {'cursor': str(cursor), 'full': full, 'has_more': False}
+    for key, _ in SYNCED.values():
+        response[key] = []
+    response['deleted'] = {key: [] for key, _ in SYNCED.values()}
+    return response
+
+
+def _trip_contents(response, trip_ids):
+    """Add the trips with all their expenses and participants to a response"""
+    if not trip_ids:
+        return
+    response['trips'].extend(trip.to_dict() for trip in Trip.query.filter(Trip.id.in_(trip_ids)).order_by(Trip.id))
+    response['expenses'].extend(
+        expense.to_dict() for expense in Expense.query.filter(Expense.trip_id.in_(trip_ids)).order_by(Expense.id)
+    )
+    response['participants'].extend(
+        participant.to_dict() for participant in
+        UnregisteredParticipant.query.filter(UnregisteredParticipant.trip_id.in_(trip_ids)).order_by(UnregisteredParticipant.id)
+    )
+
+
+def snapshot(trip_ids):
+    """Everything in the given trips, with the cursor to continue from"""
+    # The cursor is read first: a change committed meanwhile is sent again, never missed
+    response = _empty_response(current_cursor(), full=True)
+    _trip_contents(response, list(trip_ids))
+    return response
+
+
+def delta(user_id, trip_ids, since):
+    """Changes after the cursor since to the given trips of a user, at most one page of log rows"""
+    trip_ids = set(trip_ids)
+    query = ChangeLog.query.filter(ChangeLog.seq > since).filter(or_(
+        and_(ChangeLog.trip_id.in_(trip_ids), ChangeLog.table_name != MEMBERSHIP_TABLE),
+        and_(ChangeLog.table_name == MEMBERSHIP_TABLE, ChangeLog.row_id == user_id),
+    ))
+    if _settings['settle_seconds'] > 0:
+        query = query.filter(ChangeLog.changed_at <= datetime.utcnow() - timedelta(seconds=_settings['settle_seconds']))
+    rows = query.order_by(ChangeLog.seq).limit(_settings['page_size'] + 1).all()
+    has_more = len(rows) > _settings['page_size']
+    rows = rows[:_settings['page_size']]
+
+    response = _empty_response(rows[-1].seq if rows else since, full=False)
+    response['has_more'] = has_more
+
+    # The last operation on each row decides whether it is sent or tombstoned
+    latest = {}
+    for row in rows:
+        latest[(row.table_name, row.row_id)] = row
+    joined = {row.trip_id for (table, _), row in latest.items() if table == MEMBERSHIP_TABLE and row.trip_id in trip_ids}
+    left = {row.trip_id for (table, _), row in latest.items() if table == MEMBERSHIP_TABLE and row.trip_id not in trip_ids}
+
+    _trip_contents(response, sorted(joined))
+    response['deleted']['trips'].extend(sorted(left))
+
+    for table, (key, model) in SYNCED.items():
+        changed = {
+            row_id: row for (row_table, row_id), row in latest.items()
+            if row_table == table and row.trip_id not in joined and row.trip_id not in left
+        }
+        live_ids = [row_id for row_id, row in changed.items() if row.op != ChangeLog.DELETE]
+        instances = {instance.id: instance for instance in model.query.filter(model.id.in_(live_ids))} if live_ids else {}
+        for row_id in sorted(changed):
+            instance = instances.get(row_id)
+            # A row missing now was deleted by a change after this page
+            if instance is None:
+                response['deleted'][key].append(row_id)
+            else:
+                response[key].append(instance.to_dict())
+    return response
+
+
+def init_app(app):
+    _settings['page_size'] = app.config['SYNC_PAGE_SIZE']
+    _settings['settle_seconds'] = app.config['SYNC_SETTLE_SECONDS']
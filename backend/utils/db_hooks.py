@@ -0,0 +1,57 @@
+from collections import namedtuple
+from sqlalchemy import event
+from backend.database import db
+
+# A model instance written in a committed transaction. Values are captured at
+# flush time because instances are expired (or detached) once the commit ends.
+Change = namedtuple('Change', ['op', 'table', 'id', 'trip_id'])
+
+_commit_callbacks = []
+
+
+def on_commit(callback):
+    """Register callback(changes) to run after every commit that wrote model instances.
+
+    Callbacks run after the transaction is closed, so they must not emit SQL
+    on the committing session. Models can opt out of change tracking by
+    setting __track_changes__ = False.
+    """
+    if callback not in _commit_callbacks:
+        _commit_callbacks.append(callback)
+    return callback
+
+
+def _describe(op, instance):
+    table = instance.__tablename__
+    instance_id = getattr(instance, 'id', None)
+    trip_id = instance_id if table == 'trip' else getattr(instance, 'trip_id', None)
+    return Change(op, table, instance_id, trip_id)
+
+
+def _tracked(instances):
+    return [instance for instance in instances if getattr(instance, '__track_changes__', True)]
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_changes(session, flush_context):
+    changes = session.info.setdefault('committed_changes', [])
+    changes.extend(_describe('insert', instance) for instance in _tracked(session.new))
+    changes.extend(
+        _describe('update', instance) for instance in _tracked(session.dirty)
+        if session.is_modified(instance, include_collections=False)
+    )
+    changes.extend(_describe('delete', instance) for instance in _tracked(session.deleted))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _run_commit_callbacks(session):
+    changes = session.info.pop('committed_changes', None)
+    if not changes:
+        return
+    for callback in _commit_callbacks:
+        callback(changes)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('committed_changes', None)
@@ -0,0 +1,53 @@
+"""
+Engine settings for SQLite and server databases (Postgres, MySQL).
+
+init_app() turns the DB_* settings of Config into SQLALCHEMY_ENGINE_OPTIONS:
+connection pool size and overflow, pool timeout, connection recycling,
+pre-ping, and a per-statement timeout enforced by the database server.
+Options a dialect does not support are left out, so the same Config works
+for a local SQLite file and a production Postgres.
+"""
+from sqlalchemy.engine import make_url
+
+
+def normalize_url(url):
+    """Accept the postgres:// scheme that hosting providers hand out"""
+    if url and url.startswith('postgres://'):
+        return 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS for the configured database"""
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    backend = url.get_backend_name()
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    connect_args = dict(options.get('connect_args') or {})
+
+    options.setdefault('pool_pre_ping', config['DB_POOL_PRE_PING'])
+    if config['DB_POOL_RECYCLE']:
+        options.setdefault('pool_recycle', config['DB_POOL_RECYCLE'])
+
+    # SQLite files use a pool without size limits, so sizing only applies to server databases
+    if backend != 'sqlite':
+        options.setdefault('pool_size', config['DB_POOL_SIZE'])
+        options.setdefault('max_overflow', config['DB_MAX_OVERFLOW'])
+        options.setdefault('pool_timeout', config['DB_POOL_TIMEOUT'])
+
+    # Statement timeouts are enforced by the server; SQLite has no equivalent
+    timeout_ms = config['DB_STATEMENT_TIMEOUT_MS']
+    if timeout_ms and backend == 'postgresql':
+        existing = connect_args.get('options', '')
+        connect_args['options'] = f'{existing} -c statement_timeout={int(timeout_ms)}'.strip()
+    elif timeout_ms and backend == 'mysql':
+        connect_args.setdefault('init_command', f'SET SESSION max_execution_time = {int(timeout_ms)}')
+
+    if connect_args:
+        options['connect_args'] = connect_args
+    return options
+
+
+def init_app(app):
+    """Call before the first database connection is made"""
+    app.config['SQLALCHEMY_DATABASE_URI'] = normalize_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
@@ -0,0 +1,196 @@
+import csv
+import io
+import json
+import zlib
+from backend.models.expense import Expense
+from backend.models.trip import Trip
+from backend.models.user import User
+
+# Columns shared by every exported record. Expense rows carry the full amount,
+# share rows carry one participant's share of an expense, and advance/payment
+# rows carry the amount recorded against a participant on the trip.
+EXPORT_FIELDS = [
+    'record_type',
+    'trip_id',
+    'trip_name',
+    'expense_id',
+    'date',
+    'description',
+    'category',
+    'currency',
+    'split_method',
+    'payer_id',
+    'payer_name',
+    'participant_id',
+    'participant_name',
+    'amount',
+]
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Number of rows fetched per round trip and written per output chunk
+DEFAULT_BATCH_SIZE = 500
+
+
+class NameResolver:
+    """Resolve participant IDs to display names, loading users on demand"""
+
+    def __init__(self):
+        self.user_names = {}
+
+    def preload(self, user_ids):
+        """Load the names of the given registered users in a single query"""
+        missing = {int(uid) for uid in user_ids if str(uid).isdigit() and str(uid) not in self.user_names}
+        if missing:
+            for user in User.query.filter(User.id.in_(missing)).all():
+                self.user_names[str(user.id)] = user.name
+            for uid in missing:
+                self.user_names.setdefault(str(uid), 'Unknown')
+
+    def name(self, participant_id):
+        participant_id = str(participant_id)
+        if participant_id == 'group_everyone':
+            return 'Everyone (Group Payment)'
+        if participant_id.startswith('unregistered_'):
+            return participant_id.replace('unregistered_', '').title()
+        if participant_id not in self.user_names:
+            self.preload([participant_id])
+        return self.user_names.get(participant_id, 'Unknown')
+
+
+def _format_date(value):
+    if value is None:
+        return None
+    if hasattr(value, 'strftime'):
+        return value.strftime('%Y-%m-%d')
+    return str(value)
+
+
+def _record(record_type, trip, **fields):
+    record = dict.fromkeys(EXPORT_FIELDS)
+    record['record_type'] = record_type
+    record['trip_id'] = trip.id
+    record['trip_name'] = trip.name
+    record.update(fields)
+    return record
+
+
+def iter_trip_records(trip, resolver=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Yield export records for one trip: expenses, shares, advances and payments"""
+    resolver = resolver or NameResolver()
+    participant_ids = trip.get_participants_list() + [str(trip.admin_id)]
+    resolver.preload(participant_ids)
+
+    # Stream expenses through a server-side cursor so memory stays flat
+    expenses = (
+        Expense.query.filter_by(trip_id=trip.id)
+        .order_by(Expense.date, Expense.id)
+        .yield_per(batch_size)
+    )
+    for expense in expenses:
+        expense_fields = {
+            'expense_id': expense.id,
+            'date': _format_date(expense.date),
+            'description': expense.description,
+            'category': expense.category,
+            'currency': expense.currency,
+            'split_method': expense.split_method,
+            'payer_id': expense.payer_id,
+            'payer_name': resolver.name(expense.payer_id),
+        }
+        yield _record('expense', trip, amount=expense.amount, **expense_fields)
+
+        for participant_id, share in expense.get_shares().items():
+            yield _record(
+                'share', trip,
+                participant_id=participant_id,
+                participant_name=resolver.name(participant_id),
+                amount=share,
+                **expense_fields
+            )
+
+    for participant_id, amount in trip.get_advances().items():
+        yield _record(
+            'advance', trip,
+            participant_id=participant_id,
+            participant_name=resolver.name(participant_id),
+            amount=amount
+        )
+
+    for payment in trip.get_general_payments():
+        participant_id = payment.get('participant_id')
+        yield _record(
+            'payment', trip,
+            expense_id=payment.get('expense_id'),
+            date=payment.get('date'),
+            description=payment.get('description'),
+            participant_id=participant_id,
+            participant_name=resolver.name(participant_id),
+            amount=payment.get('amount')
+        )
+
+
+def iter_records(trip_ids, batch_size=DEFAULT_BATCH_SIZE):
+    """Yield export records for every trip in trip_ids, one trip at a time"""
+    resolver = NameResolver()
+    for trip_id in trip_ids:
+        trip = Trip.query.get(trip_id)
+        if trip is None:
+            continue
+        yield from iter_trip_records(trip, resolver, batch_size)
+
+
+def iter_csv(records, chunk_rows=DEFAULT_BATCH_SIZE):
+    """Serialize records as CSV, yielding UTF-8 encoded chunks"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for count, record in enumerate(records, 1):
+        writer.writerow(record)
+        if count % chunk_rows == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate(0)
+    yield buffer.getvalue().encode('utf-8')
+
+
+def iter_ndjson(records, chunk_rows=DEFAULT_BATCH_SIZE):
+    """Serialize records as newline-delimited JSON, yielding UTF-8 encoded chunks"""
+    lines = []
+    for record in records:
+        lines.append(json.dumps(record, default=str))
+        if len(lines) >= chunk_rows:
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+            lines = []
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def gzip_stream(chunks, level=6):
+    """Compress an iterable of byte chunks into a gzip stream on the fly"""
+    # wbits=31 selects the gzip container format instead of raw zlib
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(trip_ids, fmt='csv', compress=False, batch_size=DEFAULT_BATCH_SIZE):
+    """Return an iterator of bytes exporting the given trips in the requested format"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+
+    records = iter_records(trip_ids, batch_size)
+    if fmt == 'csv':
+        chunks = iter_csv(records, batch_size)
+    else:
+        chunks = iter_ndjson(records, batch_size)
+
+    if compress:
+        chunks = gzip_stream(chunks)
+    return chunks
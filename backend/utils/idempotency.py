@@ -0,0 +1,198 @@
+"""
+Idempotency keys for POSTs that create expenses, advances and payments.
+
+A client sends a key it generated in the Idempotency-Key header or the
+idempotency_key form field (the forms render one per page load). The first
+request with a key claims it in the idempotency_key table, runs the view and
+stores its response. A retry with the same key gets the stored response
+back, marked with an Idempotent-Replayed header, without running the view
+again. Nothing is written twice and balances are not recalculated.
+
+- A retry that arrives while the first request is still running gets a 409
+  with Retry-After.
+- Reusing a key for a different request body is a 422.
+- Responses with status 500 or above, and requests that raise, release the
+  key so the client can retry.
+- Keys expire after IDEMPOTENCY_KEY_TTL seconds. A claim that is never
+  completed, because the process died, can be taken over after
+  IDEMPOTENCY_LOCK_TIMEOUT seconds.
+"""
+import functools
+import hashlib
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta
+from flask import current_app, flash, request
+from flask_login import current_user
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import BadRequest, Conflict, UnprocessableEntity
+from backend.database import db
+from backend.models.idempotency_key import IdempotencyKey
+from backend.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Idempotency-Key'
+FORM_FIELD = 'idempotency_key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 100
+# Form fields that differ between retries of the same submission
+_IGNORED_FIELDS = ('csrf_token', FORM_FIELD)
+
+IDEMPOTENT_REQUESTS = metrics.counter(
+    'idempotent_requests_total', 'POSTs sent with an idempotency key by outcome', ('endpoint', 'outcome'))
+
+_settings = {
+    'ttl': 86400.0,
+    'lock_timeout': 60.0,
+    'purge_interval': 300.0,
+}
+_last_purge = [0.0]
+
+
+def request_key():
+    """The idempotency key of the current request, or None"""
+    key = request.headers.get(HEADER) or request.form.get(FORM_FIELD)
+    if not key or not key.strip():
+        return None
+    key = key.strip()
+    if len(key) > MAX_KEY_LENGTH:
+        raise BadRequest(f'{HEADER} must be at most {MAX_KEY_LENGTH} characters')
+    return key
+
+
+def fingerprint():
+    """Hash of the request path and body, ignoring the key and CSRF token"""
+    digest = hashlib.sha256(f'{request.method} {request.path}\0'.encode())
+    if request.form:
+        for name in sorted(request.form):
+            if name in _IGNORED_FIELDS:
+                continue
+            for value in request.form.getlist(name):
+                digest.update(f'{name}={value}\0'.encode())
+    else:
+        digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def _claim(key, user_id, endpoint, request_fingerprint):
+    """(key_id, None) when this request now owns the key, else (None, existing row)"""
+    table = IdempotencyKey.__table__
+    where = (table.c.user_id == user_id) & (table.c.key == key)
+    now = datetime.utcnow()
+    with db.engine.begin() as connection:
+        row = connection.execute(select(table).where(where)).first()
+        abandoned = row is not None and row.status == IdempotencyKey.IN_PROGRESS and \
+            row.created_at <= now - timedelta(seconds=_settings['lock_timeout'])
+        if row is not None and (row.expires_at <= now or abandoned):
+            connection.execute(table.delete().where(table.c.id == row.id))
+            row = None
+    if row is not None:
+        return None, row
+
+    try:
+        with db.engine.begin() as connection:
+            result = connection.execute(table.insert().values(
+                key=key, user_id=user_id, endpoint=endpoint, fingerprint=request_fingerprint,
+                status=IdempotencyKey.IN_PROGRESS, created_at=now,
+                expires_at=now + timedelta(seconds=_settings['ttl']),
+            ))
+            return result.inserted_primary_key[0], None
+    except IntegrityError:
+        # A concurrent retry claimed the key first
+        with db.engine.connect() as connection:
+            return None, connection.execute(select(table).where(where)).first()
+
+
+def _complete(key_id, response):
+    table = IdempotencyKey.__table__
+    with db.engine.begin() as connection:
+        connection.execute(table.update().where(table.c.id == key_id).values(
+            status=IdempotencyKey.COMPLETED,
+            response_status=response.status_code,
+            response_location=response.headers.get('Location'),
+            response_mimetype=response.mimetype,
+            response_body=response.get_data(),
+        ))
+
+
+def _release(key_id):
+    table = IdempotencyKey.__table__
+    with db.engine.begin() as connection:
+        connection.execute(table.delete().where(table.c.id == key_id))
+
+
+def _replay(row):
+    response = current_app.response_class(
+        row.response_body or b'', status=row.response_status, mimetype=row.response_mimetype
+    )
+    if row.response_location:
+        response.headers['Location'] = row.response_location
+        # The original response's flash message was lost with it
+        flash('This request was already processed', 'info')
+    response.headers[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def purge_expired(force=False):
+    """Delete expired keys, at most once per purge interval; returns the number deleted"""
+    if not force and time.monotonic() - _last_purge[0] < _settings['purge_interval']:
+        return 0
+    _last_purge[0] = time.monotonic()
+    table = IdempotencyKey.__table__
+    with db.engine.begin() as connection:
+        return connection.execute(table.delete().where(table.c.expires_at <= datetime.utcnow())).rowcount
+
+
+def idempotent(view):
+    """Make a POST view replay its stored response when retried with the same key"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request_key() if request.method == 'POST' else None
+        if key is None or not current_user.is_authenticated:
+            return view(*args, **kwargs)
+
+        endpoint = request.endpoint
+        request_fingerprint = fingerprint()
+        purge_expired()
+        key_id, existing = _claim(key, current_user.id, endpoint, request_fingerprint)
+        if existing is not None:
+            if existing.endpoint != endpoint or existing.fingerprint != request_fingerprint:
+                IDEMPOTENT_REQUESTS.inc(endpoint=endpoint, outcome='mismatch')
+                raise UnprocessableEntity(f'{HEADER} was already used for a different request')
+            if existing.status != IdempotencyKey.COMPLETED:
+                IDEMPOTENT_REQUESTS.inc(endpoint=endpoint, outcome='in_progress')
+                conflict = Conflict('A request with this idempotency key is still being processed')
+                conflict.response = current_app.response_class(
+                    conflict.description, status=409, headers={'Retry-After': '1'}, mimetype='text/plain'
+                )
+                raise conflict
+            IDEMPOTENT_REQUESTS.inc(endpoint=endpoint, outcome='replayed')
+            logger.info('Replaying %s response for idempotency key of user %s', endpoint, current_user.id)
+            return _replay(existing)
+
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        except Exception:
+            _release(key_id)
+            raise
+        if response.status_code >= 500 or response.is_streamed:
+            _release(key_id)
+        else:
+            _complete(key_id, response)
+        IDEMPOTENT_REQUESTS.inc(endpoint=endpoint, outcome='executed')
+        return response
+    return wrapper
+
+
+def new_key():
+    """A fresh key for a form; rendered into a hidden idempotency_key field"""
+    return uuid.uuid4().hex
+
+
+def init_app(app):
+    _settings['ttl'] = app.config['IDEMPOTENCY_KEY_TTL']
+    _settings['lock_timeout'] = app.config['IDEMPOTENCY_LOCK_TIMEOUT']
+    app.context_processor(lambda: {'new_idempotency_key': new_key})
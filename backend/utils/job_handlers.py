@@ -0,0 +1,73 @@
+"""
+Implementations of the job types run by backend.utils.jobs workers.
+"""
+from backend.database import db
+from backend.models.trip import Trip
+from backend.models.user import User
+from backend.utils import sync, trip_report
+from backend.utils.jobs import job_handler, set_progress
+
+
+def _get_trip(job):
+    trip = Trip.query.get(job.trip_id)
+    if trip is None:
+        raise LookupError(f'Trip {job.trip_id} no longer exists')
+    return trip
+
+
+@job_handler('sync_balances')
+def sync_balances(job):
+    """Recalculate every participant balance of a trip"""
+    trip = _get_trip(job)
+    balances = trip.recalculate_all_balances()
+    return {'balances': {participant_id: round(balance, 2) for participant_id, balance in balances.items()}}
+
+
+@job_handler('sync_account')
+def sync_account(job):
+    """Recalculate balances across all of a user's trips"""
+    user = User.query.get(job.user_id)
+    if user is None:
+        raise LookupError(f'User {job.user_id} no longer exists')
+
+    trip_ids = [trip.id for trip in user.get_trips()]
+    sync_count = 0
+    failed_trips = []
+    for completed, result in enumerate(sync.iter_sync(trip_ids), start=1):
+        if result['success']:
+            sync_count += 1
+        else:
+            # Continue with other trips even if one fails
+            failed_trips.append(sync.failed_trip(result))
+        set_progress(job.id, 100 * completed / len(trip_ids), f'Synchronized {completed} of {len(trip_ids)} trips')
+
+    return {'sync_count': sync_count, 'failed_trips': failed_trips}
+
+
+@job_handler('sync_linked_participants')
+def sync_linked_participants(job):
+    """Re-point records of linked unregistered participants to their users"""
+    trip = _get_trip(job)
+    sync_count, updated_expenses = trip.sync_linked_participants()
+    if sync_count:
+        db.session.commit()
+    return {'sync_count': sync_count or 0, 'updated_expenses': len(updated_expenses)}
+
+
+@job_handler('link_participant')
+def link_participant(job):
+    """Link an unregistered participant to a registered user and rewrite their records"""
+    trip = _get_trip(job)
+    payload = job.get_payload()
+    if not trip.link_participant(payload['name'], payload['user_id']):
+        raise ValueError(f"Participant '{payload['name']}' not found in trip {trip.id}")
+    return {'name': payload['name'], 'user_id': payload['user_id']}
+
+
+@job_handler('render_settlement_pdf')
+def render_settlement_pdf(job):
+    """Render the trip's settlement PDF into the PDF cache"""
+    trip = _get_trip(job)
+    data_version = trip.get_data_version()
+    trip_report.settlement_pdf(trip, data_version)
+    return {'data_version': data_version}
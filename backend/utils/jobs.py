@@ -0,0 +1,237 @@
+"""
+A small database-backed job queue.
+
+Jobs are rows in the job table. Web requests enqueue them and `flask jobs work`
+worker processes claim and run them, so no external broker is needed. Queued
+or running jobs carry a dedup key (by default "<job_type>:<trip_id>") that is
+unique in the table, so the same work for a trip is never queued twice.
+"""
+import json
+import logging
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+from flask import current_app, jsonify, request, url_for
+from sqlalchemy.exc import IntegrityError, OperationalError
+from backend.database import db
+from backend.models.job import Job
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}
+
+
+def job_handler(job_type):
+    """Register handler(job) as the implementation of a job type.
+
+    The handler's return value must be JSON serializable and is stored as the
+    job result. Raising an exception fails the attempt; the job is retried
+    with backoff until it runs out of attempts.
+    """
+    def decorator(func):
+        _handlers[job_type] = func
+        return func
+    return decorator
+
+
+def _load_handlers():
+    # Handlers register themselves on import
+    from backend.utils import job_handlers  # noqa: F401
+
+
+def dedup_key_for(job_type, trip_id=None, user_id=None):
+    if trip_id is not None:
+        return f'{job_type}:{trip_id}'
+    return f'{job_type}:user{user_id}'
+
+
+def wants_async():
+    """Whether the current request asked for the job-queue mode"""
+    return request.values.get('async', '').lower() in ('1', 'true', 'yes')
+
+
+def enqueue(job_type, trip_id=None, user_id=None, payload=None, dedup_key=None, max_attempts=None):
+    """Queue a job unless the same work is already queued or running.
+
+    Returns (job, created). Commits the current session.
+    """
+    dedup_key = dedup_key or dedup_key_for(job_type, trip_id, user_id)
+    existing = Job.query.filter_by(dedup_key=dedup_key).first()
+    if existing:
+        return existing, False
+
+    job = Job(
+        job_type=job_type,
+        trip_id=trip_id,
+        user_id=user_id,
+        payload_json=json.dumps(payload or {}),
+        dedup_key=dedup_key,
+        max_attempts=max_attempts or current_app.config['JOB_MAX_ATTEMPTS'],
+        run_after=datetime.utcnow()
+    )
+    db.session.add(job)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another request queued the same work between our check and insert
+        db.session.rollback()
+        existing = Job.query.filter_by(dedup_key=dedup_key).first()
+        if existing:
+            return existing, False
+        raise
+    return job, True
+
+
+def job_accepted(job, created):
+    """202 response telling the client where to poll for the job's outcome"""
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': url_for('jobs.job_status', job_id=job.id),
+        'message': 'Job queued' if created else 'An identical job is already queued'
+    }), 202
+
+
+def set_progress(job_id, progress, message=None):
+    """Record a running job's progress (0-100).
+
+    Written on its own connection so it is visible to pollers without
+    committing the handler's pending work.
+    """
+    values = {'progress': max(0, min(100, int(progress))), 'updated_at': datetime.utcnow()}
+    if message is not None:
+        values['message'] = message
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(Job.__table__.update().where(Job.__table__.c.id == job_id).values(**values))
+    except OperationalError as e:
+        # Progress is informational; never fail the job over it
+        logger.warning('Could not record progress for job %s: %s', job_id, e)
+
+
+def default_worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def claim_next(worker_id):
+    """Atomically claim the next runnable job, or return None"""
+    now = datetime.utcnow()
+    candidates = db.session.query(Job.id).filter(
+        Job.status == Job.QUEUED,
+        Job.run_after <= now
+    ).order_by(Job.run_after, Job.id).limit(10).all()
+
+    for (job_id,) in candidates:
+        # Compare-and-swap on the status so concurrent workers never run the same job
+        claimed = Job.query.filter_by(id=job_id, status=Job.QUEUED).update({
+            'status': Job.RUNNING,
+            'worker_id': worker_id,
+            'started_at': now,
+            'attempts': Job.attempts + 1,
+            'progress': 0
+        }, synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            return Job.query.get(job_id)
+    return None
+
+
+def _finish(job, status, message=None):
+    job.status = status
+    job.finished_at = datetime.utcnow()
+    job.dedup_key = None
+    if message is not None:
+        job.message = message
+
+
+def _retry_or_fail(job, error):
+    if job.attempts < job.max_attempts:
+        delay = current_app.config['JOB_RETRY_DELAY'] * 2 ** (job.attempts - 1)
+        job.status = Job.QUEUED
+        job.run_after = datetime.utcnow() + timedelta(seconds=delay)
+        job.message = f'Attempt {job.attempts} failed: {error}. Retrying in {delay} seconds'
+    else:
+        _finish(job, Job.FAILED, f'Failed after {job.attempts} attempt(s): {error}')
+
+
+def run_job(job):
+    """Run a claimed job and record its outcome"""
+    _load_handlers()
+    job_id = job.id
+    handler = _handlers.get(job.job_type)
+    if handler is None:
+        _finish(job, Job.FAILED, f'Unknown job type: {job.job_type}')
+        db.session.commit()
+        return job
+
+    started = time.perf_counter()
+    try:
+        result = handler(job)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.exception('Job %s (%s) failed', job_id, job.job_type)
+        job = Job.query.get(job_id)
+        _retry_or_fail(job, str(e) or e.__class__.__name__)
+    else:
+        job = Job.query.get(job_id)
+        job.progress = 100
+        job.result_json = json.dumps(result) if result is not None else None
+        _finish(job, Job.SUCCEEDED, f'Completed in {time.perf_counter() - started:.2f}s')
+    db.session.commit()
+    return job
+
+
+def requeue_stale(timeout):
+    """Recover jobs whose worker died mid-run; returns how many were touched"""
+    cutoff = datetime.utcnow() - timedelta(seconds=timeout)
+    stale = Job.query.filter(Job.status == Job.RUNNING, Job.started_at < cutoff).all()
+    for job in stale:
+        _retry_or_fail(job, f'worker {job.worker_id} did not finish within {timeout} seconds')
+    if stale:
+        db.session.commit()
+    return len(stale)
+
+
+def work(worker_id=None, burst=False, poll_interval=None):
+    """Claim and run jobs until stopped; with burst, return once the queue is empty.
+
+    Returns the number of jobs run.
+    """
+    worker_id = worker_id or default_worker_id()
+    poll_interval = poll_interval or current_app.config['JOB_POLL_INTERVAL']
+    timeout = current_app.config['JOB_TIMEOUT']
+    processed = 0
+    last_stale_check = 0
+
+    while True:
+        if time.monotonic() - last_stale_check > poll_interval * 10:
+            requeue_stale(timeout)
+            last_stale_check = time.monotonic()
+
+        job = claim_next(worker_id)
+        if job is None:
+            db.session.remove()
+            if burst:
+                return processed
+            time.sleep(poll_interval)
+            continue
+
+        logger.info('Worker %s running job %s (%s)', worker_id, job.id, job.job_type)
+        run_job(job)
+        processed += 1
+        # Each job starts from a clean session
+        db.session.remove()
+
+
+def purge_finished(older_than_days):
+    """Delete finished jobs older than the given age; returns how many were removed"""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    removed = Job.query.filter(
+        Job.status.in_([Job.SUCCEEDED, Job.FAILED]),
+        Job.finished_at < cutoff
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return removed
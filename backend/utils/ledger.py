@@ -0,0 +1,102 @@
+"""
+Pure ledger computations over plain Python data.
+
+These functions work on already-loaded expense data so that balances for a
+whole trip can be computed in a single pass, without per-participant queries.
+"""
+
+
+def summarize_participants(participant_ids, expenses, advances, payments):
+    """Calculate amount paid, total share and balance for each participant.
+
+    expenses is an iterable of (payer_id, amount, shares) tuples, advances maps
+    participant IDs to advance amounts and payments is the trip's list of
+    general payment dicts. Balances follow Trip.calculate_user_balance: what a
+    participant paid (expenses, general payments and advances) minus their
+    share of all expenses. Positive means they are owed money.
+    """
+    paid = {participant_id: 0 for participant_id in participant_ids}
+    share = {participant_id: 0 for participant_id in participant_ids}
+
+    for payer_id, amount, shares in expenses:
+        if payer_id in paid:
+            paid[payer_id] += amount
+        for participant_id, share_amount in shares.items():
+            if participant_id in share:
+                share[participant_id] += share_amount
+
+    for payment in payments:
+        participant_id = payment.get('participant_id')
+        if participant_id in paid:
+            paid[participant_id] += payment['amount']
+
+    for participant_id, amount in advances.items():
+        if participant_id in paid:
+            paid[participant_id] += amount
+
+    return {
+        participant_id: {
+            'paid': paid[participant_id],
+            'share': share[participant_id],
+            'balance': paid[participant_id] - share[participant_id],
+        }
+        for participant_id in participant_ids
+    }
+
+
+def settle_balances(balances, max_iterations=100):
+    """Greedy settlement plan: repeatedly pay the largest creditor from the largest debtor.
+
+    balances maps participant IDs to their balance. Balances within 0.01 of
+    zero are ignored. Returns a list of {'from_user', 'to_user', 'amount'}.
+    """
+    balances = {k: v for k, v in balances.items() if abs(v) > 0.01}
+    settlements = []
+    iteration = 0
+
+    while balances and iteration < max_iterations:
+        iteration += 1
+
+        # Find max creditor and max debtor
+        max_creditor = max(balances.items(), key=lambda x: x[1])
+        max_debtor = min(balances.items(), key=lambda x: x[1])
+
+        # If all balances are settled (close to zero), we're done
+        if abs(max_creditor[1]) < 0.01 or abs(max_debtor[1]) < 0.01:
+            break
+
+        # Round to 2 decimal places to avoid floating point issues
+        amount = round(min(max_creditor[1], -max_debtor[1]), 2)
+        if amount <= 0:
+            break  # No more meaningful settlements to make
+
+        settlements.append({
+            'from_user': max_debtor[0],
+            'to_user': max_creditor[0],
+            'amount': amount
+        })
+
+        balances[max_creditor[0]] -= amount
+        balances[max_debtor[0]] += amount
+
+        # Remove settled balances
+        balances = {k: v for k, v in balances.items() if abs(v) > 0.01}
+
+    return settlements
+
+
+def category_totals(expenses):
+    """Return [(category, count, total)] sorted by total, highest first.
+
+    expenses is an iterable of (category, amount) tuples.
+    """
+    totals = {}
+    for category, amount in expenses:
+        category = category or 'Uncategorized'
+        count, total = totals.get(category, (0, 0))
+        totals[category] = (count + 1, total + amount)
+    return sorted(
+        ((category, count, total) for category, (count, total) in totals.items()),
+        key=lambda item: item[2],
+        reverse=True
+    )
@@ -0,0 +1,409 @@
+"""
+Live trip updates over Server-Sent Events.
+
+A commit that changes a trip's expenses, advances, payments or participants
+hands the trip to a publisher thread. The thread computes the trip's events
+once, in its own session, and publishes them to the broker, which fans them
+out to every open /trips/<id>/events stream:
+
+- expense_added, expense_edited and expense_deleted, one per changed expense
+- balances: the trip total and every participant's paid, share and balance
+- settlements: the settlement plan
+- trip_deleted
+
+Commits that arrive while the thread is busy are coalesced, so a burst of
+writes to one trip costs one balance computation. balances and settlements
+are only sent when they changed.
+
+LIVE_UPDATES_BROKER selects the broker. 'local' fans events out to streams in
+the publishing process only, enough for a single worker; it skips trips
+nobody follows. 'database' stores events in the trip_event table and every
+worker polls it for the trips its streams follow. Any other value is the
+import path of a Broker subclass ('package.module:ClassName'). Both brokers
+keep recent events, so a client reconnecting with Last-Event-ID receives the
+events it missed.
+"""
+import importlib
+import itertools
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque, namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+from sqlalchemy.exc import SQLAlchemyError
+from backend.database import db
+from backend.models.expense import Expense
+from backend.models.trip import Trip
+from backend.models.trip_event import TripEvent
+from backend.utils import metrics
+from backend.utils.db_hooks import on_commit
+from backend.utils.ledger import settle_balances, summarize_participants
+
+logger = logging.getLogger(__name__)
+
+# An event as sent to streams; data is its JSON payload, serialized once
+Event = namedtuple('Event', ['id', 'trip_id', 'type', 'data'])
+
+# Tables whose changes can move a trip's balances
+TRIP_TABLES = ('trip', 'expense', 'unregistered_participant')
+# Events kept per trip by the local broker for reconnecting clients
+BACKLOG_SIZE = 100
+# Events waiting for one stream before it is considered stalled and closed
+STREAM_QUEUE_SIZE = 1000
+# Trips whose last published balances are remembered before the memory is reset
+MAX_TRACKED_TRIPS = 10000
+# Reconnection delay suggested to EventSource clients, in milliseconds
+RETRY_MS = 3000
+
+LIVE_EVENTS = metrics.counter('live_events_total', 'Live trip update events published by type', ('type',))
+
+_settings = {
+    'keepalive': 15.0,
+    'stream_timeout': 300.0,
+    'poll_interval': 1.0,
+    'retention': 300.0,
+    'purge_interval': 60.0,
+}
+_state = {'broker': None}
+
+# trip id -> {'deleted': bool, 'expenses': {expense id: [first op, last op]}}
+_pending = {}
+_pending_changed = threading.Condition()
+_publisher = [None]
+# trip id -> serialized balances and settlements last published by this process
+_last_published = {}
+
+
+class Subscription:
+    """The queue of events of one open stream"""
+
+    def __init__(self, trip_id):
+        self.trip_id = trip_id
+        self.queue = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+        self.closed = False
+
+    def get(self, timeout):
+        """The next event, or None when none arrived within timeout seconds"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class Broker:
+    """
+    Fans published events out to the streams of this process.
+
+    A shared broker overrides publish() to send events to the other workers,
+    calls dispatch() for each event it receives, and overrides replay() to
+    serve reconnects from its shared store.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+        self._backlog = {}
+        # trip id -> when its last stream closed; events are kept for reconnects meanwhile
+        self._followed_until = {}
+        # Starts from the clock so ids keep increasing across restarts
+        self._ids = itertools.count(int(time.time() * 1000))
+
+    def wants(self, trip_id):
+        """Whether events of the trip can reach a stream"""
+        if self._subscriptions.get(trip_id):
+            return True
+        return self._followed_until.get(trip_id, 0) > time.monotonic()
+
+    def subscribed_trips(self):
+        with self._lock:
+            return set(self._subscriptions)
+
+    def subscribe(self, trip_id, last_event_id=None):
+        """Open a subscription; returns it with the events after last_event_id"""
+        subscription = Subscription(trip_id)
+        with self._lock:
+            self._subscriptions.setdefault(trip_id, set()).add(subscription)
+        missed = self.replay(trip_id, last_event_id) if last_event_id is not None else []
+        return subscription, missed
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.trip_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.trip_id, None)
+                now = time.monotonic()
+                if len(self._followed_until) >= MAX_TRACKED_TRIPS:
+                    for key in [key for key, until in self._followed_until.items() if until <= now]:
+                        del self._followed_until[key]
+                        self._backlog.pop(key, None)
+                self._followed_until[subscription.trip_id] = now + _settings['retention']
+
+    def publish(self, trip_id, events):
+        """Publish [(type, data)] of a trip, data already serialized"""
+        published = [Event(next(self._ids), trip_id, event_type, data) for event_type, data in events]
+        with self._lock:
+            self._backlog.setdefault(trip_id, deque(maxlen=BACKLOG_SIZE)).extend(published)
+        for event in published:
+            self.dispatch(event)
+
+    def dispatch(self, event):
+        """Queue an event for every stream of its trip"""
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(event.trip_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.queue.put_nowait(event)
+            except queue.Full:
+                # The client stopped reading; it resumes from Last-Event-ID when it reconnects
+                subscription.closed = True
+
+    def replay(self, trip_id, after_id):
+        """Kept events of the trip published after after_id"""
+        with self._lock:
+            return [event for event in self._backlog.get(trip_id, ()) if event.id > after_id]
+
+    def close(self):
+        """Release the broker's resources when the app is initialized again"""
+
+
+class DatabaseBroker(Broker):
+    """Shares events between workers through the trip_event table"""
+
+    def __init__(self, app):
+        super().__init__(app)
+        self._last_id = None
+        self._last_purge = 0.0
+        self._poller = None
+        self._stopped = threading.Event()
+
+    def wants(self, trip_id):
+        # Streams of other workers are not known here
+        return True
+
+    def subscribe(self, trip_id, last_event_id=None):
+        with self._lock:
+            if self._poller is None:
+                with db.engine.connect() as connection:
+                    self._last_id = connection.execute(select(func.max(TripEvent.__table__.c.id))).scalar() or 0
+                self._poller = threading.Thread(target=self._poll, name='live-updates-poller', daemon=True)
+                self._poller.start()
+        return super().subscribe(trip_id, last_event_id)
+
+    def publish(self, trip_id, events):
+        table = TripEvent.__table__
+        now = datetime.utcnow()
+        with db.engine.begin() as connection:
+            connection.execute(table.insert(), [
+                {'trip_id': trip_id, 'event_type': event_type, 'data': data, 'created_at': now}
+                for event_type, data in events
+            ])
+            if time.monotonic() - self._last_purge >= _settings['purge_interval']:
+                self._last_purge = time.monotonic()
+                connection.execute(table.delete().where(
+                    table.c.created_at < now - timedelta(seconds=_settings['retention'])))
+
+    def replay(self, trip_id, after_id):
+        table = TripEvent.__table__
+        query = select(table).where((table.c.trip_id == trip_id) & (table.c.id > after_id)).order_by(table.c.id)
+        with db.engine.connect() as connection:
+            rows = connection.execute(query).fetchall()
+        return [Event(row.id, row.trip_id, row.event_type, row.data) for row in rows]
+
+    def _poll(self):
+        table = TripEvent.__table__
+        while not self._stopped.wait(_settings['poll_interval']):
+            try:
+                with self.app.app_context():
+                    with db.engine.connect() as connection:
+                        rows = connection.execute(
+                            select(table).where(table.c.id > self._last_id).order_by(table.c.id)
+                        ).fetchall()
+            except SQLAlchemyError as e:
+                logger.warning('Could not read live update events: %s', e)
+                continue
+            trip_ids = self.subscribed_trips()
+            for row in rows:
+                self._last_id = row.id
+                if row.trip_id in trip_ids:
+                    self.dispatch(Event(row.id, row.trip_id, row.event_type, row.data))
+
+    def close(self):
+        self._stopped.set()
+
+
+BROKERS = {
+    'local': Broker,
+    'database': DatabaseBroker,
+}
+
+
+def load_broker(name, app):
+    """Instantiate a broker by name or by 'package.module:ClassName'"""
+    broker_class = BROKERS.get(name)
+    if broker_class is None:
+        module_name, _, class_name = name.partition(':')
+        if not class_name:
+            raise ValueError(f"Unknown LIVE_UPDATES_BROKER {name!r}; use one of {', '.join(BROKERS)} or 'module:Class'")
+        broker_class = getattr(importlib.import_module(module_name), class_name)
+    return broker_class(app)
+
+
+def trip_summary(trip):
+    """(balances, settlements) of a trip, computed from a single expense query"""
+    participant_ids = trip.get_participants_list()
+    if str(trip.admin_id) not in participant_ids:
+        participant_ids.append(str(trip.admin_id))
+    participant_ids += [f'unregistered_{name}' for name in trip.get_unregistered_participants()]
+
+    rows = db.session.query(Expense.payer_id, Expense.amount, Expense.shares).filter(Expense.trip_id == trip.id).all()
+    entries = [(payer_id, amount, json.loads(shares) if shares else {}) for payer_id, amount, shares in rows]
+    summary = summarize_participants(participant_ids, entries, trip.get_advances(), trip.get_general_payments())
+
+    balances = {
+        'total_expenses': round(sum(amount for _, amount, _ in entries), 2),
+        'participants': {
+            participant_id: {key: round(value, 2) for key, value in totals.items()}
+            for participant_id, totals in summary.items()
+        },
+    }
+    plain = {participant_id: totals['balance'] for participant_id, totals in summary.items()}
+    # The complete plan; every greedy step settles at least one participant
+    settlements = settle_balances(plain, max_iterations=len(plain) + 1)
+    return balances, settlements
+
+
+def build_events(trip_id, changes):
+    """The [(type, data)] events describing a trip's pending changes"""
+    trip = None if changes['deleted'] else Trip.query.get(trip_id)
+    if trip is None:
+        _last_published.pop(trip_id, None)
+        return [('trip_deleted', json.dumps({'trip_id': trip_id}))]
+
+    events = []
+    expense_ops = changes['expenses']
+    live_ids = [expense_id for expense_id, (_, last_op) in expense_ops.items() if last_op != 'delete']
+    expenses = {expense.id: expense for expense in Expense.query.filter(Expense.id.in_(live_ids))} if live_ids else {}
+    for expense_id in sorted(expense_ops):
+        first_op, _ = expense_ops[expense_id]
+        expense = expenses.get(expense_id)
+        if expense is None:
+            # Added and deleted again before anyone was told
+            if first_op != 'insert':
+                events.append(('expense_deleted', json.dumps({'id': expense_id})))
+        elif first_op == 'insert':
+            events.append(('expense_added', json.dumps(expense.to_dict())))
+        else:
+            events.append(('expense_edited', json.dumps(expense.to_dict())))
+
+    balances, settlements = trip_summary(trip)
+    summary = (json.dumps(balances), json.dumps({'settlements': settlements}))
+    previous = _last_published.get(trip_id, (None, None))
+    if summary[0] != previous[0]:
+        events.append(('balances', summary[0]))
+    if summary[1] != previous[1]:
+        events.append(('settlements', summary[1]))
+    if len(_last_published) >= MAX_TRACKED_TRIPS:
+        _last_published.clear()
+    _last_published[trip_id] = summary
+    return events
+
+
+def _publish_pending(broker):
+    with _pending_changed:
+        batch = dict(_pending)
+        _pending.clear()
+    with broker.app.app_context():
+        try:
+            for trip_id, changes in batch.items():
+                try:
+                    events = build_events(trip_id, changes)
+                    if events:
+                        broker.publish(trip_id, events)
+                except Exception:
+                    logger.exception('Could not publish live updates of trip %s', trip_id)
+                    continue
+                for event_type, _ in events:
+                    LIVE_EVENTS.inc(type=event_type)
+        finally:
+            db.session.remove()
+
+
+def _run_publisher():
+    while True:
+        with _pending_changed:
+            while not _pending:
+                _pending_changed.wait()
+        broker = _state['broker']
+        if broker is not None:
+            _publish_pending(broker)
+
+
+@on_commit
+def _queue_changed_trips(changes):
+    broker = _state['broker']
+    if broker is None:
+        return
+    changed = [
+        change for change in changes
+        if change.table in TRIP_TABLES and change.trip_id is not None and broker.wants(change.trip_id)
+    ]
+    if not changed:
+        return
+
+    with _pending_changed:
+        for change in changed:
+            pending = _pending.setdefault(change.trip_id, {'deleted': False, 'expenses': {}})
+            if change.table == 'trip' and change.op == 'delete':
+                pending['deleted'] = True
+            elif change.table == 'expense' and change.id is not None:
+                pending['expenses'].setdefault(change.id, [change.op, change.op])[1] = change.op
+        _pending_changed.notify()
+        if _publisher[0] is None:
+            _publisher[0] = threading.Thread(target=_run_publisher, name='live-updates-publisher', daemon=True)
+            _publisher[0].start()
+
+
+def format_event(event):
+    """An event in the text/event-stream format"""
+    return f'id: {event.id}\nevent: {event.type}\ndata: {event.data}\n\n'
+
+
+def stream(trip_id, last_event_id=None):
+    """Yield a trip's events as Server-Sent Events until LIVE_UPDATES_STREAM_TIMEOUT"""
+    broker = _state['broker']
+    subscription, missed = broker.subscribe(trip_id, last_event_id)
+    deadline = time.monotonic() + _settings['stream_timeout']
+    last_sent = None
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+        for event in missed:
+            yield format_event(event)
+            last_sent = event.id
+        # Ending the stream makes the client reconnect, which checks its access again
+        while not subscription.closed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            event = subscription.get(min(_settings['keepalive'], remaining))
+            if event is None:
+                yield ': keepalive\n\n'
+            elif last_sent is None or event.id > last_sent:
+                yield format_event(event)
+                last_sent = event.id
+    finally:
+        broker.unsubscribe(subscription)
+
+
+def init_app(app):
+    _settings['keepalive'] = app.config['LIVE_UPDATES_KEEPALIVE']
+    _settings['stream_timeout'] = app.config['LIVE_UPDATES_STREAM_TIMEOUT']
+    _settings['poll_interval'] = app.config['LIVE_UPDATES_POLL_INTERVAL']
+    _settings['retention'] = app.config['LIVE_UPDATES_RETENTION']
+    if _state['broker'] is not None:
+        _state['broker'].close()
+    _state['broker'] = load_broker(app.config['LIVE_UPDATES_BROKER'], app)
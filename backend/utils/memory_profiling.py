@@ -0,0 +1,212 @@
+"""
+Opt-in tracemalloc instrumentation for the ledger, dashboard and PDF paths.
+
+With MEMORY_PROFILING enabled, every request and every @tracked() section
+(balance recalculation, settlements, report data, PDF rendering) records the
+peak memory it allocated. A sampled fraction of them (MEMORY_SNAPSHOT_RATE)
+also compares tracemalloc snapshots taken before and after, which yields the
+allocation sites that grew the most. Results are kept per process, served to
+site admins at /metrics/memory, and peaks feed the memory_peak_bytes
+histogram of /metrics.
+
+Peaks come from tracemalloc's process-wide counters, so concurrent requests
+in one process inflate each other's numbers. Use a single-threaded worker
+when exact figures matter.
+"""
+import contextlib
+import functools
+import linecache
+import os
+import random
+import threading
+import tracemalloc
+from flask import g, request
+from backend.utils import metrics
+
+# Memory peak buckets in bytes, from 64 KiB to 1 GiB
+MEMORY_BUCKETS = tuple(2 ** exponent for exponent in range(16, 31, 2))
+
+MEMORY_PEAK = metrics.histogram(
+    'memory_peak_bytes', 'Peak traced memory by request endpoint or section', ('scope', 'name'),
+    buckets=MEMORY_BUCKETS)
+
+_settings = {
+    'enabled': os.environ.get('MEMORY_PROFILING', 'False').lower() in ('true', '1', 't'),
+    'frames': int(os.environ.get('MEMORY_TRACE_FRAMES', 1)),
+    'snapshot_rate': float(os.environ.get('MEMORY_SNAPSHOT_RATE', 0.1)),
+    'top_sites': int(os.environ.get('MEMORY_TOP_SITES', 10)),
+}
+_lock = threading.Lock()
+_local = threading.local()
+# (scope, name) -> aggregate, see _record()
+_stats = {}
+
+_SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, linecache.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+
+class MemorySample:
+    """Outcome of one measured block"""
+
+    def __init__(self, scope, name):
+        self.scope = scope
+        self.name = name
+        self.peak_bytes = 0
+        self.top_sites = None
+
+    def as_dict(self):
+        return {'peak_bytes': self.peak_bytes, 'top_sites': self.top_sites}
+
+
+def start_tracing(frames=None):
+    """Start tracemalloc unless it is already running"""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames or _settings['frames'])
+
+
+def _sections():
+    sections = getattr(_local, 'sections', None)
+    if sections is None:
+        sections = _local.sections = []
+    return sections
+
+
+def top_sites(before, after, limit=None):
+    """Allocation sites that grew the most between two snapshots"""
+    limit = limit or _settings['top_sites']
+    # With MEMORY_TRACE_FRAMES > 1, sites are split by call stack and the stack is reported
+    differences = after.filter_traces(_SNAPSHOT_FILTERS).compare_to(
+        before.filter_traces(_SNAPSHOT_FILTERS), 'traceback')
+    growth = sorted((diff for diff in differences if diff.size_diff > 0), key=lambda diff: diff.size_diff, reverse=True)
+    sites = []
+    for diff in growth[:limit]:
+        frames = [f'{frame.filename}:{frame.lineno}' for frame in diff.traceback]
+        site = {'site': frames[0], 'size_bytes': diff.size_diff, 'allocations': diff.count_diff}
+        if len(frames) > 1:
+            site['stack'] = frames
+        sites.append(site)
+    return sites
+
+
+@contextlib.contextmanager
+def measure(scope, name, snapshot=False):
+    """
+    Record the peak memory allocated inside the block.
+
+    Yields a MemorySample (or None when tracemalloc is not running) whose
+    peak_bytes, and top_sites when snapshot is true, are filled in on exit.
+    """
+    if not tracemalloc.is_tracing():
+        yield None
+        return
+
+    sample = MemorySample(scope, name)
+    before = tracemalloc.take_snapshot() if snapshot else None
+    sections = _sections()
+    current, peak = tracemalloc.get_traced_memory()
+    if sections:
+        # reset_peak() below would lose the enclosing section's peak so far
+        sections[-1]['peak'] = max(sections[-1]['peak'], peak)
+    section = {'start': current, 'peak': current}
+    sections.append(section)
+    tracemalloc.reset_peak()
+    try:
+        yield sample
+    finally:
+        _, peak = tracemalloc.get_traced_memory()
+        sections.pop()
+        peak = max(peak, section['peak'])
+        if sections:
+            sections[-1]['peak'] = max(sections[-1]['peak'], peak)
+        sample.peak_bytes = max(peak - section['start'], 0)
+        if before is not None:
+            sample.top_sites = top_sites(before, tracemalloc.take_snapshot())
+        _record(sample)
+
+
+def _record(sample):
+    MEMORY_PEAK.observe(sample.peak_bytes, scope=sample.scope, name=sample.name)
+    with _lock:
+        entry = _stats.get((sample.scope, sample.name))
+        if entry is None:
+            entry = _stats[(sample.scope, sample.name)] = {
+                'calls': 0, 'peak_bytes_max': 0, 'peak_bytes_total': 0, 'top_sites': [], 'top_sites_peak_bytes': 0
+            }
+        entry['calls'] += 1
+        entry['peak_bytes_total'] += sample.peak_bytes
+        entry['peak_bytes_max'] = max(entry['peak_bytes_max'], sample.peak_bytes)
+        # Keep the sites of the largest sampled call, which is the one worth investigating
+        if sample.top_sites is not None and sample.peak_bytes >= entry['top_sites_peak_bytes']:
+            entry['top_sites'] = sample.top_sites
+            entry['top_sites_peak_bytes'] = sample.peak_bytes
+
+
+def _should_snapshot():
+    rate = _settings['snapshot_rate']
+    return rate >= 1 or random.random() < rate
+
+
+def tracked(name):
+    """Decorator measuring a function's peak memory as a section"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracemalloc.is_tracing():
+                return func(*args, **kwargs)
+            with measure('section', name, snapshot=_should_snapshot()):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def report():
+    """Per-process results, largest peak first"""
+    with _lock:
+        entries = [
+            {
+                'scope': scope,
+                'name': name,
+                'calls': entry['calls'],
+                'peak_bytes_max': entry['peak_bytes_max'],
+                'peak_bytes_mean': entry['peak_bytes_total'] // entry['calls'],
+                'top_sites': list(entry['top_sites']),
+            }
+            for (scope, name), entry in _stats.items()
+        ]
+    entries.sort(key=lambda entry: entry['peak_bytes_max'], reverse=True)
+    traced_bytes = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+    return {'pid': os.getpid(), 'traced_bytes': traced_bytes, 'entries': entries}
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def _start_request():
+    g._memory_block = measure('endpoint', request.endpoint or 'unmatched', snapshot=_should_snapshot())
+    g._memory_block.__enter__()
+
+
+def _finish_request(exception=None):
+    block = g.pop('_memory_block', None)
+    if block is not None:
+        block.__exit__(None, None, None)
+
+
+def init_app(app):
+    _settings['enabled'] = app.config['MEMORY_PROFILING']
+    _settings['frames'] = app.config['MEMORY_TRACE_FRAMES']
+    _settings['snapshot_rate'] = app.config['MEMORY_SNAPSHOT_RATE']
+    _settings['top_sites'] = app.config['MEMORY_TOP_SITES']
+    if not _settings['enabled']:
+        return
+    start_tracing()
+    app.before_request(_start_request)
+    app.teardown_request(_finish_request)
@@ -0,0 +1,312 @@
+"""
+Prometheus-style metrics that work under a preforking WSGI server.
+
+Every process keeps its counters and histograms in memory and periodically
+writes them to its own JSON file in METRICS_DIR. The /metrics endpoint merges
+the files of all processes into the Prometheus text exposition format, so
+any worker can answer a scrape with the numbers of all of them.
+"""
+import atexit
+import contextlib
+import functools
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from flask import g, request
+from backend.utils.sql_instrumentation import start_collecting, stop_collecting
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_METRICS_DIR = os.path.join(tempfile.gettempdir(), 'expense_tracker_metrics')
+
+# Request latency buckets in seconds; also used for ledger and PDF timings
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_settings = {
+    'enabled': os.environ.get('METRICS_ENABLED', 'False').lower() in ('true', '1', 't'),
+    'dir': os.environ.get('METRICS_DIR') or DEFAULT_METRICS_DIR,
+    'flush_interval': float(os.environ.get('METRICS_FLUSH_INTERVAL', 5)),
+}
+_lock = threading.Lock()
+_metrics = {}
+_last_flush = [0.0]
+# pid whose metrics are in memory, and the file it writes them to (named on first flush)
+_process = {'pid': os.getpid(), 'file': None}
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        if not _settings['enabled']:
+            return
+        key = tuple(str(labels.get(label, '')) for label in self.labelnames)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dump(self):
+        return {'|'.join(key): value for key, value in self.values.items()}
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (non-cumulative, last is +Inf), sum, count]
+        self.values = {}
+
+    def observe(self, value, **labels):
+        if not _settings['enabled']:
+            return
+        key = tuple(str(labels.get(label, '')) for label in self.labelnames)
+        index = len(self.buckets)
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = position
+                break
+        with _lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def dump(self):
+        return {'|'.join(key): value for key, value in self.values.items()}
+
+
+def _register(metric):
+    _metrics[metric.name] = metric
+    return metric
+
+
+def counter(name, help_text, labelnames=()):
+    return _metrics.get(name) or _register(Counter(name, help_text, labelnames))
+
+
+def histogram(name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _metrics.get(name) or _register(Histogram(name, help_text, labelnames, buckets))
+
+
+REQUEST_LATENCY = histogram(
+    'http_request_duration_seconds', 'Request latency by endpoint', ('endpoint', 'method'))
+REQUESTS = counter(
+    'http_requests_total', 'Requests by endpoint and status code', ('endpoint', 'method', 'status'))
+DB_QUERIES = counter(
+    'db_queries_total', 'SQL statements executed by endpoint', ('endpoint',))
+DB_TIME = counter(
+    'db_query_seconds_total', 'Time spent executing SQL by endpoint', ('endpoint',))
+LEDGER_TIME = histogram(
+    'ledger_computation_seconds', 'Balance and settlement computation time', ('operation',))
+PDF_RENDER_TIME = histogram(
+    'pdf_render_seconds', 'PDF rendering time', ('kind',))
+CACHE_REQUESTS = counter(
+    'cache_requests_total', 'Cache lookups by cache and result', ('cache', 'result'))
+
+
+def timed(metric, **labels):
+    """Decorator observing a function's duration on a histogram"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _settings['enabled']:
+                return func(*args, **kwargs)
+            with metric.time(**labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def metrics_dir():
+    os.makedirs(_settings['dir'], exist_ok=True)
+    return _settings['dir']
+
+
+def _process_file():
+    """This process's metrics file, renamed when a forked worker no longer has its parent's pid"""
+    if _process['pid'] != os.getpid():
+        _forget_parent()
+    if _process['file'] is None:
+        # Includes the start time so a recycled PID never overwrites an earlier process's totals
+        _process['file'] = f'metrics_{os.getpid()}_{int(time.time() * 1000)}.json'
+    return _process['file']
+
+
+def _forget_parent():
+    """Drop the counts a forked child inherited, which its parent already publishes"""
+    _process['pid'] = os.getpid()
+    _process['file'] = None
+    _last_flush[0] = 0.0
+    for metric in _metrics.values():
+        metric.values.clear()
+
+
+# Runs in the child right after a fork (e.g. gunicorn --preload), before it records anything
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_parent)
+
+
+def flush(force=False):
+    """Write this process's metrics to its file (at most once per flush interval)"""
+    if not _settings['enabled']:
+        return
+    now = time.monotonic()
+    if not force and now - _last_flush[0] < _settings['flush_interval']:
+        return
+    _last_flush[0] = now
+    with _lock:
+        # Checked first: a child must not write the counts it inherited
+        path = os.path.join(metrics_dir(), _process_file())
+        snapshot = {
+            name: {'labels': list(metric.labelnames), 'values': metric.dump()}
+            for name, metric in _metrics.items() if metric.values
+        }
+    tmp_path = f'{path}.tmp'
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning('Could not write metrics to %s: %s', path, e)
+
+
+def _merge_files():
+    merged = {}
+    for path in glob.glob(os.path.join(metrics_dir(), 'metrics_*.json')):
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            # A file being replaced mid-read is picked up on the next scrape
+            continue
+        for name, data in snapshot.items():
+            metric = _metrics.get(name)
+            if metric is None:
+                continue
+            values = merged.setdefault(name, {})
+            for key, value in data['values'].items():
+                if metric.kind == 'counter':
+                    values[key] = values.get(key, 0) + value
+                else:
+                    entry = values.setdefault(key, [[0] * (len(metric.buckets) + 1), 0.0, 0])
+                    entry[0] = [a + b for a, b in zip(entry[0], value[0])]
+                    entry[1] += value[1]
+                    entry[2] += value[2]
+    return merged
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, key, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, key.split('|') if names else [])]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def render():
+    """All processes' metrics in the Prometheus text exposition format"""
+    flush(force=True)
+    merged = _merge_files()
+    lines = []
+    for name, metric in _metrics.items():
+        lines.append(f'# HELP {name} {metric.help}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        for key, value in sorted(merged.get(name, {}).items()):
+            if metric.kind == 'counter':
+                lines.append(f'{name}{_labels(metric.labelnames, key)} {value}')
+                continue
+            bucket_counts, total, count = value
+            cumulative = 0
+            for bound, bucket_count in zip(metric.buckets + (float('inf'),), bucket_counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                bucket_labels = _labels(metric.labelnames, key, 'le="%s"' % le)
+                lines.append(f'{name}_bucket{bucket_labels} {cumulative}')
+            lines.append(f'{name}_sum{_labels(metric.labelnames, key)} {total}')
+            lines.append(f'{name}_count{_labels(metric.labelnames, key)} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """Forget all recorded metrics, in memory and on disk"""
+    with _lock:
+        for metric in _metrics.values():
+            metric.values.clear()
+    for path in glob.glob(os.path.join(metrics_dir(), 'metrics_*.json')):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _start_request():
+    g._metrics_started = time.perf_counter()
+    g._metrics_queries = start_collecting()
+
+
+def _finish_request(response):
+    started = g.pop('_metrics_started', None)
+    stats = g.pop('_metrics_queries', None)
+    if started is None:
+        return response
+    stop_collecting(stats)
+
+    endpoint = request.endpoint or 'unmatched'
+    REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint, method=request.method)
+    REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    DB_QUERIES.inc(stats.count, endpoint=endpoint)
+    DB_TIME.inc(stats.total_time, endpoint=endpoint)
+    flush()
+    return response
+
+
+def _discard_request_stats(exception=None):
+    stats = g.pop('_metrics_queries', None)
+    if stats is not None:
+        stop_collecting(stats)
+
+
+def init_app(app):
+    _settings['enabled'] = app.config['METRICS_ENABLED']
+    _settings['dir'] = app.config.get('METRICS_DIR') or DEFAULT_METRICS_DIR
+    _settings['flush_interval'] = app.config['METRICS_FLUSH_INTERVAL']
+    if not _settings['enabled']:
+        return
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_discard_request_stats)
+
+
+@atexit.register
+def _flush_at_exit():
+    flush(force=True)
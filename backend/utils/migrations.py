@@ -0,0 +1,236 @@
+"""
+Versioned schema migrations and online data backfills.
+
+Migrations are files named ``NNNN_description.py`` in MIGRATIONS_DIR. Each
+defines ``upgrade(connection)`` and may define ``BACKFILLS``, a list of
+backfill.Backfill data migrations. ``flask db upgrade`` applies the pending
+schema migrations in version order, each in its own transaction together
+with its row in the schema_migration table. Backfills are not run by the
+upgrade: they rewrite rows in small batches while the app serves traffic
+and are started separately with ``flask db backfill``.
+
+Migrations must be safe to run against a database that already has their
+change (databases created with db.create_all() have every table), so the
+helpers below check before they create or alter anything.
+"""
+import importlib.util
+import logging
+import os
+import re
+from datetime import datetime
+import click
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select, text
+from backend.database import db
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DEFAULT_MIGRATIONS_DIR = os.path.join(PROJECT_ROOT, 'migrations')
+_FILENAME = re.compile(r'^(\d{4})_(\w+)\.py$')
+
+# Framework tables live outside the models' metadata, so db.create_all() leaves them alone
+metadata = MetaData()
+schema_migration = Table(
+    'schema_migration', metadata,
+    Column('version', Integer, primary_key=True),
+    Column('name', String(200), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+db_cli = AppGroup('db', help='Schema migrations and data backfills.')
+
+
+class Migration:
+    """One migration file"""
+
+    def __init__(self, version, name, module):
+        self.version = version
+        self.name = name
+        self.module = module
+
+    @property
+    def description(self):
+        return (self.module.__doc__ or self.name).strip().splitlines()[0]
+
+    @property
+    def backfills(self):
+        return list(getattr(self.module, 'BACKFILLS', ()))
+
+    def upgrade(self, connection):
+        self.module.upgrade(connection)
+
+
+def discover(directory=None):
+    """Migrations of the directory, in version order"""
+    directory = directory or DEFAULT_MIGRATIONS_DIR
+    migrations = []
+    for filename in sorted(os.listdir(directory)):
+        match = _FILENAME.match(filename)
+        if not match:
+            continue
+        spec = importlib.util.spec_from_file_location(f'migrations_{match.group(1)}', os.path.join(directory, filename))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        migrations.append(Migration(int(match.group(1)), match.group(2), module))
+
+    versions = [migration.version for migration in migrations]
+    duplicates = sorted({version for version in versions if versions.count(version) > 1})
+    if duplicates:
+        raise RuntimeError(f'Duplicate migration versions: {duplicates}')
+    return migrations
+
+
+def applied_versions(engine):
+    metadata.create_all(engine, tables=[schema_migration])
+    with engine.connect() as connection:
+        return {row.version for row in connection.execute(select(schema_migration.c.version))}
+
+
+def pending(engine, migrations):
+    applied = applied_versions(engine)
+    return [migration for migration in migrations if migration.version not in applied]
+
+
+def upgrade(engine, migrations, target=None):
+    """Apply pending migrations up to target (inclusive); returns the applied migrations"""
+    done = []
+    for migration in pending(engine, migrations):
+        if target is not None and migration.version > target:
+            break
+        logger.info('Applying migration %04d %s', migration.version, migration.name)
+        # The version row commits with the schema change, so a failed migration is retried as a whole
+        with engine.begin() as connection:
+            migration.upgrade(connection)
+            connection.execute(schema_migration.insert().values(
+                version=migration.version, name=migration.name, applied_at=datetime.utcnow()
+            ))
+        done.append(migration)
+    return done
+
+
+def stamp(engine, migrations, version):
+    """Record migrations up to version as applied without running them"""
+    applied = applied_versions(engine)
+    with engine.begin() as connection:
+        for migration in migrations:
+            if migration.version <= version and migration.version not in applied:
+                connection.execute(schema_migration.insert().values(
+                    version=migration.version, name=migration.name, applied_at=datetime.utcnow()
+                ))
+
+
+# Helpers for migration files
+
+def has_table(connection, table):
+    return inspect(connection).has_table(table)
+
+
+def has_column(connection, table, column):
+    return any(info['name'] == column for info in inspect(connection).get_columns(table))
+
+
+def add_column(connection, table, column, definition):
+    """ALTER TABLE ... ADD COLUMN unless the column exists; returns whether it was added"""
+    if has_column(connection, table, column):
+        return False
+    connection.execute(text(f'ALTER TABLE {connection.dialect.identifier_preparer.quote(table)} ADD COLUMN {column} {definition}'))
+    return True
+
+
+def create_tables(connection, *tables):
+    """Create Core tables (with their indexes) that do not exist yet"""
+    for table in tables:
+        table.create(connection, checkfirst=True)
+
+
+# CLI
+
+def _migrations():
+    return discover(current_app.config.get('MIGRATIONS_DIR'))
+
+
+def _backfill(migrations, name):
+    for migration in migrations:
+        for backfill in migration.backfills:
+            if backfill.name == name:
+                return backfill
+    raise click.ClickException(f'Unknown backfill {name}; see `flask db status`')
+
+
+@db_cli.command('upgrade')
+@click.option('--to', 'target', type=int, help='Stop after this version.')
+@with_appcontext
+def upgrade_command(target):
+    """Apply pending schema migrations."""
+    done = upgrade(db.engine, _migrations(), target)
+    for migration in done:
+        click.echo(f'Applied {migration.version:04d} {migration.description}', err=True)
+    click.echo(f'{len(done)} migration(s) applied', err=True)
+
+
+@db_cli.command('stamp')
+@click.argument('version', type=int)
+@with_appcontext
+def stamp_command(version):
+    """Mark migrations up to VERSION as applied without running them."""
+    stamp(db.engine, _migrations(), version)
+    click.echo(f'Stamped up to {version:04d}', err=True)
+
+
+@db_cli.command('status')
+@with_appcontext
+def status_command():
+    """List migrations and backfills with their state."""
+    from backend.utils import backfill as backfills
+
+    migrations = _migrations()
+    applied = applied_versions(db.engine)
+    for migration in migrations:
+        state = 'applied' if migration.version in applied else 'pending'
+        click.echo(f'{migration.version:04d} {state:<8} {migration.description}')
+        for item in migration.backfills:
+            progress = backfills.progress(db.engine, item.name)
+            if progress is None:
+                state = 'not started'
+            elif progress['finished_at']:
+                state = f'done, {progress["rows_updated"]} row(s) updated'
+            else:
+                state = f'{progress["rows_scanned"]} row(s) scanned, last {item.key} {progress["last_key"]}'
+            click.echo(f'     backfill {item.name}: {state}')
+
+
+@db_cli.command('backfill')
+@click.argument('name')
+@click.option('--batch-size', type=int, help='Rows per batch (defaults to BACKFILL_BATCH_SIZE).')
+@click.option('--sleep', type=float, help='Seconds to pause between batches (defaults to BACKFILL_SLEEP).')
+@click.option('--max-batches', type=int, help='Stop after this many batches; run again to resume.')
+@click.option('--restart', is_flag=True, help='Discard the checkpoint and start from the first row.')
+@with_appcontext
+def backfill_command(name, batch_size, sleep, max_batches, restart):
+    """Run or resume the backfill NAME in throttled batches."""
+    from backend.utils import backfill as backfills
+
+    config = current_app.config
+    item = _backfill(_migrations(), name)
+    result = backfills.run(
+        db.engine, item,
+        batch_size=batch_size or config['BACKFILL_BATCH_SIZE'],
+        sleep=config['BACKFILL_SLEEP'] if sleep is None else sleep,
+        max_batch_seconds=config['BACKFILL_MAX_BATCH_SECONDS'],
+        max_batches=max_batches,
+        restart=restart,
+    )
+    state = 'finished' if result['finished_at'] else 'paused'
+    click.echo(
+        f'Backfill {name} {state}: {result["rows_scanned"]} row(s) scanned, {result["rows_updated"]} updated',
+        err=True
+    )
+
+
+def init_app(app):
+    app.cli.add_command(db_cli)
+    if app.config['MIGRATE_ON_STARTUP']:
+        with app.app_context():
+            upgrade(db.engine, discover(app.config.get('MIGRATIONS_DIR')))
@@ -0,0 +1,112 @@
+"""
+Optimistic concurrency control for trips and expenses.
+
+Trip and Expense have a version column that SQLAlchemy uses as the mapper's
+version_id_col: every UPDATE or DELETE of such a row is issued as
+``... WHERE id = ? AND version = ?`` and increments the version. When another
+writer committed first the statement matches no row and the flush raises
+StaleDataError instead of overwriting that writer's JSON blob.
+
+- Commutative changes (adding an advance or a payment, adding or removing a
+  participant) go through run_write(), which rolls back, reloads the row and
+  applies the change again.
+- Edits that replace what the user saw call check_version() with the version
+  their form was rendered with, and commit through commit() or
+  run_write(retries=0). A stale version or a conflict at commit raises
+  WriteConflict, a 409.
+"""
+import logging
+import random
+import time
+from flask import jsonify, request
+from sqlalchemy.orm.exc import StaleDataError
+from werkzeug.exceptions import Conflict
+from backend.database import db
+from backend.utils import metrics, sqlite_mode
+
+logger = logging.getLogger(__name__)
+
+WRITE_CONFLICTS = metrics.counter(
+    'write_conflicts_total', 'Optimistic concurrency conflicts by outcome', ('outcome',))
+
+_settings = {
+    'retries': 3,
+    'retry_delay': 0.01,
+}
+
+
+class WriteConflict(Conflict):
+    description = 'This was changed by someone else since you opened it. Reload the page and apply your change again.'
+
+    def __init__(self, current_version=None, description=None):
+        super().__init__(description)
+        self.current_version = current_version
+
+
+def check_version(instance, submitted):
+    """Raise WriteConflict unless the submitted version is the instance's current one.
+
+    Clients that do not send a version are only protected by the check at commit.
+    """
+    if submitted in (None, ''):
+        return
+    try:
+        submitted = int(submitted)
+    except (TypeError, ValueError):
+        raise WriteConflict(instance.version, 'Invalid version')
+    if submitted != instance.version:
+        WRITE_CONFLICTS.inc(outcome='stale_form')
+        raise WriteConflict(instance.version)
+
+
+def run_write(work, session=None, retries=None):
+    """
+    Run work() and commit (see sqlite_mode.run_write), repeating it when a
+    concurrent writer changed the same row first.
+
+    After a conflict the session is rolled back, so work() sees the other
+    writer's data when it runs again; it must re-read what it modifies.
+    Returns work()'s result, or raises WriteConflict after the last attempt.
+    """
+    session = session or db.session
+    retries = _settings['retries'] if retries is None else retries
+    for attempt in range(retries + 1):
+        try:
+            result = sqlite_mode.run_write(work, session)
+        except StaleDataError as e:
+            session.rollback()
+            if attempt == retries:
+                WRITE_CONFLICTS.inc(outcome='rejected')
+                logger.info('Write conflict not retried: %s', e)
+                raise WriteConflict()
+            WRITE_CONFLICTS.inc(outcome='retried')
+            time.sleep(_settings['retry_delay'] * (2 ** attempt) * (0.5 + random.random()))
+            continue
+        return result
+
+
+def commit(session=None):
+    """Commit an edit made in place, raising WriteConflict if a concurrent writer got there first"""
+    session = session or db.session
+    try:
+        session.commit()
+    except StaleDataError as e:
+        session.rollback()
+        WRITE_CONFLICTS.inc(outcome='rejected')
+        logger.info('Write conflict not retried: %s', e)
+        raise WriteConflict()
+
+
+def _conflict_response(error):
+    if request.is_json or request.accept_mimetypes.best == 'application/json':
+        return jsonify({
+            'success': False,
+            'message': error.description,
+            'version': error.current_version,
+        }), 409
+    return error
+
+
+def init_app(app):
+    _settings['retries'] = app.config['WRITE_CONFLICT_RETRIES']
+    app.register_error_handler(WriteConflict, _conflict_response)
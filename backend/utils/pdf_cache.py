@@ -0,0 +1,77 @@
+import glob
+import os
+import tempfile
+import logging
+from flask import current_app, has_app_context
+from backend.utils import metrics
+from backend.utils.db_hooks import on_commit
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'expense_tracker_pdf_cache')
+
+
+def cache_dir():
+    """Return the PDF cache directory, creating it if needed"""
+    path = current_app.config.get('PDF_CACHE_DIR') or DEFAULT_CACHE_DIR
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def cache_path(kind, trip_id, data_version, template_version):
+    """Path of the cached PDF for a trip at a given data and template version"""
+    filename = f'{kind}_trip{trip_id}_{data_version}_v{template_version}.pdf'
+    return os.path.join(cache_dir(), filename)
+
+
+def _trip_files(kind, trip_id):
+    return glob.glob(os.path.join(cache_dir(), f'{kind}_trip{trip_id}_*.pdf'))
+
+
+def store(path, content):
+    """Atomically write PDF bytes to path"""
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def get_or_render(kind, trip_id, data_version, template_version, render):
+    """Return (path, hit) for the cached PDF, rendering it with render() on a miss"""
+    path = cache_path(kind, trip_id, data_version, template_version)
+    if os.path.exists(path):
+        metrics.record_cache(f'pdf_{kind}', True)
+        return path, True
+    metrics.record_cache(f'pdf_{kind}', False)
+
+    store(path, render())
+
+    # Older versions of this trip's PDF can never be served again
+    for stale_path in _trip_files(kind, trip_id):
+        if stale_path != path:
+            _remove(stale_path)
+    return path, False
+
+
+def invalidate_trip(trip_id, kind='*'):
+    """Remove every cached PDF of a trip"""
+    for path in _trip_files(kind, trip_id):
+        _remove(path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning('Could not remove cached PDF %s: %s', path, e)
+
+
+@on_commit
+def _invalidate_changed_trips(changes):
+    """Drop cached PDFs of trips touched by a committed transaction"""
+    if not has_app_context():
+        return
+    for trip_id in {change.trip_id for change in changes if change.trip_id}:
+        invalidate_trip(trip_id)
@@ -1,3 +1,4 @@
+import logging
 from io import BytesIO
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4
@@ -7,8 +8,11 @@ from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, Tabl
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from datetime import datetime
+from xml.sax.saxutils import escape
 
-def generate_settlement_pdf(trip, settlements, balances, user_map):
+logger = logging.getLogger(__name__)
+
+def generate_settlement_pdf(trip, settlements, balances, user_map, total_expenses=None):
     """Generate a PDF report for trip settlements using ReportLab"""
     try:
         # Create a buffer to store PDF
@@ -41,8 +45,9 @@ def generate_settlement_pdf(trip, settlements, balances, user_map):
         elements.append(Paragraph("Trip Details", heading_style))
         elements.append(Spacer(1, 10))
         
-        # Calculate total expenses from balances
-        total_expenses = sum(abs(amount) for amount in balances.values() if amount < 0)
+        # Use the trip's real expense total
+        if total_expenses is None:
+            total_expenses = trip.calculate_total_expenses()
         
         trip_details = [
             ["Trip Name:", trip.name],
@@ -126,5 +131,134 @@ def generate_settlement_pdf(trip, settlements, balances, user_map):
         return pdf
 
     except Exception as e:
-        print(f"Error generating PDF: {str(e)}")
+        logger.exception('Error generating settlement PDF for trip %s', trip.id)
+        raise
+
+
+def _grid_table(rows, col_widths, right_columns=()):
+    """Build a bordered table with a grey header row that repeats across pages"""
+    table = Table(rows, colWidths=col_widths, repeatRows=1)
+    style = [
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 9),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
+        ('TOPPADDING', (0, 0), (-1, -1), 4),
+    ]
+    for column in right_columns:
+        style.append(('ALIGN', (column, 0), (column, -1), 'RIGHT'))
+    table.setStyle(TableStyle(style))
+    return table
+
+
+def generate_trip_report_pdf(data):
+    """Generate the full itemized trip report from plain report data.
+
+    data is built by backend.utils.trip_report.build_report_data and contains
+    only plain Python values, so this function can run in a worker process.
+    """
+    try:
+        buffer = BytesIO()
+        doc = SimpleDocTemplate(
+            buffer,
+            pagesize=A4,
+            rightMargin=1.5*cm,
+            leftMargin=1.5*cm,
+            topMargin=1.5*cm,
+            bottomMargin=1.5*cm,
+            title=f"Trip Report: {data['trip']['name']}"
+        )
+
+        styles = getSampleStyleSheet()
+        title_style = styles['Heading1']
+        heading_style = styles['Heading2']
+        cell_style = ParagraphStyle('ReportCell', parent=styles['Normal'], fontSize=8, leading=10)
+
+        elements = []
+        trip = data['trip']
+
+        # Trip details
+        elements.append(Paragraph(f"Trip Report: {trip['name']}", title_style))
+        elements.append(Spacer(1, 12))
+        trip_details = [
+            ["Trip Name:", trip['name']],
+            ["Dates:", f"{trip['start_date']} - {trip['end_date']}"],
+            ["Generated:", data['generated_at']],
+            ["Expenses:", str(len(data['expenses']))],
+            ["Total Expenses:", f"₹{data['total_expenses']:.2f}"],
+            ["Advances:", f"₹{data['total_advances']:.2f}"],
+            ["General Payments:", f"₹{data['total_payments']:.2f}"],
+        ]
+        details_table = Table(trip_details, colWidths=[110, 330])
+        details_table.setStyle(TableStyle([
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+            ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
+            ('FONTSIZE', (0, 0), (-1, -1), 10),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
+        ]))
+        elements.append(details_table)
+        elements.append(Spacer(1, 16))
+
+        # Per-category totals
+        if data['categories']:
+            elements.append(Paragraph("Spending by Category", heading_style))
+            elements.append(Spacer(1, 8))
+            rows = [["Category", "Expenses", "Total"]]
+            for category, count, total in data['categories']:
+                rows.append([category, str(count), f"₹{total:.2f}"])
+            elements.append(_grid_table(rows, [260, 80, 100], right_columns=(1, 2)))
+            elements.append(Spacer(1, 16))
+
+        # Per-participant breakdown
+        if data['participants']:
+            elements.append(Paragraph("Participant Breakdown", heading_style))
+            elements.append(Spacer(1, 8))
+            rows = [["Participant", "Paid", "Share", "Balance"]]
+            for name, paid, share, balance in data['participants']:
+                rows.append([name, f"₹{paid:.2f}", f"₹{share:.2f}", f"₹{balance:.2f}"])
+            elements.append(_grid_table(rows, [200, 80, 80, 80], right_columns=(1, 2, 3)))
+            elements.append(Spacer(1, 16))
+
+        # Settlement plan
+        elements.append(Paragraph("Settlement Plan", heading_style))
+        elements.append(Spacer(1, 8))
+        if data['settlements']:
+            rows = [["From", "To", "Amount"]]
+            for from_name, to_name, amount in data['settlements']:
+                rows.append([from_name, to_name, f"₹{amount:.2f}"])
+            elements.append(_grid_table(rows, [180, 180, 80], right_columns=(2,)))
+        else:
+            elements.append(Paragraph("All balances are settled.", styles['Normal']))
+        elements.append(Spacer(1, 16))
+
+        # Per-expense ledger
+        if data['expenses']:
+            elements.append(Paragraph("Expense Ledger", heading_style))
+            elements.append(Spacer(1, 8))
+            rows = [["Date", "Description", "Category", "Paid By", "Split", "Amount"]]
+            for expense in data['expenses']:
+                rows.append([
+                    expense['date'],
+                    Paragraph(escape(expense['description']), cell_style),
+                    Paragraph(escape(expense['category']), cell_style),
+                    Paragraph(escape(expense['payer']), cell_style),
+                    expense['split_method'],
+                    f"₹{expense['amount']:.2f}"
+                ])
+            elements.append(_grid_table(rows, [58, 150, 75, 80, 50, 65], right_columns=(5,)))
+
+        doc.build(elements)
+
+        pdf = buffer.getvalue()
+        buffer.close()
+
+        return pdf
+
+    except Exception as e:
+        logger.exception('Error generating trip report PDF for trip %s', data['trip']['id'])
         raise
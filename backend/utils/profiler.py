@@ -0,0 +1,242 @@
+"""
+Opt-in per-request profiling for site admins.
+
+With PROFILING_ENABLED, an admin can profile a single request by sending an
+``X-Profile`` header or a ``_profile`` query parameter with the mode:
+
+- ``cprofile``: deterministic profile, written as ``.pstats`` plus collapsed stacks
+- ``sample``: a background thread samples the request thread's stack every
+  PROFILE_SAMPLE_INTERVAL seconds; low overhead, written as collapsed stacks
+
+Collapsed stacks (``frame;frame;frame count`` per line) feed directly into
+flamegraph.pl, speedscope or inferno. Profiles are rate limited per process by
+PROFILE_MAX_PER_MINUTE and the oldest files beyond PROFILE_MAX_FILES are deleted.
+"""
+import cProfile
+import collections
+import logging
+import os
+import pstats
+import re
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from flask import current_app, g, request
+from flask_login import current_user
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROFILE_DIR = os.path.join(tempfile.gettempdir(), 'expense_tracker_profiles')
+PROFILE_MODES = ('cprofile', 'sample')
+PROFILE_EXTENSIONS = ('.pstats', '.collapsed')
+
+_rate_lock = threading.Lock()
+_recent_profiles = collections.deque()
+
+
+def _frame_label(filename, lineno, name):
+    # Semicolons separate frames in collapsed stacks; the count follows the last space
+    return f'{name} ({os.path.basename(filename)}:{lineno})'.replace(';', ':')
+
+
+class SamplingProfiler:
+    """Samples one thread's stack from a background thread"""
+
+    def __init__(self, thread_id, interval, max_duration):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_duration = max_duration
+        self.samples = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        deadline = time.monotonic() + self.max_duration
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(_frame_label(code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            self.samples[';'.join(reversed(stack))] += 1
+            if time.monotonic() > deadline:
+                break
+
+    def collapsed(self):
+        return [f'{stack} {count}' for stack, count in self.samples.most_common()]
+
+
+def collapse_pstats(stats):
+    """
+    Approximate collapsed stacks (in microseconds) from a cProfile call graph.
+
+    cProfile only records caller -> callee edges, so time is split down the
+    graph in proportion to each edge's share of the callee's cumulative time.
+    """
+    children = collections.defaultdict(list)
+    roots = []
+    for func, (_, _, _, cumulative, callers) in stats.stats.items():
+        if not callers:
+            roots.append(func)
+        for caller, (_, _, _, edge_cumulative) in callers.items():
+            children[caller].append((func, edge_cumulative))
+
+    lines = collections.Counter()
+
+    def walk(func, budget, path, on_stack):
+        _, _, own_time, cumulative, _ = stats.stats[func]
+        label = _frame_label(*func)
+        path = f'{path};{label}' if path else label
+        share = budget / cumulative if cumulative else 0
+        lines[path] += own_time * share
+        for callee, edge_cumulative in children.get(func, ()):
+            if callee in on_stack:
+                continue
+            walk(callee, edge_cumulative * share, path, on_stack | {callee})
+
+    for root in roots:
+        walk(root, stats.stats[root][3], '', {root})
+
+    return [
+        f'{stack} {int(seconds * 1_000_000)}'
+        for stack, seconds in sorted(lines.items(), key=lambda item: item[1], reverse=True)
+        if seconds * 1_000_000 >= 1
+    ]
+
+
+def _requested_mode():
+    mode = (request.headers.get('X-Profile') or request.args.get('_profile') or '').strip().lower()
+    if not mode:
+        return None
+    if mode in ('1', 'true', 'yes'):
+        mode = current_app.config['PROFILE_DEFAULT_MODE']
+    return mode if mode in PROFILE_MODES else None
+
+
+def _acquire_slot(limit):
+    """Per-process rate limit: at most limit profiles in any 60 second window"""
+    now = time.monotonic()
+    with _rate_lock:
+        while _recent_profiles and now - _recent_profiles[0] > 60:
+            _recent_profiles.popleft()
+        if len(_recent_profiles) >= limit:
+            return False
+        _recent_profiles.append(now)
+        return True
+
+
+def profile_dir():
+    path = current_app.config.get('PROFILE_DIR') or DEFAULT_PROFILE_DIR
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _enforce_retention(directory, max_files):
+    files = [
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.endswith(PROFILE_EXTENSIONS)
+    ]
+    if len(files) <= max_files:
+        return
+    files.sort(key=lambda path: os.path.getmtime(path))
+    for path in files[:len(files) - max_files]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _write_profile(mode, profiler, elapsed):
+    directory = profile_dir()
+    endpoint = re.sub(r'[^A-Za-z0-9_.-]', '_', request.endpoint or 'unmatched')
+    base = f'{datetime.utcnow():%Y%m%dT%H%M%S%f}_{endpoint}_{mode}_{os.getpid()}'
+    base_path = os.path.join(directory, base)
+
+    if mode == 'cprofile':
+        stats = pstats.Stats(profiler)
+        stats.dump_stats(f'{base_path}.pstats')
+        collapsed = collapse_pstats(stats)
+    else:
+        collapsed = profiler.collapsed()
+
+    with open(f'{base_path}.collapsed', 'w') as f:
+        f.write('\n'.join(collapsed) + '\n')
+
+    _enforce_retention(directory, current_app.config['PROFILE_MAX_FILES'])
+    logger.info('Profiled %s %s (%s, %.1f ms) -> %s', request.method, request.path, mode, elapsed * 1000, base_path)
+    return base
+
+
+def _start_profile():
+    mode = _requested_mode()
+    if mode is None:
+        return
+    if not (current_user.is_authenticated and current_user.is_admin):
+        return
+    if not _acquire_slot(current_app.config['PROFILE_MAX_PER_MINUTE']):
+        logger.warning('Profile of %s skipped: PROFILE_MAX_PER_MINUTE reached', request.path)
+        return
+
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active in this interpreter
+            logger.warning('Profile of %s skipped: another profiler is active', request.path)
+            return
+    else:
+        profiler = SamplingProfiler(
+            threading.get_ident(),
+            current_app.config['PROFILE_SAMPLE_INTERVAL'],
+            current_app.config['PROFILE_MAX_DURATION']
+        )
+        profiler.start()
+    g._profile = (mode, profiler, time.perf_counter())
+
+
+def _stop(profiler, mode):
+    if mode == 'cprofile':
+        profiler.disable()
+    else:
+        profiler.stop()
+
+
+def _finish_profile(response):
+    active = g.pop('_profile', None)
+    if active is None:
+        return response
+    mode, profiler, started = active
+    _stop(profiler, mode)
+    try:
+        response.headers['X-Profile-Id'] = _write_profile(mode, profiler, time.perf_counter() - started)
+    except OSError as e:
+        logger.warning('Could not write profile: %s', e)
+    return response
+
+
+def _discard_profile(exception=None):
+    # A request that failed before after_request must not leave a profiler running
+    active = g.pop('_profile', None)
+    if active is not None:
+        _stop(active[1], active[0])
+
+
+def init_app(app):
+    if not app.config.get('PROFILING_ENABLED'):
+        return
+    app.before_request(_start_profile)
+    app.after_request(_finish_profile)
+    app.teardown_request(_discard_profile)
@@ -0,0 +1,133 @@
+"""
+Read-replica routing for the dashboard, chart API, settlement and export reads.
+
+With READ_REPLICA_URL set, the URL becomes the ``replica`` bind and GET
+requests to READ_REPLICA_ENDPOINTS run their queries on it, so heavy
+aggregations stop competing with expense writes on the primary. Flushes and
+INSERT/UPDATE/DELETE statements always go to the primary, and a request
+that writes anything reads from the primary for the rest of the request.
+
+Replicas lag behind the primary. After a client's own write, its requests
+read from the primary for READ_REPLICA_PIN_SECONDS; the deadline is kept in
+the signed session cookie, so it holds across worker processes.
+
+A copy of a SQLite database works as a local replica; ``flask replica copy``
+refreshes it from the primary.
+"""
+import logging
+import os
+import sqlite3
+import time
+import click
+from flask import current_app, g, has_request_context, request, session as client_session
+from flask.cli import AppGroup, with_appcontext
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from backend.database import db, set_read_router
+from backend.utils import engine_config, metrics
+
+logger = logging.getLogger(__name__)
+
+REPLICA_BIND = 'replica'
+# Session cookie key holding the time until which the client reads from the primary
+PIN_KEY = '_primary_until'
+READ_METHODS = ('GET', 'HEAD')
+
+DB_READS = metrics.counter(
+    'db_read_requests_total', 'Requests on replica-routed endpoints by database used', ('endpoint', 'database'))
+
+_settings = {
+    'enabled': False,
+    'endpoints': frozenset(),
+    'pin_seconds': 5.0,
+}
+_listeners_installed = False
+
+replica_cli = AppGroup('replica', help='Read replica maintenance.')
+
+
+def _route(session, mapper, clause):
+    """Engine for a statement of the current request, or None for the primary"""
+    if not has_request_context() or not g.get('read_replica'):
+        return None
+    if clause is not None and getattr(clause, 'is_dml', False):
+        return None
+    return db.get_engine(session.app, bind=REPLICA_BIND)
+
+
+def _mark_write(session, flush_context):
+    # Read the request's own writes back from the primary, now and for the pin window
+    if has_request_context():
+        g.read_replica = False
+        g._replica_pin = True
+
+
+def _install_listeners():
+    global _listeners_installed
+    if not _listeners_installed:
+        event.listen(db.session, 'after_flush', _mark_write)
+        set_read_router(_route)
+        _listeners_installed = True
+
+
+def _choose_database():
+    endpoint = request.endpoint
+    if endpoint not in _settings['endpoints'] or request.method not in READ_METHODS:
+        return
+    g.read_replica = client_session.get(PIN_KEY, 0) <= time.time()
+    DB_READS.inc(endpoint=endpoint, database=REPLICA_BIND if g.read_replica else 'primary')
+
+
+def _pin_writer(response):
+    if g.pop('_replica_pin', False):
+        client_session[PIN_KEY] = time.time() + _settings['pin_seconds']
+    return response
+
+
+def sqlite_path(app, uri):
+    """File behind a sqlite:/// URL, resolved the way Flask-SQLAlchemy does"""
+    url = make_url(uri)
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        return None
+    return os.path.join(app.root_path, url.database)
+
+
+@replica_cli.command('copy')
+@with_appcontext
+def copy_replica():
+    """Refresh a SQLite replica with a consistent copy of the SQLite primary"""
+    app = current_app._get_current_object()
+    replica_uri = app.config['READ_REPLICA_URL']
+    source = sqlite_path(app, app.config['SQLALCHEMY_DATABASE_URI'])
+    target = sqlite_path(app, replica_uri) if replica_uri else None
+    if not source or not target:
+        raise click.ClickException('Copying needs SQLite files for both the database and READ_REPLICA_URL')
+
+    # The backup API copies a consistent snapshot while the app keeps writing
+    primary = sqlite3.connect(source)
+    replica = sqlite3.connect(target)
+    try:
+        with replica:
+            primary.backup(replica)
+    finally:
+        replica.close()
+        primary.close()
+    click.echo(f'Copied {source} to {target}', err=True)
+
+
+def init_app(app):
+    """Call before the first database connection is made"""
+    app.cli.add_command(replica_cli)
+    url = engine_config.normalize_url(app.config.get('READ_REPLICA_URL'))
+    _settings['enabled'] = bool(url)
+    _settings['endpoints'] = frozenset(app.config['READ_REPLICA_ENDPOINTS'])
+    _settings['pin_seconds'] = app.config['READ_REPLICA_PIN_SECONDS']
+    if not _settings['enabled']:
+        return
+
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    binds[REPLICA_BIND] = url
+    app.config['SQLALCHEMY_BINDS'] = binds
+    _install_listeners()
+    app.before_request(_choose_database)
+    app.after_request(_pin_writer)
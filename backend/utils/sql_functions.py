@@ -0,0 +1,40 @@
+"""
+SQL expressions that compile differently per database dialect.
+
+The date helpers render with literal format strings so that the same
+expression in SELECT DISTINCT and ORDER BY compiles to identical SQL, which
+Postgres requires.
+"""
+from sqlalchemy import func, literal
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.types import String
+
+
+class year_month(FunctionElement):
+    """'YYYY-MM' text of a date or datetime column"""
+    type = String()
+    name = 'year_month'
+    inherit_cache = True
+
+
+def _column(element):
+    return list(element.clauses)[0]
+
+
+@compiles(year_month)
+def _year_month_postgresql(element, compiler, **kw):
+    kw['literal_binds'] = True
+    return compiler.process(func.to_char(_column(element), literal('YYYY-MM')), **kw)
+
+
+@compiles(year_month, 'sqlite')
+def _year_month_sqlite(element, compiler, **kw):
+    kw['literal_binds'] = True
+    return compiler.process(func.strftime(literal('%Y-%m'), _column(element)), **kw)
+
+
+@compiles(year_month, 'mysql')
+def _year_month_mysql(element, compiler, **kw):
+    kw['literal_binds'] = True
+    return compiler.process(func.date_format(_column(element), literal('%Y-%m')), **kw)
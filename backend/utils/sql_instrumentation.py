@@ -0,0 +1,180 @@
+"""
+Opt-in SQL instrumentation: per-request query counts, DB time and N+1 detection.
+
+Enable with SQL_INSTRUMENTATION=1. Each request then gets a Server-Timing
+header with its query count and database time. Statements repeated with
+different parameters (the N+1 pattern) and routes over their configured
+query budget are logged. count_queries() and assert_max_queries() give tests
+the same numbers without enabling anything globally.
+"""
+import contextlib
+import logging
+import threading
+import time
+from collections import defaultdict
+from flask import current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_listeners_installed = False
+_install_lock = threading.Lock()
+
+
+class QueryStats:
+    """Queries executed while a collector was active"""
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        # statement -> [executions, distinct parameter sets, seconds]
+        self.statements = defaultdict(lambda: [0, set(), 0.0])
+
+    def record(self, statement, parameters, duration):
+        self.count += 1
+        self.total_time += duration
+        entry = self.statements[statement]
+        entry[0] += 1
+        entry[2] += duration
+        try:
+            entry[1].add(hash(repr(parameters)))
+        except TypeError:
+            pass
+
+    @property
+    def total_ms(self):
+        return self.total_time * 1000
+
+    def repeated_statements(self, threshold):
+        """[(statement, executions, distinct parameter sets, seconds)] that look like N+1 queries"""
+        return sorted(
+            (
+                (statement, executions, len(parameter_sets), seconds)
+                for statement, (executions, parameter_sets, seconds) in self.statements.items()
+                if executions >= threshold and len(parameter_sets) > 1
+            ),
+            key=lambda item: item[1],
+            reverse=True
+        )
+
+
+def _active_collectors():
+    collectors = getattr(_local, 'collectors', None)
+    if collectors is None:
+        collectors = _local.collectors = []
+    return collectors
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _active_collectors():
+        conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    collectors = _active_collectors()
+    start_times = conn.info.get('query_start_time')
+    if not collectors or not start_times:
+        return
+    duration = time.perf_counter() - start_times.pop()
+    for collector in collectors:
+        collector.record(statement, parameters, duration)
+
+
+def install_listeners():
+    """Hook every SQLAlchemy engine; safe to call more than once"""
+    global _listeners_installed
+    with _install_lock:
+        if not _listeners_installed:
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+            _listeners_installed = True
+
+
+def start_collecting():
+    """Start collecting the current thread's queries into a new QueryStats"""
+    install_listeners()
+    stats = QueryStats()
+    _active_collectors().append(stats)
+    return stats
+
+
+def stop_collecting(stats):
+    collectors = _active_collectors()
+    if stats in collectors:
+        collectors.remove(stats)
+
+
+@contextlib.contextmanager
+def count_queries():
+    """Collect the queries run by the current thread inside the block"""
+    stats = start_collecting()
+    try:
+        yield stats
+    finally:
+        stop_collecting(stats)
+
+
+@contextlib.contextmanager
+def assert_max_queries(limit):
+    """Fail with AssertionError if the block runs more than limit queries"""
+    with count_queries() as stats:
+        yield stats
+    if stats.count > limit:
+        repeated = stats.repeated_statements(2)
+        detail = f'; most repeated: {repeated[0][0]!r} x{repeated[0][1]}' if repeated else ''
+        raise AssertionError(f'Expected at most {limit} queries, ran {stats.count}{detail}')
+
+
+def _start_request():
+    g._query_stats = start_collecting()
+    g._request_started = time.perf_counter()
+
+
+def _finish_request(response):
+    stats = g.pop('_query_stats', None)
+    if stats is None:
+        return response
+    stop_collecting(stats)
+
+    elapsed_ms = (time.perf_counter() - g.pop('_request_started')) * 1000
+    response.headers.add(
+        'Server-Timing',
+        f'db;dur={stats.total_ms:.2f};desc="{stats.count} queries", app;dur={elapsed_ms:.2f}'
+    )
+
+    route = request.endpoint or request.path
+    threshold = current_app.config['SQL_N_PLUS_ONE_THRESHOLD']
+    for statement, executions, distinct, seconds in stats.repeated_statements(threshold):
+        logger.warning(
+            'Possible N+1 in %s (%s %s): statement ran %d times with %d parameter sets (%.1f ms): %s',
+            route, request.method, request.path, executions, distinct, seconds * 1000,
+            ' '.join(statement.split())[:300]
+        )
+
+    budget = current_app.config['SQL_QUERY_BUDGETS'].get(route)
+    if budget is not None and stats.count > budget:
+        logger.warning('%s ran %d queries, over its budget of %d', route, stats.count, budget)
+    return response
+
+
+def _discard_request_stats(exception=None):
+    # Requests that failed before after_request still must not leave a collector behind
+    stats = g.pop('_query_stats', None)
+    if stats is not None:
+        stop_collecting(stats)
+
+
+def current_stats():
+    """Query stats of the current request, or None if instrumentation is off"""
+    return g.get('_query_stats')
+
+
+def init_app(app):
+    if not app.config.get('SQL_INSTRUMENTATION'):
+        return
+    install_listeners()
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_discard_request_stats)
@@ -0,0 +1,133 @@
+"""
+SQLite production profile: WAL, tuned pragmas, busy timeout and write retries.
+
+With SQLITE_PRODUCTION enabled and a sqlite:// database, every new connection
+switches to WAL journaling (readers no longer block behind a writer),
+synchronous=NORMAL (durable at checkpoints, no fsync per commit), a larger
+page cache and memory-mapped I/O, and waits SQLITE_BUSY_TIMEOUT ms for a
+competing writer instead of failing at once.
+
+SQLite still allows one writer at a time. run_write() serializes the writers
+of a process and, when the database stays locked past the busy timeout or a
+read snapshot went stale, rolls back and runs the whole unit of work again
+with backoff. Units of work must therefore only touch the database session,
+so running them twice is safe.
+"""
+import logging
+import random
+import sqlite3
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from backend.database import db
+
+logger = logging.getLogger(__name__)
+
+_settings = {
+    'enabled': False,
+    'busy_timeout_ms': 5000,
+    'cache_size_kb': 20000,
+    'mmap_size': 256 * 1024 * 1024,
+    'write_retries': 5,
+    'retry_delay': 0.05,
+}
+_write_lock = threading.RLock()
+_listener_installed = False
+
+_LOCKED_MESSAGES = ('database is locked', 'database table is locked', 'database is busy')
+
+
+def is_locked_error(error):
+    """Whether an exception is SQLite reporting a lock conflict"""
+    original = getattr(error, 'orig', error)
+    return isinstance(original, sqlite3.OperationalError) and any(
+        message in str(original).lower() for message in _LOCKED_MESSAGES
+    )
+
+
+def _set_pragmas(dbapi_connection, connection_record):
+    if not _settings['enabled'] or not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute(f'PRAGMA busy_timeout={int(_settings["busy_timeout_ms"])}')
+        # Negative cache_size is in KiB rather than pages
+        cursor.execute(f'PRAGMA cache_size=-{int(_settings["cache_size_kb"])}')
+        cursor.execute(f'PRAGMA mmap_size={int(_settings["mmap_size"])}')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+    finally:
+        cursor.close()
+
+
+def _install_listener():
+    global _listener_installed
+    if not _listener_installed:
+        event.listen(Engine, 'connect', _set_pragmas)
+        _listener_installed = True
+
+
+def run_write(work, session=None):
+    """
+    Run work() and commit, retrying on SQLite lock errors.
+
+    Returns work()'s result. Without the SQLite production profile this is a
+    plain work() followed by commit().
+    """
+    session = session or db.session
+    if not _settings['enabled']:
+        result = work()
+        session.commit()
+        return result
+
+    retries = _settings['write_retries']
+    for attempt in range(retries + 1):
+        with _write_lock:
+            try:
+                result = work()
+                session.commit()
+                return result
+            except OperationalError as e:
+                session.rollback()
+                if not is_locked_error(e) or attempt == retries:
+                    raise
+        # Exponential backoff with jitter so competing processes do not retry in lockstep
+        delay = _settings['retry_delay'] * (2 ** attempt) * (0.5 + random.random())
+        logger.warning('Database locked, retrying write in %.0f ms (attempt %d of %d)', delay * 1000, attempt + 1, retries)
+        time.sleep(delay)
+
+
+def configure(enabled, busy_timeout_ms=None, cache_size_kb=None, mmap_size=None, write_retries=None, retry_delay=None):
+    """Apply settings to connections opened from now on"""
+    _settings['enabled'] = enabled
+    for key, value in (
+        ('busy_timeout_ms', busy_timeout_ms), ('cache_size_kb', cache_size_kb), ('mmap_size', mmap_size),
+        ('write_retries', write_retries), ('retry_delay', retry_delay)
+    ):
+        if value is not None:
+            _settings[key] = value
+    if enabled:
+        _install_listener()
+
+
+def init_app(app):
+    """Call before the first database connection is made"""
+    uri = app.config.get('SQLALCHEMY_DATABASE_URI') or ''
+    configure(
+        app.config['SQLITE_PRODUCTION'] and uri.startswith('sqlite'),
+        busy_timeout_ms=app.config['SQLITE_BUSY_TIMEOUT'],
+        cache_size_kb=app.config['SQLITE_CACHE_SIZE_KB'],
+        mmap_size=app.config['SQLITE_MMAP_SIZE'],
+        write_retries=app.config['SQLITE_WRITE_RETRIES'],
+        retry_delay=app.config['SQLITE_WRITE_RETRY_DELAY'],
+    )
+    if _settings['enabled']:
+        # pysqlite applies its timeout (in seconds) while connecting, before the pragmas run
+        options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+        connect_args = dict(options.get('connect_args') or {})
+        connect_args.setdefault('timeout', _settings['busy_timeout_ms'] / 1000)
+        options['connect_args'] = connect_args
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
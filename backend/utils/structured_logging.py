@@ -0,0 +1,100 @@
+"""
+Structured, leveled logging for the backend package.
+
+init_app() attaches one handler to the ``backend`` logger, so every module
+that uses ``logging.getLogger(__name__)`` is covered:
+
+- LOG_LEVEL sets the threshold (DEBUG, INFO, WARNING, ...)
+- LOG_FORMAT is ``text`` or ``json`` (one JSON object per line)
+- LOG_DEBUG_SAMPLE_RATE is the fraction of requests whose DEBUG records are
+  emitted; the decision is made once per request so sampled requests are
+  logged completely
+
+Every record carries a request id, taken from the incoming X-Request-ID
+header or generated, and echoed on the response. Call sites pass arguments
+instead of f-strings (``logger.debug('Trip %s', trip_id)``) so disabled
+levels cost one integer comparison and unsampled records are never formatted.
+"""
+import json
+import logging
+import random
+import re
+import sys
+import uuid
+from flask import current_app, g, has_request_context, request
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+# Incoming ids are echoed into logs and headers, so only accept short plain tokens
+_VALID_REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s'
+
+
+def current_request_id():
+    if has_request_context():
+        return g.get('request_id', '-')
+    return '-'
+
+
+class RequestContextFilter(logging.Filter):
+    """Adds request_id to records and drops DEBUG records of unsampled requests"""
+
+    def filter(self, record):
+        record.request_id = current_request_id()
+        if record.levelno < logging.INFO and has_request_context():
+            return g.get('log_sampled', True)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the fields log shippers index on"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', '-'),
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def _assign_request_id():
+    incoming = request.headers.get(REQUEST_ID_HEADER, '')
+    g.request_id = incoming if _VALID_REQUEST_ID.match(incoming) else uuid.uuid4().hex
+    rate = current_app.config['LOG_DEBUG_SAMPLE_RATE']
+    g.log_sampled = rate >= 1 or random.random() < rate
+
+
+def _echo_request_id(response):
+    request_id = g.get('request_id')
+    if request_id:
+        response.headers[REQUEST_ID_HEADER] = request_id
+    return response
+
+
+def configure_logging(level='INFO', fmt='text', stream=None):
+    """Install the backend handler; safe to call repeatedly"""
+    logger = logging.getLogger('backend')
+    for handler in list(logger.handlers):
+        if getattr(handler, '_backend_structured', False):
+            logger.removeHandler(handler)
+
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler._backend_structured = True
+    handler.addFilter(RequestContextFilter())
+    handler.setFormatter(JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    logger.addHandler(handler)
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    logger.propagate = False
+    return logger
+
+
+def init_app(app):
+    configure_logging(app.config['LOG_LEVEL'], app.config['LOG_FORMAT'])
+    app.before_request(_assign_request_id)
+    app.after_request(_echo_request_id)
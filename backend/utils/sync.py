@@ -0,0 +1,67 @@
+"""
+Parallel recomputation of trip balances.
+
+Each trip is recalculated in a worker thread inside its own application
+context, so every task gets its own scoped database session.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import current_app
+from backend.database import db
+from backend.models.trip import Trip
+
+logger = logging.getLogger(__name__)
+
+
+def sync_trip(app, trip_id):
+    """Recalculate one trip's balances and describe the outcome"""
+    started = time.perf_counter()
+    with app.app_context():
+        try:
+            trip = Trip.query.get(trip_id)
+            if trip is None:
+                raise LookupError(f'Trip {trip_id} no longer exists')
+            balances = trip.recalculate_all_balances()
+            return {
+                'trip_id': trip_id,
+                'name': trip.name,
+                'success': True,
+                'participants': len(balances),
+                'duration_ms': round((time.perf_counter() - started) * 1000, 1)
+            }
+        except Exception as e:
+            logger.exception('Error syncing trip %s', trip_id)
+            return {
+                'trip_id': trip_id,
+                'success': False,
+                'error': str(e) or e.__class__.__name__,
+                'duration_ms': round((time.perf_counter() - started) * 1000, 1)
+            }
+        finally:
+            db.session.remove()
+
+
+def iter_sync(trip_ids, max_workers=None):
+    """Recalculate trips concurrently, yielding each trip's result as it finishes"""
+    if not trip_ids:
+        return
+    app = current_app._get_current_object()
+    max_workers = max(1, min(max_workers or app.config['SYNC_MAX_WORKERS'], len(trip_ids)))
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='trip-sync') as executor:
+        futures = [executor.submit(sync_trip, app, trip_id) for trip_id in trip_ids]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def failed_trip(result):
+    """How a failed trip is reported in failed_trips by /api/sync and the sync_account job"""
+    return {'trip_id': result['trip_id'], 'error': result['error']}
+
+
+def sync_trips(trip_ids, max_workers=None):
+    """Recalculate trips concurrently; returns (sync_count, results)"""
+    results = list(iter_sync(trip_ids, max_workers))
+    sync_count = sum(1 for result in results if result['success'])
+    return sync_count, sorted(results, key=lambda result: result['trip_id'])
@@ -0,0 +1,69 @@
+"""
+Jinja bytecode cache for fast cold starts.
+
+With TEMPLATE_CACHE_DIR set, compiled templates are stored in that
+directory and loaded from it instead of being parsed and compiled again by
+every new process. ``flask templates compile`` fills the cache ahead of
+time, e.g. during a build, so the first request of a serverless instance
+skips template compilation. Stale entries are detected by a checksum of the
+template source and recompiled.
+"""
+import logging
+import os
+import click
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+from jinja2 import FileSystemBytecodeCache
+
+logger = logging.getLogger(__name__)
+
+templates_cli = AppGroup('templates', help='Template bytecode cache.')
+
+
+class PortableBytecodeCache(FileSystemBytecodeCache):
+    """
+    Keys entries by template name only, so a cache compiled in a build
+    directory is still found after the app is deployed to another path.
+    Writes that fail, e.g. on a read-only deployment, are skipped.
+    """
+
+    def get_cache_key(self, name, filename=None):
+        return super().get_cache_key(name)
+
+    def dump_bytecode(self, bucket):
+        try:
+            super().dump_bytecode(bucket)
+        except OSError as e:
+            logger.debug('Could not write template cache for %s: %s', bucket.key, e)
+
+
+def compile_all(app):
+    """Compile every template into the cache; returns the number compiled"""
+    names = [name for name in app.jinja_env.list_templates() if name.endswith('.html')]
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+@templates_cli.command('compile')
+@with_appcontext
+def compile_command():
+    """Precompile all templates into TEMPLATE_CACHE_DIR."""
+    app = current_app._get_current_object()
+    if app.jinja_env.bytecode_cache is None:
+        raise click.ClickException('Set TEMPLATE_CACHE_DIR to compile templates into a cache')
+    count = compile_all(app)
+    click.echo(f'Compiled {count} template(s) into {app.config["TEMPLATE_CACHE_DIR"]}', err=True)
+
+
+def init_app(app):
+    app.cli.add_command(templates_cli)
+    directory = app.config.get('TEMPLATE_CACHE_DIR')
+    if not directory:
+        return
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError:
+        # A read-only deployment can still load a cache compiled at build time
+        pass
+    app.jinja_env.bytecode_cache = PortableBytecodeCache(directory)
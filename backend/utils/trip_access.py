@@ -0,0 +1,85 @@
+"""
+Trip authorization from the trip_member index.
+
+member_roles(user_id) returns {trip_id: role} for every trip a user can
+open. It reads the indexed trip_member table once per user, keeps the result
+for the rest of the request in flask.g and for TRIP_ACCESS_TTL seconds in
+the process, so can_access() and trip_ids() are dictionary lookups rather
+than a get_trips() query plus a participants JSON parse per trip.
+
+A commit that changes membership clears the cache of the committing
+process. Other processes notice when their entries expire, so a removed
+participant can keep access for up to the TTL.
+"""
+import threading
+import time
+from flask import g, has_app_context
+from flask_login import current_user
+from backend.models.trip_member import TripMember
+from backend.utils import metrics
+from backend.utils.db_hooks import on_commit
+
+# Entries kept before expired ones are pruned
+MAX_CACHED_USERS = 10000
+
+_settings = {'ttl': 30.0}
+_lock = threading.Lock()
+# user id -> (expires at, {trip id: role})
+_roles = {}
+
+
+def _load(user_id):
+    rows = TripMember.query.with_entities(TripMember.trip_id, TripMember.role).filter_by(user_id=user_id).all()
+    return {trip_id: role for trip_id, role in rows}
+
+
+def member_roles(user_id=None):
+    """{trip_id: role} of the user's trips (the current user by default); do not mutate"""
+    user_id = current_user.id if user_id is None else int(user_id)
+    request_cache = g.setdefault('_trip_access', {})
+    if user_id in request_cache:
+        return request_cache[user_id]
+
+    now = time.monotonic()
+    entry = _roles.get(user_id) if _settings['ttl'] > 0 else None
+    cached = entry is not None and entry[0] > now
+    metrics.record_cache('trip_access', cached)
+    if cached:
+        roles = entry[1]
+    else:
+        roles = _load(user_id)
+        if _settings['ttl'] > 0:
+            with _lock:
+                if len(_roles) >= MAX_CACHED_USERS:
+                    for key in [key for key, (expires, _) in _roles.items() if expires <= now]:
+                        del _roles[key]
+                _roles[user_id] = (now + _settings['ttl'], roles)
+    request_cache[user_id] = roles
+    return roles
+
+
+def trip_ids(user_id=None):
+    """Sorted ids of the trips the user can open"""
+    return sorted(member_roles(user_id))
+
+
+def can_access(trip_id, user_id=None):
+    """Whether the user is the trip's admin or one of its participants"""
+    return trip_id in member_roles(user_id)
+
+
+def invalidate():
+    with _lock:
+        _roles.clear()
+    if has_app_context():
+        g.pop('_trip_access', None)
+
+
+@on_commit
+def _invalidate_changed_members(changes):
+    if any(change.table == 'trip_member' for change in changes):
+        invalidate()
+
+
+def init_app(app):
+    _settings['ttl'] = app.config['TRIP_ACCESS_TTL']
@@ -0,0 +1,236 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from flask import current_app
+from backend.database import db
+from backend.models.expense import Expense
+from backend.models.user import User
+from backend.models.unregistered_participant import UnregisteredParticipant
+from backend.utils import memory_profiling, metrics, pdf_cache
+from backend.utils.export import NameResolver
+from backend.utils.ledger import summarize_participants, settle_balances, category_totals
+
+logger = logging.getLogger(__name__)
+
+REPORT_KIND = 'report'
+SETTLEMENT_KIND = 'settlement'
+
+# Bump when a layout in pdf_generator changes so cached PDFs are regenerated. Kept
+# here so cache lookups and ETags do not import ReportLab.
+PDF_TEMPLATE_VERSION = 2
+REPORT_TEMPLATE_VERSION = 1
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+@metrics.timed(metrics.PDF_RENDER_TIME, kind='settlement')
+@memory_profiling.tracked('render_settlement_pdf')
+def render_settlement_pdf(trip):
+    """Render the one-page settlement summary PDF of a trip"""
+    from backend.utils.pdf_generator import generate_settlement_pdf
+
+    participants = trip.get_participants_list()
+
+    # Calculate settlements
+    settlements = trip.calculate_settlements()
+
+    # Calculate individual balances
+    balances = {}
+    for participant_id in participants:
+        balances[participant_id] = trip.calculate_user_balance(int(participant_id))
+
+    # Add admin if not already in participants
+    if str(trip.admin_id) not in participants:
+        balances[str(trip.admin_id)] = trip.calculate_user_balance(trip.admin_id)
+
+    # Create a user map for easy lookup
+    users = User.query.filter(User.id.in_([int(pid) for pid in participants] + [trip.admin_id])).all()
+    user_map = {str(user.id): user.name for user in users}
+
+    return generate_settlement_pdf(trip, settlements, balances, user_map, trip.calculate_total_expenses())
+
+
+def settlement_pdf(trip, data_version=None):
+    """Path of the trip's cached settlement PDF, rendering it on a cache miss"""
+    data_version = data_version or trip.get_data_version()
+    path, _ = pdf_cache.get_or_render(
+        SETTLEMENT_KIND, trip.id, data_version, PDF_TEMPLATE_VERSION,
+        lambda: render_settlement_pdf(trip)
+    )
+    return path
+
+
+@metrics.timed(metrics.LEDGER_TIME, operation='build_report_data')
+@memory_profiling.tracked('build_report_data')
+def build_report_data(trip):
+    """Collect everything the itemized trip report needs as plain Python data"""
+    resolver = NameResolver()
+
+    # Registered participants (including the admin) and unlinked unregistered participants,
+    # the same set Trip.calculate_settlements balances between
+    registered_ids = trip.get_participants_list()
+    if str(trip.admin_id) not in registered_ids:
+        registered_ids.append(str(trip.admin_id))
+    resolver.preload(registered_ids)
+    participant_ids = registered_ids + [f'unregistered_{name}' for name in trip.get_unregistered_participants()]
+
+    # Linked unregistered participants are shown under their registered user's name
+    linked = trip.unregistered_participants_list.filter(UnregisteredParticipant.linked_user_id.isnot(None)).all()
+    resolver.preload([participant.linked_user_id for participant in linked])
+    for participant in linked:
+        resolver.user_names[f'unregistered_{participant.name}'] = resolver.name(participant.linked_user_id)
+
+    rows = db.session.query(
+        Expense.date, Expense.description, Expense.category, Expense.amount,
+        Expense.split_method, Expense.payer_id, Expense.shares
+    ).filter(Expense.trip_id == trip.id).order_by(Expense.date, Expense.id).all()
+
+    expenses = []
+    ledger_entries = []
+    for date, description, category, amount, split_method, payer_id, shares in rows:
+        ledger_entries.append((payer_id, amount, json.loads(shares) if shares else {}))
+        expenses.append({
+            'date': date.strftime('%d %b %Y') if date else '',
+            'description': description or '',
+            'category': category or 'Uncategorized',
+            'payer': resolver.name(payer_id),
+            'split_method': split_method or '',
+            'amount': amount,
+        })
+
+    advances = trip.get_advances()
+    payments = trip.get_general_payments()
+    summary = summarize_participants(participant_ids, ledger_entries, advances, payments)
+    balances = {participant_id: totals['balance'] for participant_id, totals in summary.items()}
+
+    # The report shows the complete plan; every greedy step settles at least one participant
+    settlements = settle_balances(balances, max_iterations=len(balances) + 1)
+
+    return {
+        'trip': {
+            'id': trip.id,
+            'name': trip.name,
+            'start_date': trip.start_date.strftime('%d %b %Y'),
+            'end_date': trip.end_date.strftime('%d %b %Y'),
+        },
+        'generated_at': datetime.now().strftime('%d %b %Y %H:%M'),
+        'total_expenses': sum(expense['amount'] for expense in expenses),
+        'total_advances': sum(advances.values()),
+        'total_payments': sum(payment['amount'] for payment in payments),
+        'expenses': expenses,
+        'categories': category_totals((expense['category'], expense['amount']) for expense in expenses),
+        'participants': [
+            (resolver.name(participant_id), totals['paid'], totals['share'], totals['balance'])
+            for participant_id, totals in summary.items()
+        ],
+        'settlements': [
+            (resolver.name(s['from_user']), resolver.name(s['to_user']), s['amount'])
+            for s in settlements
+        ],
+    }
+
+
+@metrics.timed(metrics.PDF_RENDER_TIME, kind='report')
+@memory_profiling.tracked('render_report')
+def render_report(data):
+    """Render report data to PDF bytes"""
+    from backend.utils.pdf_generator import generate_trip_report_pdf
+    return generate_trip_report_pdf(data)
+
+
+def _render_to_file(data, path):
+    """Worker process entry point: render a report and store it at path"""
+    pending_path = f'{path}.pending'
+    error_path = f'{path}.error'
+    try:
+        pdf_cache.store(path, render_report(data))
+    except Exception as e:
+        with open(error_path, 'w') as f:
+            f.write(str(e) or e.__class__.__name__)
+        raise
+    finally:
+        try:
+            os.remove(pending_path)
+        except FileNotFoundError:
+            pass
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Imported here, as most processes never render a report in the background
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # Spawned workers start clean instead of inheriting the web worker's
+            # database connections and threads
+            _executor = ProcessPoolExecutor(
+                max_workers=current_app.config['REPORT_WORKERS'],
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _executor
+
+
+def report_path(trip, data_version=None):
+    """Path of the cached report for the trip's current data"""
+    data_version = data_version or trip.get_data_version()
+    return pdf_cache.cache_path(REPORT_KIND, trip.id, data_version, REPORT_TEMPLATE_VERSION)
+
+
+def report_status(path):
+    """Return 'ready', 'pending', 'failed' or 'missing' for the report at path"""
+    if os.path.exists(path):
+        return 'ready'
+    pending_path = f'{path}.pending'
+    if os.path.exists(pending_path):
+        # A render that outlived the timeout is assumed to have died with its worker
+        age = time.time() - os.path.getmtime(pending_path)
+        if age < current_app.config['REPORT_RENDER_TIMEOUT']:
+            return 'pending'
+    if os.path.exists(f'{path}.error'):
+        return 'failed'
+    return 'missing'
+
+
+def report_error(path):
+    try:
+        with open(f'{path}.error') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def start_report(trip):
+    """Make sure the trip's report is rendered or being rendered.
+
+    Small trips are rendered inline; larger ones are handed to the process
+    pool. Returns (status, path).
+    """
+    path = report_path(trip)
+    status = report_status(path)
+    metrics.record_cache('pdf_report', status in ('ready', 'pending'))
+    if status in ('ready', 'pending'):
+        return status, path
+
+    # Clear a previous failure before retrying
+    try:
+        os.remove(f'{path}.error')
+    except FileNotFoundError:
+        pass
+
+    data = build_report_data(trip)
+    if len(data['expenses']) < current_app.config['REPORT_ASYNC_THRESHOLD']:
+        pdf_cache.store(path, render_report(data))
+        return 'ready', path
+
+    with open(f'{path}.pending', 'w') as f:
+        f.write(str(os.getpid()))
+    trip_id = trip.id
+    future = _get_executor().submit(_render_to_file, data, path)
+    future.add_done_callback(lambda f: f.exception() and logger.error(
+        'Report rendering failed for trip %s: %s', trip_id, f.exception()))
+    return 'pending', path
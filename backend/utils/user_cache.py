@@ -0,0 +1,147 @@
+"""
+Cached Flask-Login user loading and write-behind last_seen updates.
+
+load_user() keeps a detached copy of each user's row for USER_CACHE_TTL
+seconds and attaches it to the request's session with merge(load=False),
+so an authenticated request no longer starts with a SELECT. Commits that
+change a user (profile, password, linked participants) drop the entry in the
+committing process; other processes see the change once their copy expires,
+so the TTL should stay short.
+
+update_last_seen() no longer commits. touch() records activity at most once
+per user per LAST_SEEN_UPDATE_INTERVAL seconds, and flush() writes all
+pending timestamps in one executemany UPDATE every LAST_SEEN_FLUSH_INTERVAL
+seconds, at the end of a request or when the process exits.
+"""
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import bindparam, inspect
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import make_transient_to_detached
+from backend.database import db
+from backend.models.user import User
+from backend.utils import metrics
+from backend.utils.db_hooks import on_commit
+
+logger = logging.getLogger(__name__)
+
+# Entries kept before expired ones are pruned
+MAX_CACHED_USERS = 10000
+
+_settings = {
+    'ttl': 60.0,
+    'last_seen_interval': 300.0,
+    'flush_interval': 30.0,
+}
+_lock = threading.Lock()
+# user id -> (expires at, detached User)
+_users = {}
+# user id -> time activity was last recorded, and user id -> pending last_seen
+_last_touched = {}
+_pending = {}
+_last_flush = [time.monotonic()]
+# App whose database receives the final flush when the process exits
+_exit_app = [None]
+
+
+def _snapshot(user):
+    """A detached, fully loaded copy of the user's columns that no session owns"""
+    copy = User(**{attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs})
+    make_transient_to_detached(copy)
+    return copy
+
+
+def load_user(user_id):
+    """Flask-Login user loader backed by the cache"""
+    user_id = int(user_id)
+    now = time.monotonic()
+    entry = _users.get(user_id) if _settings['ttl'] > 0 else None
+    cached = entry is not None and entry[0] > now
+    metrics.record_cache('user', cached)
+    if cached:
+        # Attaches a copy to this request's session without querying
+        return db.session.merge(entry[1], load=False)
+
+    user = User.query.get(user_id)
+    if user is not None and _settings['ttl'] > 0:
+        with _lock:
+            if len(_users) >= MAX_CACHED_USERS:
+                for key in [key for key, (expires, _) in _users.items() if expires <= now]:
+                    del _users[key]
+            _users[user_id] = (now + _settings['ttl'], _snapshot(user))
+    return user
+
+
+def invalidate(user_id=None):
+    """Drop one user's cached row, or all of them"""
+    with _lock:
+        if user_id is None:
+            _users.clear()
+        else:
+            _users.pop(int(user_id), None)
+
+
+@on_commit
+def _invalidate_changed_users(changes):
+    for change in changes:
+        if change.table == 'user' and change.id is not None:
+            invalidate(change.id)
+
+
+def touch(user_id):
+    """Record activity; at most one last_seen write per user per interval"""
+    now = time.monotonic()
+    with _lock:
+        if now - _last_touched.get(user_id, float('-inf')) < _settings['last_seen_interval']:
+            return
+        _last_touched[user_id] = now
+        _pending[user_id] = datetime.utcnow()
+
+
+def flush(force=False):
+    """Write pending last_seen timestamps in one statement; returns the number written"""
+    with _lock:
+        if not _pending or (not force and time.monotonic() - _last_flush[0] < _settings['flush_interval']):
+            return 0
+        batch = dict(_pending)
+        _pending.clear()
+        _last_flush[0] = time.monotonic()
+
+    table = User.__table__
+    statement = table.update().where(table.c.id == bindparam('b_id')).values(last_seen=bindparam('b_last_seen'))
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(statement, [{'b_id': key, 'b_last_seen': value} for key, value in batch.items()])
+    except SQLAlchemyError as e:
+        # Keep the timestamps for the next flush; newer activity recorded meanwhile wins
+        logger.warning('Could not write last_seen of %d user(s): %s', len(batch), e)
+        with _lock:
+            for key, value in batch.items():
+                _pending.setdefault(key, value)
+        return 0
+    return len(batch)
+
+
+def _flush_after_request(response):
+    flush()
+    return response
+
+
+def _flush_at_exit():
+    app = _exit_app[0]
+    if app is not None and _pending:
+        with app.app_context():
+            flush(force=True)
+
+
+def init_app(app):
+    _settings['ttl'] = app.config['USER_CACHE_TTL']
+    _settings['last_seen_interval'] = app.config['LAST_SEEN_UPDATE_INTERVAL']
+    _settings['flush_interval'] = app.config['LAST_SEEN_FLUSH_INTERVAL']
+    app.after_request(_flush_after_request)
+    if _exit_app[0] is None:
+        atexit.register(_flush_at_exit)
+    _exit_app[0] = app
@@ -0,0 +1,148 @@
+"""
+Concurrent read/write throughput of the SQLite database, with and without
+the SQLite production profile (see backend.utils.sqlite_mode).
+
+For each mode a fresh database is generated, then writer processes add
+expenses through sqlite_mode.run_write while reader processes calculate a
+trip's settlements, all for a fixed time. Each process is a separate
+connection, like the workers of a preforking server.
+
+Usage:
+    python -m benchmarks.concurrency --writers 4 --readers 4 --seconds 10
+    python -m benchmarks.concurrency --modes production --output results.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+# Allow running as a script from the project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.datagen import create_bench_app, generate, quiet
+from sqlalchemy.exc import OperationalError
+from backend.database import db
+from backend.models.trip import Trip
+from backend.models.expense import Expense
+from backend.utils import sqlite_mode
+
+MODES = {'default': False, 'production': True}
+
+
+def _app_for(database, production):
+    return create_bench_app(database, SQLITE_PRODUCTION=production)
+
+
+def _worker(role, database, production, trip_id, seconds):
+    """Run reads or writes until the deadline; returns (operations, lock errors, latencies in ms)"""
+    app = _app_for(database, production)
+    operations = errors = 0
+    latencies = []
+    deadline = time.monotonic() + seconds
+    with app.app_context(), quiet():
+        trip = Trip.query.get(trip_id)
+        payer_id = str(trip.admin_id)
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                if role == 'writer':
+                    expense = Expense(
+                        description='Concurrency benchmark', amount=100.0, date=datetime.utcnow(),
+                        payer_id=payer_id, trip_id=trip_id, split_method='equal',
+                        participants=json.dumps([payer_id]), shares=json.dumps({payer_id: 100.0})
+                    )
+                    sqlite_mode.run_write(lambda: db.session.add(expense))
+                else:
+                    Trip.query.get(trip_id).calculate_settlements()
+                    db.session.rollback()
+                operations += 1
+                latencies.append((time.perf_counter() - started) * 1000)
+            except OperationalError as e:
+                db.session.rollback()
+                if not sqlite_mode.is_locked_error(e):
+                    raise
+                errors += 1
+    return operations, errors, latencies
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))], 2)
+
+
+def run_mode(production, writers, readers, seconds, expenses):
+    fd, database = tempfile.mkstemp(prefix='bench_concurrency_', suffix='.db')
+    os.close(fd)
+    os.remove(database)
+    try:
+        app = _app_for(database, production)
+        summary = generate(app, trips=1, participants=10, expenses=expenses)
+        trip_id = summary['trips'][0]['id']
+        # The pragmas run on connect, so drop the generator's connections first
+        with app.app_context():
+            db.engine.dispose()
+
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=writers + readers, mp_context=context) as pool:
+            futures = {
+                role: [pool.submit(_worker, role, database, production, trip_id, seconds) for _ in range(count)]
+                for role, count in (('writer', writers), ('reader', readers))
+            }
+            results = {}
+            for role, role_futures in futures.items():
+                outcomes = [future.result() for future in role_futures]
+                latencies = [latency for _, _, worker_latencies in outcomes for latency in worker_latencies]
+                operations = sum(outcome[0] for outcome in outcomes)
+                results[role] = {
+                    'operations': operations,
+                    'per_second': round(operations / seconds, 1),
+                    'lock_errors': sum(outcome[1] for outcome in outcomes),
+                    'p50_ms': _percentile(latencies, 0.5),
+                    'p99_ms': _percentile(latencies, 0.99),
+                }
+        return results
+    finally:
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(database + suffix):
+                os.remove(database + suffix)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure concurrent SQLite read/write throughput.')
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--expenses', type=int, default=500, help='Expenses in the trip the readers settle.')
+    parser.add_argument('--modes', nargs='+', choices=sorted(MODES), default=['default', 'production'])
+    parser.add_argument('--output', '-o', help='Write JSON results to this file (defaults to stdout).')
+    args = parser.parse_args(argv)
+
+    report = {'writers': args.writers, 'readers': args.readers, 'seconds': args.seconds, 'results': {}}
+    for mode in args.modes:
+        print(f'Running {mode} mode...', file=sys.stderr)
+        results = run_mode(MODES[mode], args.writers, args.readers, args.seconds, args.expenses)
+        report['results'][mode] = results
+        for role, numbers in results.items():
+            print(
+                f'{mode:<11} {role:<7} {numbers["per_second"]:>9.1f}/s  p50 {numbers["p50_ms"]} ms  '
+                f'p99 {numbers["p99_ms"]} ms  {numbers["lock_errors"]} lock errors',
+                file=sys.stderr
+            )
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
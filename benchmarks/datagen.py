@@ -0,0 +1,297 @@
+"""
+Seeded synthetic data generator for benchmarks.
+
+Builds users, trips, unregistered participants, expenses (equal, exact and
+itemized splits), advances and general payments into a scratch database.
+The same seed always produces the same data.
+
+Usage:
+    python -m benchmarks.datagen --output bench.db --scenario medium
+    python -m benchmarks.datagen --output bench.db --trips 3 --participants 50 --expenses 20000
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Allow running as a script from the project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash
+from backend.app_factory import create_app
+from backend.database import db
+from backend.models.user import User
+from backend.models.trip import Trip
+from backend.models.expense import Expense
+from backend.models.unregistered_participant import UnregisteredParticipant
+
+# (trips, participants per trip, expenses per trip)
+SCENARIOS = {
+    'tiny': (2, 3, 10),
+    'small': (3, 8, 200),
+    'medium': (3, 25, 2000),
+    'large': (2, 100, 20000),
+    'huge': (1, 500, 100000),
+}
+
+BENCH_PASSWORD = 'benchmark'
+CATEGORIES = ['Food', 'Transport', 'Accommodation', 'Activities', 'Shopping', None]
+SPLIT_WEIGHTS = [('equal', 0.6), ('exact', 0.25), ('itemized', 0.15)]
+BASE_DATE = datetime(2024, 1, 1)
+
+
+def database_url(database):
+    """Accept either a SQLAlchemy URL or a path to a SQLite file"""
+    if '://' in database:
+        return database
+    return 'sqlite:///' + os.path.abspath(database)
+
+
+def create_bench_app(database, **config):
+    """Create the application bound to the given scratch database"""
+    return create_app({'SQLALCHEMY_DATABASE_URI': database_url(database), 'TESTING': True, **config})
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the models' debug prints while generating or timing"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def _pick_split_method(rng):
+    roll = rng.random()
+    for method, weight in SPLIT_WEIGHTS:
+        if roll < weight:
+            return method
+        roll -= weight
+    return 'equal'
+
+
+def _random_parts(rng, total, count):
+    """Split total into count positive parts rounded to 2 decimals"""
+    weights = [rng.uniform(0.5, 1.5) for _ in range(count)]
+    scale = total / sum(weights)
+    parts = [round(weight * scale, 2) for weight in weights]
+    parts[0] = round(parts[0] + total - sum(parts), 2)
+    return parts
+
+
+def random_split(rng, amount, payer_pool):
+    """Pick a split for an expense among payer_pool.
+
+    Returns (method, registered, unregistered, shares_data, items_data) in the
+    form Expense.update_split takes them.
+    """
+    # Most expenses involve a handful of people, a few involve everyone
+    group_size = len(payer_pool) if rng.random() < 0.1 else rng.randint(2, max(2, min(12, len(payer_pool))))
+    group = rng.sample(payer_pool, max(1, min(group_size, len(payer_pool))))
+    group_registered = [pid for pid in group if not pid.startswith('unregistered_')]
+    group_unregistered = [pid[len('unregistered_'):] for pid in group if pid.startswith('unregistered_')]
+
+    method = _pick_split_method(rng)
+    shares_data = None
+    items_data = None
+    if method == 'exact':
+        parts = _random_parts(rng, amount, len(group))
+        shares_data = dict(zip(group, parts))
+    elif method == 'itemized':
+        item_count = rng.randint(1, 5)
+        prices = _random_parts(rng, amount, item_count)
+        items_data = []
+        for index, price in enumerate(prices):
+            consumers = rng.sample(group, rng.randint(1, len(group)))
+            items_data.append({
+                'name': f'Item {index + 1}',
+                'price': price,
+                'participants': [pid for pid in consumers if not pid.startswith('unregistered_')],
+                'unregistered': [pid[len('unregistered_'):] for pid in consumers if pid.startswith('unregistered_')]
+            })
+    return method, group_registered, group_unregistered, shares_data, items_data
+
+
+def _build_expense(rng, trip, registered, unregistered, start_date, duration):
+    """Build a transient expense with its split calculated by the model itself"""
+    amount = round(rng.uniform(50, 20000), 2)
+    payer_pool = registered + [f'unregistered_{name}' for name in unregistered]
+    expense = Expense(
+        description=f'Expense {rng.randint(1, 10 ** 6)}',
+        amount=amount,
+        currency='INR',
+        category=rng.choice(CATEGORIES),
+        date=start_date + timedelta(days=rng.randint(0, duration), minutes=rng.randint(0, 1439)),
+        created_at=BASE_DATE,
+        updated_at=BASE_DATE,
+        payer_id=rng.choice(payer_pool),
+        trip_id=trip.id
+    )
+
+    method, group_registered, group_unregistered, shares_data, items_data = random_split(rng, amount, payer_pool)
+    expense.update_split(
+        method,
+        group_registered,
+        shares_data=shares_data,
+        items_data=items_data,
+        unregistered_participants=group_unregistered
+    )
+
+    return {
+        'description': expense.description,
+        'amount': expense.amount,
+        'currency': expense.currency,
+        'category': expense.category,
+        'date': expense.date,
+        'created_at': expense.created_at,
+        'updated_at': expense.updated_at,
+        'split_method': expense.split_method,
+        'payer_id': expense.payer_id,
+        'trip_id': expense.trip_id,
+        'participants': expense.participants,
+        'shares': expense.shares,
+        'items': expense.items
+    }
+
+
+def generate(app, seed=42, trips=3, participants=25, expenses=2000, unregistered_ratio=0.2, batch_size=5000):
+    """Populate the app's database and return a summary of what was created.
+
+    participants and expenses are per trip. Roughly unregistered_ratio of each
+    trip's participants are unregistered.
+    """
+    rng = random.Random(seed)
+    participants = max(2, participants)
+    unregistered_count = int(participants * unregistered_ratio)
+    registered_count = max(2, participants - unregistered_count)
+
+    summary = {'seed': seed, 'users': 0, 'trips': []}
+    with app.app_context(), quiet():
+        db.create_all()
+
+        # Hashing is deliberately slow, so every benchmark user shares one hash
+        password_hash = generate_password_hash(BENCH_PASSWORD)
+        user_count = registered_count + trips
+        first_user = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+        db.session.bulk_insert_mappings(User, [
+            {
+                'email': f'bench{first_user + index}@example.com',
+                'name': f'Bench User {first_user + index}',
+                'password_hash': password_hash,
+                'created_at': BASE_DATE,
+                'last_seen': BASE_DATE,
+                'linked_unregistered_names': '[]'
+            }
+            for index in range(user_count)
+        ])
+        db.session.commit()
+        user_ids = [user_id for (user_id,) in db.session.query(User.id).filter(User.id >= first_user).order_by(User.id)]
+        summary['users'] = len(user_ids)
+
+        for trip_index in range(trips):
+            started = time.perf_counter()
+            members = rng.sample(user_ids, registered_count)
+            admin_id = members[0]
+            start_date = BASE_DATE + timedelta(days=rng.randint(0, 300))
+            duration = rng.randint(2, 30)
+
+            trip = Trip(
+                name=f'Benchmark Trip {trip_index + 1}',
+                description='Generated benchmark data',
+                start_date=start_date,
+                end_date=start_date + timedelta(days=duration),
+                admin_id=admin_id,
+                participants=json.dumps([str(user_id) for user_id in members[1:]]),
+                created_at=BASE_DATE,
+                updated_at=BASE_DATE
+            )
+            db.session.add(trip)
+            db.session.commit()
+
+            unregistered = [f'guest {trip_index + 1}-{index + 1}' for index in range(unregistered_count)]
+            db.session.bulk_insert_mappings(UnregisteredParticipant, [
+                {'name': name, 'trip_id': trip.id, 'created_at': BASE_DATE} for name in unregistered
+            ])
+
+            registered = [str(user_id) for user_id in members]
+            everyone = registered + [f'unregistered_{name}' for name in unregistered]
+
+            # Advances for about a third of the participants, general payments for a few
+            trip.set_advances({
+                participant_id: round(rng.uniform(500, 5000), 2)
+                for participant_id in everyone if rng.random() < 0.3
+            })
+            trip.set_general_payments([
+                {
+                    'participant_id': rng.choice(everyone),
+                    'amount': round(rng.uniform(100, 3000), 2),
+                    'description': f'Payment {index + 1}',
+                    'date': (start_date + timedelta(days=rng.randint(0, duration))).strftime('%Y-%m-%d'),
+                    'expense_id': None
+                }
+                for index in range(max(1, len(everyone) // 5))
+            ])
+            db.session.commit()
+
+            batch = []
+            for _ in range(expenses):
+                batch.append(_build_expense(rng, trip, registered, unregistered, start_date, duration))
+                if len(batch) >= batch_size:
+                    db.session.bulk_insert_mappings(Expense, batch)
+                    db.session.commit()
+                    batch = []
+            if batch:
+                db.session.bulk_insert_mappings(Expense, batch)
+                db.session.commit()
+
+            summary['trips'].append({
+                'id': trip.id,
+                'admin_id': admin_id,
+                'participants': len(everyone),
+                'unregistered': len(unregistered),
+                'expenses': expenses,
+                'seconds': round(time.perf_counter() - started, 2)
+            })
+
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate synthetic expense tracker data into a scratch database.')
+    parser.add_argument('--output', '-o', required=True, help='SQLite file path or database URL to populate.')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='medium')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--trips', type=int, help='Number of trips (overrides the scenario).')
+    parser.add_argument('--participants', type=int, help='Participants per trip, 2-500 (overrides the scenario).')
+    parser.add_argument('--expenses', type=int, help='Expenses per trip, 10-100000 (overrides the scenario).')
+    parser.add_argument('--unregistered-ratio', type=float, default=0.2)
+    parser.add_argument('--force', action='store_true', help='Replace an existing SQLite output file.')
+    args = parser.parse_args(argv)
+
+    if '://' not in args.output and os.path.exists(args.output):
+        if not args.force:
+            parser.error(f'{args.output} already exists; pass --force to replace it')
+        os.remove(args.output)
+
+    trips, participants, expenses = SCENARIOS[args.scenario]
+    participants = min(500, max(2, args.participants or participants))
+    expenses = min(100000, max(10, args.expenses or expenses))
+
+    app = create_bench_app(args.output)
+    summary = generate(
+        app,
+        seed=args.seed,
+        trips=args.trips or trips,
+        participants=participants,
+        expenses=expenses,
+        unregistered_ratio=args.unregistered_ratio
+    )
+    json.dump(summary, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
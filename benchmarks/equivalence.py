@@ -0,0 +1,403 @@
+"""
+Differential equivalence harness for balance engines.
+
+Runs the current model implementations (Trip.calculate_user_balance,
+Trip.calculate_unregistered_balance, Trip.calculate_settlements and the
+Expense.calculate_*_split methods) side by side with a candidate engine on
+generated and randomized trips. Any per-participant difference above 0.01 is
+reported, along with timings of both sides.
+
+A candidate is any object (or class, which is instantiated) providing:
+
+    balances(participant_ids, expenses, advances, payments) -> {participant_id: balance}
+        expenses is a list of (payer_id, amount, shares) tuples, advances the
+        trip's advances dict and payments its general payments list
+    settlements(balances) -> [{'from_user', 'to_user', 'amount'}]
+        balances as returned by the reference engine
+
+and optionally equal_split(amount, participants, unregistered),
+exact_split(amount, shares_input, unregistered) and
+itemized_split(amount, items, unregistered), each returning a shares dict.
+Split checks a candidate does not implement are skipped.
+
+Random trips are drawn with Hypothesis when it is installed (failures are
+shrunk to a minimal example) and with a seeded random generator otherwise.
+
+Usage:
+    python -m benchmarks.equivalence --examples 200
+    python -m benchmarks.equivalence --candidate mypackage.engine:FastLedger --scenario medium
+"""
+import argparse
+import importlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+# Allow running as a script from the project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.datagen import (
+    BASE_DATE, BENCH_PASSWORD, SCENARIOS, create_bench_app, generate, quiet, random_split
+)
+from backend.database import db
+from backend.models.user import User
+from backend.models.trip import Trip
+from backend.models.expense import Expense
+from backend.models.unregistered_participant import UnregisteredParticipant
+from backend.utils.ledger import settle_balances, summarize_participants
+
+try:
+    from hypothesis import HealthCheck, given, settings, strategies as st
+except ImportError:
+    given = None
+
+TOLERANCE = 0.01
+DEFAULT_CANDIDATE = 'benchmarks.equivalence:LedgerEngine'
+
+
+class LedgerEngine:
+    """The single-pass engine in backend.utils.ledger, as used by the trip report"""
+
+    def balances(self, participant_ids, expenses, advances, payments):
+        summary = summarize_participants(participant_ids, expenses, advances, payments)
+        return {participant_id: totals['balance'] for participant_id, totals in summary.items()}
+
+    def settlements(self, balances):
+        # Trip.calculate_settlements caps the plan at 20 transfers
+        return settle_balances(balances, max_iterations=100)[:20]
+
+
+def load_candidate(spec):
+    module_name, _, attr = spec.partition(':')
+    candidate = getattr(importlib.import_module(module_name), attr or 'Candidate')
+    return candidate() if isinstance(candidate, type) else candidate
+
+
+class Timings:
+    """Accumulated reference and candidate time per operation"""
+
+    def __init__(self):
+        self.totals = defaultdict(lambda: {'reference': 0.0, 'candidate': 0.0, 'calls': 0})
+
+    def measure(self, operation, side, func, *args):
+        started = time.perf_counter()
+        result = func(*args)
+        self.totals[operation][side] += time.perf_counter() - started
+        if side == 'reference':
+            self.totals[operation]['calls'] += 1
+        return result
+
+    def summary(self):
+        return {
+            operation: {
+                'calls': totals['calls'],
+                'reference_ms': round(totals['reference'] * 1000, 3),
+                'candidate_ms': round(totals['candidate'] * 1000, 3),
+                'speedup': round(totals['reference'] / totals['candidate'], 2) if totals['candidate'] else None
+            }
+            for operation, totals in self.totals.items()
+        }
+
+
+def _diff_maps(expected, actual):
+    """{key: (expected, actual)} for keys whose values differ by more than the tolerance"""
+    differences = {}
+    for key in set(expected) | set(actual):
+        reference_value = expected.get(key, 0)
+        candidate_value = actual.get(key, 0)
+        if abs(reference_value - candidate_value) > TOLERANCE:
+            differences[key] = (round(reference_value, 4), round(candidate_value, 4))
+    return differences
+
+
+def _settlement_flows(settlements):
+    """Net money each participant sends (negative) or receives (positive)"""
+    flows = defaultdict(float)
+    for settlement in settlements:
+        flows[settlement['from_user']] -= settlement['amount']
+        flows[settlement['to_user']] += settlement['amount']
+    return flows
+
+
+def load_trip_data(trip):
+    """The trip's ledger inputs in the form candidates take them"""
+    participant_ids = trip.get_participants_list()
+    if str(trip.admin_id) not in participant_ids:
+        participant_ids.append(str(trip.admin_id))
+    participant_ids += [f'unregistered_{name}' for name in trip.get_unregistered_participants()]
+    rows = db.session.query(Expense.payer_id, Expense.amount, Expense.shares).filter(Expense.trip_id == trip.id).all()
+    expenses = [(payer_id, amount, json.loads(shares) if shares else {}) for payer_id, amount, shares in rows]
+    return participant_ids, expenses, trip.get_advances(), trip.get_general_payments()
+
+
+def _reference_balances(trip, participant_ids):
+    balances = {}
+    for participant_id in participant_ids:
+        if participant_id.startswith('unregistered_'):
+            balances[participant_id] = trip.calculate_unregistered_balance(participant_id)
+        else:
+            balances[participant_id] = trip.calculate_user_balance(participant_id)
+    return balances
+
+
+def compare_trip(trip, candidate, timings):
+    """Compare balances and settlements of one stored trip; returns a list of differences"""
+    differences = []
+    with quiet():
+        participant_ids = trip.get_participants_list()
+        if str(trip.admin_id) not in participant_ids:
+            participant_ids.append(str(trip.admin_id))
+        participant_ids += [f'unregistered_{name}' for name in trip.get_unregistered_participants()]
+
+        reference = timings.measure('balances', 'reference', _reference_balances, trip, participant_ids)
+        actual = timings.measure(
+            'balances', 'candidate', lambda: candidate.balances(*load_trip_data(trip))
+        )
+        for participant_id, (expected, got) in _diff_maps(reference, actual).items():
+            differences.append({'check': 'balance', 'trip_id': trip.id, 'participant': participant_id,
+                                'reference': expected, 'candidate': got})
+
+        reference_plan = timings.measure('settlements', 'reference', trip.calculate_settlements)
+        candidate_plan = timings.measure('settlements', 'candidate', candidate.settlements, dict(reference))
+
+    for participant_id, (expected, got) in _diff_maps(
+        _settlement_flows(reference_plan), _settlement_flows(candidate_plan)
+    ).items():
+        differences.append({'check': 'settlement', 'trip_id': trip.id, 'participant': participant_id,
+                            'reference': expected, 'candidate': got})
+    if len(reference_plan) != len(candidate_plan):
+        differences.append({'check': 'settlement_count', 'trip_id': trip.id,
+                            'reference': len(reference_plan), 'candidate': len(candidate_plan)})
+    return differences
+
+
+def compare_split(case, candidate, timings):
+    """Compare one expense split; returns a list of differences (empty if skipped)"""
+    method, registered, unregistered, shares_data, items_data, amount = case
+    candidate_method = getattr(candidate, f'{method}_split', None)
+    if candidate_method is None:
+        return []
+
+    expense = Expense(amount=amount)
+    expense.set_participants_list(registered)
+    with quiet():
+        if method == 'equal':
+            reference = timings.measure('equal_split', 'reference', expense.calculate_equal_split, unregistered)
+            actual = timings.measure('equal_split', 'candidate', candidate_method, amount, registered, unregistered)
+        elif method == 'exact':
+            reference = timings.measure('exact_split', 'reference', expense.calculate_exact_split,
+                                        shares_data, unregistered)
+            actual = timings.measure('exact_split', 'candidate', candidate_method, amount, shares_data, unregistered)
+        else:
+            reference = timings.measure('itemized_split', 'reference', expense.calculate_itemized_split,
+                                        items_data, unregistered)
+            actual = timings.measure('itemized_split', 'candidate', candidate_method, amount, items_data, unregistered)
+
+    return [
+        {'check': f'{method}_split', 'amount': amount, 'participant': participant_id,
+         'reference': expected, 'candidate': got}
+        for participant_id, (expected, got) in _diff_maps(reference, actual).items()
+    ]
+
+
+class CaseBuilder:
+    """Stores randomized trips in the scratch database"""
+
+    def __init__(self, max_users=8):
+        existing = User.query.filter(User.email.like('equiv%@example.com')).order_by(User.id).all()
+        for index in range(len(existing), max_users):
+            user = User(email=f'equiv{index}@example.com', name=f'Equivalence User {index}')
+            user.set_password(BENCH_PASSWORD)
+            db.session.add(user)
+            existing.append(user)
+        db.session.commit()
+        self.user_ids = [str(user.id) for user in existing]
+
+    def build(self, rng, registered_count, unregistered_count, expense_count):
+        """Create a random trip; returns (trip, split cases)"""
+        registered = rng.sample(self.user_ids, min(registered_count, len(self.user_ids)))
+        trip = Trip(
+            name=f'Equivalence Trip {rng.randint(1, 10 ** 9)}',
+            start_date=BASE_DATE,
+            end_date=BASE_DATE + timedelta(days=7),
+            admin_id=int(registered[0]),
+            participants=json.dumps(registered[1:])
+        )
+        db.session.add(trip)
+        db.session.flush()
+
+        unregistered = [f'guest{index}' for index in range(unregistered_count)]
+        for name in unregistered:
+            db.session.add(UnregisteredParticipant(name=name, trip_id=trip.id))
+        everyone = registered + [f'unregistered_{name}' for name in unregistered]
+
+        trip.set_advances({pid: round(rng.uniform(1, 5000), 2) for pid in everyone if rng.random() < 0.3})
+        trip.set_general_payments([
+            {'participant_id': rng.choice(everyone), 'amount': round(rng.uniform(1, 3000), 2),
+             'description': 'Payment', 'date': '2024-01-02', 'expense_id': None}
+            for _ in range(rng.randint(0, 3))
+        ])
+
+        split_cases = []
+        for _ in range(expense_count):
+            # Mix round, tiny and awkward amounts to exercise rounding adjustments
+            amount = rng.choice([
+                round(rng.uniform(0.01, 5), 2),
+                round(rng.uniform(1, 20000), 2),
+                float(rng.randint(1, 1000)),
+                round(rng.randint(1, 100) / 3, 2),
+            ])
+            split = random_split(rng, amount, everyone)
+            method, group_registered, group_unregistered, shares_data, items_data = split
+            expense = Expense(
+                description='Equivalence expense',
+                amount=amount,
+                date=BASE_DATE,
+                payer_id=rng.choice(everyone),
+                trip_id=trip.id
+            )
+            expense.update_split(method, group_registered, shares_data=shares_data, items_data=items_data,
+                                 unregistered_participants=group_unregistered)
+            db.session.add(expense)
+            split_cases.append((method, group_registered, group_unregistered, shares_data, items_data, amount))
+
+        db.session.commit()
+        return trip, split_cases
+
+
+def check_random_case(builder, candidate, timings, rng, registered, unregistered, expenses):
+    with quiet():
+        trip, split_cases = builder.build(rng, registered, unregistered, expenses)
+    differences = compare_trip(trip, candidate, timings)
+    for case in split_cases:
+        differences.extend(compare_split(case, candidate, timings))
+    return differences
+
+
+def run_random_cases(builder, candidate, timings, examples, seed):
+    """Check randomized trips; returns (cases run, differences of the first failing case)"""
+    failures = []
+    cases = [0]
+
+    def check(case_seed, registered, unregistered, expenses):
+        cases[0] += 1
+        differences = check_random_case(
+            builder, candidate, timings, random.Random(case_seed), registered, unregistered, expenses
+        )
+        if differences:
+            failures[:] = [dict(difference, case={'seed': case_seed, 'registered': registered,
+                                                  'unregistered': unregistered, 'expenses': expenses})
+                           for difference in differences]
+            raise AssertionError(f'{len(differences)} difference(s)')
+
+    if given is not None:
+        property_check = settings(
+            max_examples=examples,
+            deadline=None,
+            database=None,
+            derandomize=True,
+            suppress_health_check=list(HealthCheck)
+        )(given(
+            case_seed=st.integers(0, 2 ** 32 - 1),
+            registered=st.integers(2, 8),
+            unregistered=st.integers(0, 3),
+            expenses=st.integers(1, 40)
+        )(check))
+        try:
+            property_check()
+        except AssertionError:
+            # Hypothesis re-raises the shrunk example last, so failures holds its differences
+            pass
+        return cases[0], failures
+
+    rng = random.Random(seed)
+    for _ in range(examples):
+        try:
+            check(rng.randrange(2 ** 32), rng.randint(2, 8), rng.randint(0, 3), rng.randint(1, 40))
+        except AssertionError:
+            break
+    return cases[0], failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check a candidate balance engine against the current models.')
+    parser.add_argument('--candidate', default=DEFAULT_CANDIDATE, help='module:object of the candidate engine.')
+    parser.add_argument('--database', help='Existing benchmark database whose trips are compared as well.')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS),
+                        help='Generate this data set into the scratch database and compare its trips.')
+    parser.add_argument('--examples', type=int, default=100, help='Number of randomized trips.')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', '-o', help='Write the JSON report to this file.')
+    args = parser.parse_args(argv)
+
+    candidate = load_candidate(args.candidate)
+    timings = Timings()
+
+    scratch_path = None
+    database = args.database
+    if not database:
+        fd, scratch_path = tempfile.mkstemp(prefix='equivalence_', suffix='.db')
+        os.close(fd)
+        os.remove(scratch_path)
+        database = scratch_path
+
+    try:
+        app = create_bench_app(database)
+        if args.scenario:
+            trips, participants, expenses = SCENARIOS[args.scenario]
+            generate(app, seed=args.seed, trips=trips, participants=participants, expenses=expenses)
+
+        differences = []
+        with app.app_context():
+            db.create_all()
+
+            # Stored trips: generated scenario data or an existing benchmark database
+            stored_trips = [trip_id for (trip_id,) in db.session.query(Trip.id).order_by(Trip.id)]
+            for trip_id in stored_trips:
+                differences.extend(compare_trip(Trip.query.get(trip_id), candidate, timings))
+
+            with quiet():
+                builder = CaseBuilder()
+            case_count, failures = run_random_cases(builder, candidate, timings, args.examples, args.seed)
+            differences.extend(failures)
+
+        report = {
+            'candidate': args.candidate,
+            'engine': 'hypothesis' if given is not None else 'random',
+            'stored_trips': len(stored_trips),
+            'random_cases': case_count,
+            'differences': differences,
+            'timings': timings.summary(),
+        }
+    finally:
+        if scratch_path and os.path.exists(scratch_path):
+            os.remove(scratch_path)
+
+    print(f'Compared {report["stored_trips"]} stored trip(s) and {case_count} random trip(s) '
+          f'using {report["engine"]} generation', file=sys.stderr)
+    print(f'\n{"operation":<16} {"calls":>7} {"reference":>12} {"candidate":>12} {"speedup":>8}', file=sys.stderr)
+    for operation, totals in report['timings'].items():
+        speedup = f'{totals["speedup"]:.2f}x' if totals['speedup'] else '-'
+        print(f'{operation:<16} {totals["calls"]:>7} {totals["reference_ms"]:>10.1f}ms '
+              f'{totals["candidate_ms"]:>10.1f}ms {speedup:>8}', file=sys.stderr)
+
+    if differences:
+        print(f'\n{len(differences)} difference(s) above {TOLERANCE}:', file=sys.stderr)
+        for difference in differences[:20]:
+            print(f'  {difference}', file=sys.stderr)
+    else:
+        print(f'\nNo differences above {TOLERANCE}', file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+    return 1 if differences else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""
+Import-time budget check for the application entry point.
+
+Imports backend.app in fresh processes under ``python -X importtime``,
+parses the per-module timings and fails (exit status 1) when:
+
+- the cumulative import time of the entry point exceeds --max-import-ms,
+- more than --max-modules modules are imported, or
+- a module that must load lazily is imported at startup (ReportLab, the PDF
+  generator and report renderer, the export and analytics modules, pyarrow
+  and the profiler; see LAZY_MODULES)
+
+The report lists the slowest modules and the time per top-level package so
+a regression can be traced to the import that caused it.
+
+Usage:
+    python -m benchmarks.imports
+    python -m benchmarks.imports --max-import-ms 800 --max-modules 600 --top 30
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_POINT = 'backend.app'
+DEFAULT_IMPORT_BUDGET_MS = 1500
+DEFAULT_MODULE_BUDGET = 650
+
+# Modules only some routes need; importing them at startup is a regression
+LAZY_MODULES = (
+    'reportlab',
+    'pyarrow',
+    'pstats',
+    'backend.utils.pdf_generator',
+    'backend.utils.trip_report',
+    'backend.utils.export',
+    'backend.utils.analytics_export',
+    'backend.utils.profiler',
+)
+
+# "import time:       412 |       1530 |   backend.models.trip"
+_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)\s*$')
+
+
+def parse_importtime(stderr):
+    """[(module, self_us, cumulative_us, depth)] in the order -X importtime reports them"""
+    modules = []
+    for line in stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules.append((name, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return modules
+
+
+def measure_once(entry_point, env):
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {entry_point}'],
+        env=env, cwd=PROJECT_ROOT, check=True, capture_output=True, text=True
+    )
+    return parse_importtime(result.stderr)
+
+
+def summarize(modules, entry_point, top):
+    by_package = defaultdict(int)
+    for name, self_us, _, _ in modules:
+        by_package[name.split('.')[0]] += self_us
+    entry = [cumulative for name, _, cumulative, depth in modules if name == entry_point and depth == 0]
+    names = {name for name, _, _, _ in modules}
+    return {
+        'import_ms': round((entry[0] if entry else sum(m[1] for m in modules)) / 1000, 2),
+        'modules': len(names),
+        'lazy_violations': sorted(
+            module for module in LAZY_MODULES
+            if module in names or any(name.startswith(module + '.') for name in names)
+        ),
+        'slowest': [
+            {'module': name, 'self_ms': round(self_us / 1000, 2), 'cumulative_ms': round(cumulative_us / 1000, 2)}
+            for name, self_us, cumulative_us, _ in sorted(modules, key=lambda m: m[2], reverse=True)[:top]
+        ],
+        'packages_ms': {
+            package: round(total / 1000, 2)
+            for package, total in sorted(by_package.items(), key=lambda item: item[1], reverse=True)[:top]
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check the import time of the app entry point.')
+    parser.add_argument('--entry-point', default=ENTRY_POINT)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-import-ms', type=float, default=DEFAULT_IMPORT_BUDGET_MS)
+    parser.add_argument('--max-modules', type=int, default=DEFAULT_MODULE_BUDGET)
+    parser.add_argument('--top', type=int, default=15, help='Slowest modules and packages to report.')
+    parser.add_argument('--output', '-o', help='Write JSON results to this file (defaults to stdout).')
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = PROJECT_ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    # An untimed run writes the .pyc files, which a deployment ships precompiled
+    measure_once(args.entry_point, env)
+    runs = [summarize(measure_once(args.entry_point, env), args.entry_point, args.top) for _ in range(args.runs)]
+
+    # Report the median run, so one slow process does not decide the result
+    report = sorted(runs, key=lambda run: run['import_ms'])[len(runs) // 2]
+    report['import_ms_runs'] = [run['import_ms'] for run in runs]
+    report['import_ms_median'] = round(statistics.median(report['import_ms_runs']), 2)
+
+    failures = []
+    if report['import_ms_median'] > args.max_import_ms:
+        failures.append(f'import time {report["import_ms_median"]:.0f} ms > {args.max_import_ms:.0f} ms')
+    if report['modules'] > args.max_modules:
+        failures.append(f'{report["modules"]} modules > {args.max_modules}')
+    if report['lazy_violations']:
+        failures.append(f'imported at startup: {", ".join(report["lazy_violations"])}')
+    report['budgets'] = {'import_ms': args.max_import_ms, 'modules': args.max_modules}
+    report['failures'] = failures
+
+    print(f'{args.entry_point}: {report["import_ms_median"]:.0f} ms, {report["modules"]} modules', file=sys.stderr)
+    for item in report['slowest'][:5]:
+        print(f'  {item["cumulative_ms"]:>8.1f} ms  {item["module"]}', file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+    if failures:
+        print('FAILED: ' + '; '.join(failures), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""
+Benchmark suite for the ledger hot paths.
+
+Times balance and settlement calculation, the trip, expense and dashboard
+pages and APIs, and PDF rendering against a generated database. Results are
+written as JSON and can be compared against a stored baseline.
+
+With --memory, each benchmark also runs once under tracemalloc and records
+its peak allocation and top allocation sites; timing runs stay untraced.
+
+Usage:
+    python -m benchmarks.run --scenario medium --output results.json
+    python -m benchmarks.run --memory --only trip_settlements
+    python -m benchmarks.run --database bench.db --baseline baseline.json --fail-on-regression
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+# Allow running as a script from the project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.datagen import SCENARIOS, create_bench_app, generate, quiet
+from backend.database import db
+from backend.models.trip import Trip
+from backend.models.expense import Expense
+from backend.utils import memory_profiling
+from backend.utils.sql_instrumentation import count_queries
+
+DEFAULT_TOLERANCE = 0.2
+
+
+def _client_for(app, user_id):
+    """Test client logged in as the given user"""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    return client
+
+
+def _get(client, url):
+    response = client.get(url)
+    if response.status_code != 200:
+        raise RuntimeError(f'GET {url} returned {response.status_code}')
+    return response
+
+
+def build_benchmarks(app, trip_id):
+    """Return {name: callable} for the benchmarked operations on one trip"""
+    from backend.utils import trip_report
+
+    with app.app_context():
+        trip = Trip.query.get(trip_id)
+        admin_id = trip.admin_id
+
+    client = _client_for(app, admin_id)
+
+    def in_context(func):
+        def run():
+            with app.app_context():
+                try:
+                    return func(Trip.query.get(trip_id))
+                finally:
+                    db.session.remove()
+        return run
+
+    return {
+        'trip_balances': in_context(lambda trip: trip.recalculate_all_balances()),
+        'trip_settlements': in_context(lambda trip: trip.calculate_settlements()),
+        'settlement_pdf_render': in_context(trip_report.render_settlement_pdf),
+        'view_trip': lambda: _get(client, f'/trips/{trip_id}'),
+        'view_settlements': lambda: _get(client, f'/trips/{trip_id}/settlements'),
+        'list_expenses': lambda: _get(client, f'/expenses/{trip_id}/expenses'),
+        'dashboard': lambda: _get(client, '/dashboard'),
+        'api_dashboard_data': lambda: _get(client, f'/api/dashboard_data?trip_id={trip_id}'),
+        'api_spending_history': lambda: _get(client, '/api/spending_history'),
+        'api_all_months': lambda: _get(client, '/api/all_months'),
+    }
+
+
+def time_call(func, repeat, warmup=1):
+    """Run func warmup + repeat times and summarize the timed runs in milliseconds"""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {
+        'runs': repeat,
+        'min_ms': round(min(samples), 3),
+        'median_ms': round(statistics.median(samples), 3),
+        'mean_ms': round(statistics.mean(samples), 3),
+        'max_ms': round(max(samples), 3),
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(app, trip_id, repeat, only=None):
+    benchmarks = build_benchmarks(app, trip_id)
+    results = {}
+    for name, func in benchmarks.items():
+        if only and name not in only:
+            continue
+        with quiet():
+            results[name] = time_call(func, repeat)
+            with count_queries() as stats:
+                func()
+        results[name]['queries'] = stats.count
+        print(f'{name:<24} median {results[name]["median_ms"]:>10.2f} ms {stats.count:>6} queries', file=sys.stderr)
+    return results
+
+
+def measure_memory(app, trip_id, results, frames, only=None):
+    """Add peak memory and top allocation sites to results, one traced run per benchmark"""
+    benchmarks = build_benchmarks(app, trip_id)
+    memory_profiling.start_tracing(frames)
+    try:
+        for name, func in benchmarks.items():
+            if only and name not in only:
+                continue
+            with quiet(), memory_profiling.measure('benchmark', name, snapshot=True) as sample:
+                func()
+            results[name]['peak_kb'] = round(sample.peak_bytes / 1024, 1)
+            results[name]['top_sites'] = sample.top_sites
+            print(f'{name:<24} peak {results[name]["peak_kb"]:>10.1f} KiB', file=sys.stderr)
+    finally:
+        tracemalloc.stop()
+
+
+def compare(results, baseline, tolerance):
+    """Compare medians against a baseline; returns a list of regression descriptions"""
+    regressions = []
+    print(f'\n{"benchmark":<24} {"baseline":>12} {"current":>12} {"change":>8}', file=sys.stderr)
+    for name, current in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous:
+            print(f'{name:<24} {"-":>12} {current["median_ms"]:>10.2f}ms {"new":>8}', file=sys.stderr)
+            continue
+        ratio = current['median_ms'] / previous['median_ms'] if previous['median_ms'] else 1.0
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = '  REGRESSION'
+            regressions.append(f'{name}: {previous["median_ms"]:.2f}ms -> {current["median_ms"]:.2f}ms ({ratio:.2f}x)')
+        print(
+            f'{name:<24} {previous["median_ms"]:>10.2f}ms {current["median_ms"]:>10.2f}ms {ratio - 1:>+7.0%}{flag}',
+            file=sys.stderr
+        )
+    return regressions
+
+
+def _largest_trip(app):
+    with app.app_context():
+        row = db.session.query(Expense.trip_id, db.func.count(Expense.id)).group_by(
+            Expense.trip_id
+        ).order_by(db.func.count(Expense.id).desc()).first()
+        if row is None:
+            raise SystemExit('The benchmark database has no expenses')
+        return row[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark ledger hot paths.')
+    parser.add_argument('--database', help='Existing benchmark database (file path or URL). '
+                                           'Without it, data is generated into a temporary SQLite file.')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='small')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--trip-id', type=int, help='Trip to benchmark (defaults to the one with most expenses).')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', action='append', help='Run only this benchmark (repeatable).')
+    parser.add_argument('--output', '-o', help='Write JSON results to this file (defaults to stdout).')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against.')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Allowed slowdown of the median before it counts as a regression.')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    parser.add_argument('--memory', action='store_true',
+                        help='Also record peak memory and top allocation sites of each benchmark.')
+    parser.add_argument('--memory-frames', type=int, default=5,
+                        help='Stack frames tracemalloc keeps per allocation with --memory.')
+    args = parser.parse_args(argv)
+
+    scratch_path = None
+    database = args.database
+    if not database:
+        fd, scratch_path = tempfile.mkstemp(prefix='bench_', suffix='.db')
+        os.close(fd)
+        os.remove(scratch_path)
+        database = scratch_path
+
+    try:
+        app = create_bench_app(database)
+        generated = None
+        if scratch_path:
+            trips, participants, expenses = SCENARIOS[args.scenario]
+            print(f'Generating {args.scenario} data set...', file=sys.stderr)
+            generated = generate(app, seed=args.seed, trips=trips, participants=participants, expenses=expenses)
+
+        trip_id = args.trip_id or _largest_trip(app)
+        results = run_benchmarks(app, trip_id, args.repeat, args.only)
+        if args.memory:
+            measure_memory(app, trip_id, results, args.memory_frames, args.only)
+
+        report = {
+            'meta': {
+                'timestamp': datetime.utcnow().isoformat(),
+                'git_revision': _git_revision(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'scenario': args.scenario if scratch_path else None,
+                'database': None if scratch_path else database,
+                'seed': args.seed,
+                'trip_id': trip_id,
+                'repeat': args.repeat,
+                'data': generated,
+            },
+            'results': results,
+        }
+
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+        else:
+            json.dump(report, sys.stdout, indent=2)
+            sys.stdout.write('\n')
+
+        if args.baseline:
+            with open(args.baseline) as f:
+                regressions = compare(results, json.load(f), args.tolerance)
+            if regressions:
+                print('\nRegressions:\n  ' + '\n  '.join(regressions), file=sys.stderr)
+                if args.fail_on_regression:
+                    return 1
+        return 0
+    finally:
+        if scratch_path and os.path.exists(scratch_path):
+            os.remove(scratch_path)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""
+Cold start time of the application, as a serverless instance sees it.
+
+Each run starts a fresh Python process that imports backend.app (which
+builds the app, like the vercel.json entry point) and then serves its first
+and second request through the test client. The medians are compared
+against budgets and the command exits with status 1 when one is exceeded.
+
+With --template-cache, templates are first precompiled into a Jinja
+bytecode cache (see backend.utils.template_cache) that every run loads.
+
+Usage:
+    python -m benchmarks.startup --runs 5
+    python -m benchmarks.startup --template-cache /tmp/templates --max-first-request-ms 150
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_IMPORT_BUDGET_MS = 1500
+DEFAULT_FIRST_REQUEST_BUDGET_MS = 300
+
+# Runs in the child process; prints one JSON line of timings
+_CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import backend.app
+imported = time.perf_counter()
+client = backend.app.app.test_client()
+status = client.get(sys.argv[1]).status_code
+first = time.perf_counter()
+client.get(sys.argv[1])
+second = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_request_ms': (first - imported) * 1000,
+    'second_request_ms': (second - first) * 1000,
+    'status': status,
+    'modules': len(sys.modules),
+}))
+"""
+
+
+def _child_env(database, template_cache):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = PROJECT_ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    env['DATABASE_URL'] = 'sqlite:///' + database
+    if template_cache:
+        env['TEMPLATE_CACHE_DIR'] = template_cache
+    else:
+        env.pop('TEMPLATE_CACHE_DIR', None)
+    return env
+
+
+def measure_once(path, env):
+    output = subprocess.run(
+        [sys.executable, '-c', _CHILD, path], env=env, cwd=PROJECT_ROOT,
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def precompile_templates(env):
+    subprocess.run(
+        [sys.executable, '-m', 'flask', 'templates', 'compile'],
+        env=dict(env, FLASK_APP='backend.app'), cwd=PROJECT_ROOT, check=True
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure cold start import and first-request time.')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/login', help='Path of the first request.')
+    parser.add_argument('--template-cache', help='Precompile templates into this directory and load them from it.')
+    parser.add_argument('--max-import-ms', type=float, default=DEFAULT_IMPORT_BUDGET_MS)
+    parser.add_argument('--max-first-request-ms', type=float, default=DEFAULT_FIRST_REQUEST_BUDGET_MS)
+    parser.add_argument('--output', '-o', help='Write JSON results to this file (defaults to stdout).')
+    args = parser.parse_args(argv)
+
+    fd, database = tempfile.mkstemp(prefix='bench_startup_', suffix='.db')
+    os.close(fd)
+    try:
+        env = _child_env(database, args.template_cache)
+        if args.template_cache:
+            precompile_templates(env)
+        # An untimed run writes the .pyc files, which a deployment ships precompiled
+        measure_once(args.path, env)
+        runs = [measure_once(args.path, env) for _ in range(args.runs)]
+    finally:
+        os.remove(database)
+
+    summary = {
+        key: round(statistics.median(run[key] for run in runs), 2)
+        for key in ('import_ms', 'first_request_ms', 'second_request_ms', 'modules')
+    }
+    budgets = {'import_ms': args.max_import_ms, 'first_request_ms': args.max_first_request_ms}
+    over_budget = [key for key, budget in budgets.items() if summary[key] > budget]
+    report = {
+        'path': args.path,
+        'template_cache': bool(args.template_cache),
+        'median': summary,
+        'budgets_ms': budgets,
+        'over_budget': over_budget,
+        'runs': runs,
+    }
+
+    print(
+        f'import {summary["import_ms"]:.0f} ms (budget {args.max_import_ms:.0f}), '
+        f'first request {summary["first_request_ms"]:.0f} ms (budget {args.max_first_request_ms:.0f}), '
+        f'second request {summary["second_request_ms"]:.0f} ms, {summary["modules"]:.0f} modules',
+        file=sys.stderr
+    )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+    if over_budget:
+        print(f'Over budget: {", ".join(over_budget)}', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
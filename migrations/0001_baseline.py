@@ -0,0 +1,66 @@
+"""
+Baseline schema: user, trip, expense and unregistered_participant tables
+
+The tables are written out as they were before the later migrations, so
+this file keeps describing the same schema while the models change.
+"""
+from sqlalchemy import Boolean, Column, DateTime, Float, ForeignKey, Integer, MetaData, String, Table, Text
+from backend.utils.migrations import create_tables
+
+metadata = MetaData()
+
+user = Table(
+    'user', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('email', String(120), nullable=False, unique=True, index=True),
+    Column('name', String(100), nullable=False),
+    Column('password_hash', String(128)),
+    Column('created_at', DateTime),
+    Column('last_seen', DateTime),
+    Column('is_admin', Boolean),
+    Column('linked_unregistered_names', Text, nullable=False),
+)
+
+trip = Table(
+    'trip', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', String(100), nullable=False),
+    Column('description', Text),
+    Column('start_date', DateTime, nullable=False),
+    Column('end_date', DateTime, nullable=False),
+    Column('created_at', DateTime),
+    Column('updated_at', DateTime),
+    Column('admin_id', Integer, ForeignKey('user.id'), nullable=False),
+    Column('participants', Text, nullable=False),
+)
+
+expense = Table(
+    'expense', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('description', String(200), nullable=False),
+    Column('amount', Float, nullable=False),
+    Column('currency', String(3)),
+    Column('category', String(50)),
+    Column('date', DateTime),
+    Column('created_at', DateTime),
+    Column('updated_at', DateTime),
+    Column('split_method', String(20)),
+    Column('payer_id', String(100), nullable=False),
+    Column('trip_id', Integer, ForeignKey('trip.id'), nullable=False),
+    Column('participants', Text, nullable=False),
+    Column('shares', Text, nullable=False),
+    Column('items', Text),
+)
+
+unregistered_participant = Table(
+    'unregistered_participant', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', String(100), nullable=False),
+    Column('trip_id', Integer, ForeignKey('trip.id'), nullable=False),
+    Column('linked_user_id', Integer, ForeignKey('user.id')),
+    Column('created_at', DateTime),
+)
+
+
+def upgrade(connection):
+    create_tables(connection, user, trip, expense, unregistered_participant)
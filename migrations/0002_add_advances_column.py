@@ -0,0 +1,8 @@
+"""
+Add the advances_json column to the trip table
+"""
+from backend.utils.migrations import add_column
+
+
+def upgrade(connection):
+    add_column(connection, 'trip', 'advances_json', "TEXT DEFAULT '{}'")
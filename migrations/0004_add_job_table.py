@@ -0,0 +1,37 @@
+"""
+Add the job table used by the background job queue
+"""
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, MetaData, String, Table, Text
+from backend.utils.migrations import create_tables
+
+metadata = MetaData()
+
+# Referenced tables are declared so the foreign keys resolve; only job is created
+Table('trip', metadata, Column('id', Integer, primary_key=True))
+Table('user', metadata, Column('id', Integer, primary_key=True))
+
+job = Table(
+    'job', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('job_type', String(50), nullable=False, index=True),
+    Column('trip_id', Integer, ForeignKey('trip.id'), index=True),
+    Column('user_id', Integer, ForeignKey('user.id')),
+    Column('payload_json', Text),
+    Column('status', String(20), nullable=False, index=True),
+    Column('progress', Integer, nullable=False),
+    Column('message', Text),
+    Column('result_json', Text),
+    Column('attempts', Integer, nullable=False),
+    Column('max_attempts', Integer, nullable=False),
+    Column('run_after', DateTime, index=True),
+    Column('dedup_key', String(200), unique=True),
+    Column('worker_id', String(100)),
+    Column('started_at', DateTime),
+    Column('finished_at', DateTime),
+    Column('created_at', DateTime),
+    Column('updated_at', DateTime),
+)
+
+
+def upgrade(connection):
+    create_tables(connection, job)
@@ -0,0 +1,31 @@
+"""
+Normalize empty JSON columns (NULL, '' and 'null') to empty lists and objects
+
+The schema is unchanged. The rows are rewritten online by the backfills
+below: flask db backfill normalize_trip_json (and _expense_json, _user_json).
+"""
+from backend.utils.backfill import Backfill
+
+EMPTY_VALUES = (None, '', 'null')
+
+
+def _normalizer(defaults):
+    def transform(row):
+        changes = {name: empty for name, empty in defaults.items() if row[name] in EMPTY_VALUES}
+        return changes or None
+    return transform
+
+
+TRIP_DEFAULTS = {'participants': '[]', 'advances_json': '{}', 'general_payments_json': '[]'}
+EXPENSE_DEFAULTS = {'participants': '[]', 'shares': '{}', 'items': '[]'}
+USER_DEFAULTS = {'linked_unregistered_names': '[]'}
+
+BACKFILLS = [
+    Backfill('normalize_trip_json', 'trip', TRIP_DEFAULTS, _normalizer(TRIP_DEFAULTS)),
+    Backfill('normalize_expense_json', 'expense', EXPENSE_DEFAULTS, _normalizer(EXPENSE_DEFAULTS)),
+    Backfill('normalize_user_json', 'user', USER_DEFAULTS, _normalizer(USER_DEFAULTS)),
+]
+
+
+def upgrade(connection):
+    pass
@@ -0,0 +1,60 @@
+"""
+Add the trip_member table indexing which users can open which trip
+
+Existing trips are indexed from their admin_id and participants JSON. The
+app keeps the rows in step from then on (see Trip.sync_members).
+"""
+import json
+from sqlalchemy import Column, ForeignKey, Integer, MetaData, String, Table, Text, select
+from backend.utils.migrations import create_tables
+
+metadata = MetaData()
+
+# Referenced tables are declared so the foreign keys resolve; only trip_member is created
+trip = Table(
+    'trip', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('admin_id', Integer),
+    Column('participants', Text),
+)
+Table('user', metadata, Column('id', Integer, primary_key=True))
+
+trip_member = Table(
+    'trip_member', metadata,
+    Column('trip_id', Integer, ForeignKey('trip.id'), primary_key=True),
+    Column('user_id', Integer, ForeignKey('user.id'), primary_key=True, index=True),
+    Column('role', String(20), nullable=False),
+)
+
+BATCH_SIZE = 1000
+
+
+def _member_roles(admin_id, participants):
+    roles = {admin_id: 'admin'} if admin_id is not None else {}
+    try:
+        participant_ids = json.loads(participants or '[]') or []
+    except ValueError:
+        participant_ids = []
+    for participant_id in participant_ids:
+        if str(participant_id).isdigit():
+            roles.setdefault(int(participant_id), 'participant')
+    return roles
+
+
+def upgrade(connection):
+    create_tables(connection, trip_member)
+
+    # Databases created with db.create_all() already have the (empty) table
+    existing = {(row.trip_id, row.user_id) for row in connection.execute(
+        select(trip_member.c.trip_id, trip_member.c.user_id)
+    )}
+    rows = []
+    for row in connection.execute(select(trip.c.id, trip.c.admin_id, trip.c.participants)).fetchall():
+        for user_id, role in _member_roles(row.admin_id, row.participants).items():
+            if (row.id, user_id) not in existing:
+                rows.append({'trip_id': row.id, 'user_id': user_id, 'role': role})
+        if len(rows) >= BATCH_SIZE:
+            connection.execute(trip_member.insert(), rows)
+            rows = []
+    if rows:
+        connection.execute(trip_member.insert(), rows)
@@ -0,0 +1,11 @@
+"""
+Add the version columns used for optimistic concurrency on trip and expense
+
+Existing rows start at version 1.
+"""
+from backend.utils.migrations import add_column
+
+
+def upgrade(connection):
+    add_column(connection, 'trip', 'version', 'INTEGER NOT NULL DEFAULT 1')
+    add_column(connection, 'expense', 'version', 'INTEGER NOT NULL DEFAULT 1')
@@ -0,0 +1,31 @@
+"""
+Add the idempotency_key table storing responses of retried POSTs
+"""
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, LargeBinary, MetaData, String, Table, Text, UniqueConstraint
+from backend.utils.migrations import create_tables
+
+metadata = MetaData()
+
+# Referenced tables are declared so the foreign keys resolve; only idempotency_key is created
+Table('user', metadata, Column('id', Integer, primary_key=True))
+
+idempotency_key = Table(
+    'idempotency_key', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('key', String(100), nullable=False),
+    Column('user_id', Integer, ForeignKey('user.id'), nullable=False),
+    Column('endpoint', String(100), nullable=False),
+    Column('fingerprint', String(64), nullable=False),
+    Column('status', String(20), nullable=False),
+    Column('response_status', Integer),
+    Column('response_location', Text),
+    Column('response_mimetype', String(100)),
+    Column('response_body', LargeBinary),
+    Column('created_at', DateTime),
+    Column('expires_at', DateTime, nullable=False, index=True),
+    UniqueConstraint('user_id', 'key', name='uq_idempotency_key_user_key'),
+)
+
+
+def upgrade(connection):
+    create_tables(connection, idempotency_key)
@@ -0,0 +1,24 @@
+"""
+Add the change_log table behind the delta sync API
+
+Changes are logged from this migration on; clients start with a snapshot.
+"""
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table
+from backend.utils.migrations import create_tables
+
+metadata = MetaData()
+
+change_log = Table(
+    'change_log', metadata,
+    Column('seq', Integer, primary_key=True),
+    Column('table_name', String(50), nullable=False),
+    Column('row_id', Integer, nullable=False),
+    Column('trip_id', Integer),
+    Column('op', String(10), nullable=False),
+    Column('changed_at', DateTime, nullable=False),
+    Index('ix_change_log_trip_seq', 'trip_id', 'seq'),
+)
+
+
+def upgrade(connection):
+    create_tables(connection, change_log)
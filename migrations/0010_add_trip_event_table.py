@@ -0,0 +1,21 @@
+"""
+Add the trip_event table used by the database broker of live trip updates
+"""
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table, Text
+from backend.utils.migrations import create_tables
+
+metadata = MetaData()
+
+trip_event = Table(
+    'trip_event', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('trip_id', Integer, nullable=False),
+    Column('event_type', String(30), nullable=False),
+    Column('data', Text, nullable=False),
+    Column('created_at', DateTime, nullable=False, index=True),
+    Index('ix_trip_event_trip_id', 'trip_id', 'id'),
+)
+
+
+def upgrade(connection):
+    create_tables(connection, trip_event)